@@ -0,0 +1,112 @@
+"""
+Micro-benchmark of request parsing on the built-in server
+
+Counts receive syscalls and measures parse time per request,
+for the buffered ``HTTPSocketIO`` against the former byte-at-a-time reader.
+
+Usage:
+    $ python -m benchmarks.bench_http_parser
+"""
+
+import time
+import socket
+import threading
+
+from webgo.servers.server import Server, HTTPSocketIO, InputStream
+from webgo.wsgirequest import Request
+
+HEAD = (
+    b'POST /form HTTP/1.1\r\n'
+    b'Host: localhost:8080\r\n'
+    b'User-Agent: Mozilla/5.0 (X11; Linux x86_64) Gecko/20100101 Firefox/115.0\r\n'
+    b'Accept: text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8\r\n'
+    b'Accept-Language: en-US,en;q=0.5\r\n'
+    b'Accept-Encoding: gzip, deflate, br\r\n'
+    b'Content-Type: application/octet-stream\r\n'
+    b'Content-Length: %d\r\n'
+    b'Connection: keep-alive\r\n'
+    b'\r\n'
+)
+
+
+class CountingSocket:
+    """ Proxy counting the receive calls made on a socket """
+    def __init__(self, sock):
+        self._sock = sock
+        self.calls = 0
+
+    def recv(self, *args):
+        self.calls += 1
+        return self._sock.recv(*args)
+
+    def recv_into(self, *args):
+        self.calls += 1
+        return self._sock.recv_into(*args)
+
+    def __getattr__(self, name):
+        return getattr(self._sock, name)
+
+
+def legacy_parse(conn):
+    """ The former reader: one recv(1) per header byte, one read(1) per body byte """
+    def readline():
+        line = []
+        while not line or (line[-1] != b'\n' and line[-1] != b''):
+            line.append(conn.recv(1))
+        return b''.join(line)
+
+    content_length = 0
+    readline()
+    while (header := readline()) not in (b'\r\n', b'\n', b''):
+        key, value = header.decode('iso-8859-1').split(':', 1)
+        if key == 'Content-Length':
+            content_length = int(value)
+    body = b''
+    for _ in range(content_length):
+        body += conn.recv(1)
+    return body
+
+
+def buffered_parse(conn):
+    http_io = HTTPSocketIO(conn)
+    environ = Server.build_environ(http_io.read_head())
+    environ['wsgi.input'] = InputStream(http_io, environ['CONTENT_LENGTH'])
+    return Request(environ).buffer
+
+
+def run(parse, body_size, rounds):
+    payload = HEAD % body_size + b'x' * body_size
+    calls = 0
+    elapsed = 0.0
+    for _ in range(rounds):
+        reader, writer = socket.socketpair()
+        sender = threading.Thread(target=writer.sendall, args=(payload,))
+        sender.start()
+        conn = CountingSocket(reader)
+        start = time.perf_counter()
+        body = parse(conn)
+        elapsed += time.perf_counter() - start
+        sender.join()
+        assert len(body) == body_size
+        calls += conn.calls
+        reader.close()
+        writer.close()
+    return calls / rounds, elapsed / rounds * 1e6
+
+
+def main():
+    cases = [
+        ('empty body', 0, 200),
+        ('1 KB body', 1024, 200),
+        ('64 KB body', 64 * 1024, 20),
+        ('1 MB body', 1024 * 1024, 1),
+    ]
+    print(f"{'request':<12} {'parser':<10} {'recv calls':>12} {'us/request':>14}")
+    for name, size, rounds in cases:
+        for label, parse in (('legacy', legacy_parse), ('buffered', buffered_parse)):
+            calls, usec = run(parse, size, rounds)
+            print(f"{name:<12} {label:<10} {calls:>12.0f} {usec:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+Benchmark of ORM writes
+
+Measures single-record operations (insert, get, update, delete) in ops/sec,
+the time and memory to load a large set, then compares saving records one ``save`` at a time with ``bulk_create``,
+updating them with ``bulk_update`` and a set-level ``update``,
+and summing a column of the records in Python and with ``aggregate``.
+
+``--compare REV`` runs the single-record operations against the ``webgo``
+package of another git revision as well, e.g. the one before statements
+were precompiled, and prints both measures side by side.
+
+Usage:
+    $ python -m benchmarks.bench_orm [records]
+    $ python -m benchmarks.bench_orm --compare REV
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import logging
+import tempfile
+import tracemalloc
+
+from webgo import config
+from webgo import orm
+
+RECORDS = 100000
+SAVES = 2000
+OPS = 5000
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Item(orm.Model):
+    name = orm.TextField()
+    price = orm.IntegerField()
+
+
+def bench(label, func, n):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<20} {n:>8} records {elapsed:>8.3f} s {n / elapsed:>12.0f} records/s")
+
+
+def bench_ops(label, func, n, quiet=False):
+    start = time.perf_counter()
+    for i in range(n):
+        func(i)
+    rate = n / (time.perf_counter() - start)
+    if not quiet:
+        print(f"{label:<20} {rate:>12.0f} ops/s")
+    return rate
+
+
+def single_record_ops(quiet=False):
+    """ Return the ops/s of inserting, getting, updating and deleting records one at a time """
+    items = []
+    return {
+        'insert': bench_ops('insert', lambda i: items.append(Item(name=f'item{i}', price=i)) or items[-1].save(),
+                            OPS, quiet),
+        'get': bench_ops('get', lambda i: Item.objects.get(pk=items[i].pk), OPS, quiet),
+        'update': bench_ops('update', lambda i: items[i].save(), OPS, quiet),
+        'delete': bench_ops('delete', lambda i: items[i].delete(), OPS, quiet),
+    }
+
+
+def run_ops(path):
+    """ Measure the single-record operations with the ``webgo`` package found in ``path`` """
+    env = dict(os.environ, PYTHONPATH=path)
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--ops'],
+        env=env, cwd=path, check=True, stdout=subprocess.PIPE,
+    ).stdout
+    return json.loads(output)
+
+
+def compare(rev):
+    """ Print the single-record operations of revision ``rev`` next to the working tree's """
+    with tempfile.TemporaryDirectory() as tmp:
+        archive = subprocess.run(
+            ['git', 'archive', rev, 'webgo'], cwd=ROOT, check=True, stdout=subprocess.PIPE,
+        ).stdout
+        subprocess.run(['tar', '-x', '-C', tmp], input=archive, check=True)
+        before = run_ops(tmp)
+    after = run_ops(ROOT)
+    print(f"{'':<20} {rev:>12} {'working tree':>14}")
+    for op in before:
+        print(f"{op:<20} {before[op]:>12.0f} {after[op]:>14.0f} ops/s {after[op] / before[op]:>6.2f}x")
+
+
+def load_records():
+    start = time.perf_counter()
+    loaded = len(Item.objects.query())
+    elapsed = time.perf_counter() - start
+    # Measured apart, tracing slows allocations down
+    tracemalloc.start()
+    records = Item.objects.query()._fetch()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del records
+    print(f"{'load':<20} {loaded:>8} records {elapsed:>8.3f} s {size / loaded:>9.0f} bytes/record")
+
+
+def sum_prices():
+    bench('sum() of records', lambda: sum(item.price for item in Item.objects.query()), Item.objects.count())
+    bench('aggregate(Sum())', lambda: Item.objects.aggregate(orm.Sum('price')), Item.objects.count())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('records', type=int, nargs='?', default=RECORDS)
+    parser.add_argument('--compare', metavar='REV',
+                        help='measure the single-record operations of this git revision as well')
+    # Run by --compare, in a process importing the package to measure
+    parser.add_argument('--ops', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+    if args.compare:
+        compare(args.compare)
+        return
+    n = args.records
+    with tempfile.TemporaryDirectory() as tmp:
+        config.DB_FILE = os.path.join(tmp, 'bench.db')
+        Item.create_table()
+        if args.ops:
+            print(json.dumps(single_record_ops(quiet=True)))
+            return
+        single_record_ops()
+
+        def save_each():
+            for i in range(SAVES):
+                Item(name=f'item{i}', price=i).save()
+
+        items = [Item(name=f'item{i}', price=i) for i in range(n)]
+
+        def update_each():
+            for item in items[:SAVES]:
+                item.save()
+
+        bench('save()', save_each, SAVES)
+        bench('bulk_create()', lambda: Item.objects.bulk_create(items), n)
+        for item in items:
+            item.price += 1
+        bench('save() updates', update_each, SAVES)
+        bench('bulk_update()', lambda: Item.objects.bulk_update(items, ['price']), n)
+        bench('objects.update()', lambda: Item.objects.update(price=0), n + SAVES)
+        load_records()
+        sum_prices()
+        orm.close_pools()
+
+
+if __name__ == '__main__':
+    main()
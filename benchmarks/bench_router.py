@@ -0,0 +1,78 @@
+"""
+Benchmark of route lookup across a large route table
+
+Compares the compiled ``Router`` with scanning a list of regular expressions,
+which is what path parameters took before it.
+
+Usage:
+    $ python -m benchmarks.bench_router
+"""
+
+import re
+import time
+import random
+
+from webgo.routing import Router
+
+ROUTES = 2000
+LOOKUPS = 20000
+
+
+def make_templates(n):
+    templates = []
+    for i in range(n):
+        kind = i % 4
+        if kind == 0:
+            templates.append(f'/api/v1/resource{i}')
+        elif kind == 1:
+            templates.append(f'/api/v1/resource{i}/<int:id>')
+        elif kind == 2:
+            templates.append(f'/api/v1/resource{i}/<int:id>/items/<name>')
+        else:
+            templates.append(f'/files{i}/<path:rest>')
+    return templates
+
+
+def sample_path(template):
+    return (template.replace('<int:id>', '12345')
+                    .replace('<name>', 'widget')
+                    .replace('<path:rest>', 'a/b/c.css'))
+
+
+def compile_regex(template):
+    pattern = re.sub(r'<int:(\w+)>', r'(?P<\1>\\d+)', template)
+    pattern = re.sub(r'<path:(\w+)>', r'(?P<\1>.*)', pattern)
+    pattern = re.sub(r'(?<!\?P)<(\w+)>', r'(?P<\1>[^/]+)', pattern)
+    return re.compile(f'^{pattern}$')
+
+
+def bench(label, lookup, paths):
+    start = time.perf_counter()
+    for path in paths:
+        lookup(path)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<16} {elapsed / len(paths) * 1e6:>10.2f} us/lookup")
+
+
+def main():
+    templates = make_templates(ROUTES)
+    paths = [sample_path(random.choice(templates)) for _ in range(LOOKUPS)]
+
+    router = Router()
+    for i, template in enumerate(templates):
+        router.add('GET', template, i)
+
+    regexes = [(compile_regex(t), i) for i, t in enumerate(templates)]
+
+    def regex_lookup(path):
+        for regex, handler in regexes:
+            if m := regex.match(path):
+                return handler, m.groupdict()
+
+    print(f"{ROUTES} routes, {LOOKUPS} lookups")
+    bench('regex scan', regex_lookup, paths[:LOOKUPS // 20])
+    bench('Router', lambda path: router.match('GET', path), paths)
+
+
+if __name__ == '__main__':
+    main()
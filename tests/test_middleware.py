@@ -0,0 +1,405 @@
+"""
+Usage:
+    $ python -m unittest tests/test_middleware.py
+"""
+
+import os
+import gzip
+import zlib
+import time
+import logging
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+from webgo.handler import get
+from webgo.webgoapp import Application
+from webgo.wsgirequest import Request, Response, is_not_modified
+from webgo.middleware import ResponseCache, MemoryCacheBackend, SQLiteCacheBackend, CacheEntry, Compress
+
+logging.disable(logging.CRITICAL)
+
+
+def make_environ(path='/', method='GET', query='', **headers):
+    environ = {'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': query}
+    for name, value in headers.items():
+        environ[f'HTTP_{name.upper()}'] = value
+    return environ
+
+
+class CountingApp:
+    """ Answers its path and the number of calls, with ``headers`` """
+    def __init__(self, headers=(), delay=0):
+        self.headers = list(headers)
+        self.delay = delay
+        self.calls = 0
+
+    def __call__(self, environ, start_response):
+        self.calls += 1
+        time.sleep(self.delay)
+        start_response('200 OK', [('Content-Type', 'text/plain'), *self.headers])
+        return [f"{environ['PATH_INFO']} {self.calls}".encode()]
+
+
+def call(app, environ):
+    response = []
+
+    def start_response(status, headers, exc_info=None):
+        response[:] = [status, headers]
+
+    body = b''.join(app(environ, start_response))
+    return response[0], dict(response[1]), body
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def test_hit(self):
+        app = CountingApp()
+        cache = ResponseCache(app, ttl=60)
+        self.assertEqual(call(cache, make_environ())[2], b'/ 1')
+        status, headers, body = call(cache, make_environ())
+        self.assertEqual((status, body), ('200 OK', b'/ 1'))
+        self.assertEqual(headers['Content-Length'], '3')
+        self.assertEqual(app.calls, 1)
+        self.assertEqual(cache.stats(), {'entries': 1, 'hits': 1, 'misses': 1, 'stale': 0})
+
+    def test_key(self):
+        app = CountingApp()
+        cache = ResponseCache(app, ttl=60)
+        call(cache, make_environ(query='page=1'))
+        call(cache, make_environ(query='page=2'))
+        call(cache, make_environ(query='page=1', accept_encoding='gzip'))
+        call(cache, make_environ(query='page=1', user_agent='curl'))
+        self.assertEqual(app.calls, 3)
+
+    def test_ttl(self):
+        app = CountingApp(headers=[('Cache-Control', 'max-age=60')])
+        cache = ResponseCache(app, routes={'/api/': 0, '/api/slow': 30})
+        for path in ('/', '/', '/api/', '/api/', '/api/slow', '/api/slow'):
+            call(cache, make_environ(path))
+        self.assertEqual(app.calls, 4)
+
+        # Without max-age nor a default TTL, nothing is kept
+        app = CountingApp()
+        cache = ResponseCache(app)
+        call(cache, make_environ())
+        call(cache, make_environ())
+        self.assertEqual(app.calls, 2)
+
+    def test_expired(self):
+        app = CountingApp()
+        cache = ResponseCache(app, ttl=60)
+        call(cache, make_environ())
+        cache.backend.get(cache.key(make_environ())).expires = 0
+        self.assertEqual(call(cache, make_environ())[2], b'/ 2')
+
+    def test_not_cached(self):
+        for headers in (
+                [('Cache-Control', 'no-store')],
+                [('Cache-Control', 'private, max-age=60')],
+                [('Set-Cookie', 'session=1')],
+                [('Vary', 'Cookie')],
+        ):
+            app = CountingApp(headers)
+            cache = ResponseCache(app, ttl=60)
+            call(cache, make_environ())
+            call(cache, make_environ())
+            self.assertEqual(app.calls, 2, headers)
+
+        app = CountingApp()
+        cache = ResponseCache(app, ttl=60)
+        call(cache, make_environ(method='POST'))
+        call(cache, make_environ(method='POST'))
+        self.assertEqual(app.calls, 2)
+
+    def test_streamed(self):
+        produced = []
+
+        def pieces():
+            for i in range(3):
+                produced.append(i)
+                yield b'x' * 10
+
+        def app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return pieces()
+
+        cache = ResponseCache(app, ttl=60)
+        result = cache(make_environ(), lambda status, headers, exc_info=None: None)
+        # Nothing is read before the server iterates it
+        self.assertEqual(produced, [])
+        self.assertEqual(b''.join(result), b'x' * 30)
+        self.assertEqual(len(cache.backend), 0)
+
+    def test_too_large(self):
+        app = CountingApp(headers=[('Content-Length', '3')])
+        cache = ResponseCache(app, ttl=60, max_entry_size=2)
+        call(cache, make_environ())
+        self.assertEqual(call(cache, make_environ())[2], b'/ 2')
+
+        # Longer than its Content-Length, the body is sent whole and not kept
+        app = CountingApp(headers=[('Content-Length', '1')])
+        cache = ResponseCache(app, ttl=60, max_entry_size=2)
+        self.assertEqual(call(cache, make_environ())[2], b'/ 1')
+        self.assertEqual(len(cache.backend), 0)
+
+    def test_credentials(self):
+        for headers in ({'authorization': 'Basic YTpi'}, {'cookie': 'session=1'}):
+            app = CountingApp()
+            cache = ResponseCache(app, ttl=60)
+            call(cache, make_environ())
+            # Neither answered from the cache, nor kept for others
+            self.assertEqual(call(cache, make_environ(**headers))[2], b'/ 2')
+            self.assertEqual(call(cache, make_environ(**headers))[2], b'/ 3')
+            self.assertEqual(call(cache, make_environ())[2], b'/ 1')
+
+        app = CountingApp(headers=[('Cache-Control', 'public, max-age=60')])
+        cache = ResponseCache(app)
+        call(cache, make_environ(cookie='session=1'))
+        self.assertEqual(call(cache, make_environ())[2], b'/ 1')
+
+    def test_stampede(self):
+        app = CountingApp(delay=0.2)
+        cache = ResponseCache(app, ttl=60)
+        bodies = []
+        threads = [
+            threading.Thread(target=lambda: bodies.append(call(cache, make_environ())[2]))
+            for _ in range(10)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(app.calls, 1)
+        self.assertEqual(bodies, [b'/ 1'] * 10)
+
+    def test_uncacheable_not_coalesced(self):
+        def burst(cache):
+            threads = [threading.Thread(target=call, args=(cache, make_environ())) for _ in range(4)]
+            start = time.monotonic()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            return time.monotonic() - start
+
+        # Without a TTL, nor a max-age, once it's known
+        cache = ResponseCache(CountingApp(delay=0.2))
+        call(cache, make_environ())
+        self.assertLess(burst(cache), 0.35)
+
+        # Not kept the last time
+        cache = ResponseCache(CountingApp([('Set-Cookie', 'session=1')], delay=0.2), ttl=60)
+        call(cache, make_environ())
+        self.assertLess(burst(cache), 0.35)
+
+    def test_stampede_max_age(self):
+        # The TTL comes from the handler, as @get(path, cache=60) sets, not from the cache
+        app = CountingApp(headers=[('Cache-Control', 'max-age=60')], delay=0.2)
+        cache = ResponseCache(app)
+        threads = [threading.Thread(target=call, args=(cache, make_environ())) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(app.calls, 1)
+
+    def test_stale_while_refreshing(self):
+        app = CountingApp()
+        cache = ResponseCache(app, ttl=60)
+        call(cache, make_environ())
+        cache.backend.get(cache.key(make_environ())).expires = 0
+
+        app.delay = 0.3
+        refresh = threading.Thread(target=call, args=(cache, make_environ()))
+        refresh.start()
+        time.sleep(0.1)
+        start = time.monotonic()
+        self.assertEqual(call(cache, make_environ())[2], b'/ 1')
+        self.assertLess(time.monotonic() - start, 0.2)
+        refresh.join()
+        self.assertEqual(call(cache, make_environ())[2], b'/ 2')
+        self.assertEqual(cache.stats()['stale'], 1)
+
+    def test_handler_cache(self):
+        @get('/', cache=60)
+        def cached(request):
+            return 'hello'
+
+        @get('/')
+        def uncached(request):
+            return 'hello'
+
+        headers = dict(Application.attach_response(cached.response_attached, 'hello').headers)
+        self.assertEqual(headers['Cache-Control'], 'max-age=60')
+        headers = dict(Application.attach_response(uncached.response_attached, 'hello').headers)
+        self.assertNotIn('Cache-Control', headers)
+
+
+def make_entry(body, ttl=60):
+    return CacheEntry('200 OK', [('Content-Type', 'text/plain')], body, time.time() + ttl)
+
+
+class MemoryCacheBackendTest(unittest.TestCase):
+    def test_lru(self):
+        backend = MemoryCacheBackend(max_size=250)
+        for key in ('a', 'b', 'c'):
+            backend.set(key, make_entry(b'x' * 50))
+        backend.get('a')
+        backend.set('d', make_entry(b'x' * 50))
+        self.assertIsNone(backend.get('b'))
+        self.assertIsNotNone(backend.get('a'))
+        self.assertLessEqual(backend.size, 250)
+
+
+class SQLiteCacheBackendTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'cache.db')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_shared(self):
+        one, other = SQLiteCacheBackend(self.path), SQLiteCacheBackend(self.path)
+        one.set('/', make_entry(b'hello'))
+        entry = other.get('/')
+        self.assertEqual((entry.status, entry.body), ('200 OK', b'hello'))
+        self.assertEqual(entry.headers, [('Content-Type', 'text/plain')])
+        self.assertIsNone(other.get('/missing'))
+
+    def test_lease(self):
+        one, other = SQLiteCacheBackend(self.path), SQLiteCacheBackend(self.path)
+        self.assertTrue(one.lease('/'))
+        self.assertFalse(other.lease('/'))
+        one.release('/')
+        self.assertTrue(other.lease('/'))
+        # Left by a crashed process
+        self.assertTrue(one.lease('/a', timeout=-1))
+        self.assertTrue(other.lease('/a'))
+
+    def test_locked(self):
+        backend = SQLiteCacheBackend(self.path)
+        backend.set('/', make_entry(b'hello'))
+        backend._connect().execute("UPDATE response_cache SET used=0")
+        backend._connect().commit()
+
+        writer = sqlite3.connect(self.path)
+        writer.execute('BEGIN IMMEDIATE')
+        try:
+            start = time.monotonic()
+            result = []
+            # A hit from another thread, which has its own connection
+            reader = threading.Thread(target=lambda: result.append(backend.get('/')))
+            reader.start()
+            reader.join()
+            self.assertEqual(result[0].body, b'hello')
+            self.assertLess(time.monotonic() - start, 1)
+        finally:
+            writer.rollback()
+            writer.close()
+
+    def test_eviction(self):
+        backend = SQLiteCacheBackend(self.path, max_size=250)
+        for key in ('a', 'b', 'c', 'd'):
+            backend.set(key, make_entry(b'x' * 50))
+            time.sleep(0.01)
+        self.assertIsNone(backend.get('a'))
+        self.assertEqual(len(backend), 3)
+
+    def test_middleware(self):
+        app = CountingApp()
+        cache = ResponseCache(app, SQLiteCacheBackend(self.path), ttl=60)
+        call(cache, make_environ())
+        other = ResponseCache(CountingApp(), SQLiteCacheBackend(self.path), ttl=60)
+        self.assertEqual(call(other, make_environ())[2], b'/ 1')
+
+
+def response_app(rep):
+    def app(environ, start_response):
+        start_response(rep.status, rep.headers)
+        return rep
+    return app
+
+
+class CompressTest(unittest.TestCase):
+    text = 'hello world, ' * 100
+
+    def compress(self, rep, **headers):
+        return call(Compress(response_app(rep)), make_environ(**headers))
+
+    def test_gzip(self):
+        status, headers, body = self.compress(
+            Response(self.text, headers={'ETag': '"abc"'}), accept_encoding='gzip, deflate, br'
+        )
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertEqual(headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(headers['ETag'], '"abc-gzip"')
+        self.assertEqual(int(headers['Content-Length']), len(body))
+        self.assertEqual(gzip.decompress(body).decode(), self.text)
+
+    def test_not_modified(self):
+        def app(environ, start_response):
+            if is_not_modified(Request(environ), '"abc"', 0):
+                start_response('304 Not Modified', [('ETag', '"abc"')])
+                return []
+            rep = Response(self.text, headers={'ETag': '"abc"'})
+            start_response(rep.status, rep.headers)
+            return rep
+
+        app = Compress(app)
+        etag = call(app, make_environ(accept_encoding='gzip'))[1]['ETag']
+        for if_none_match in (etag, f'W/{etag}', f'"other", {etag}'):
+            status, headers, body = call(app, make_environ(accept_encoding='gzip', if_none_match=if_none_match))
+            self.assertEqual((status, body), ('304 Not Modified', b''))
+            self.assertEqual(headers['ETag'], '"abc-gzip"')
+
+        # Another encoding is another response
+        status = call(app, make_environ(accept_encoding='deflate', if_none_match=etag))[0]
+        self.assertEqual(status, '200 OK')
+
+    def test_negotiation(self):
+        headers = self.compress(Response(self.text), accept_encoding='gzip;q=0.5, deflate')[1]
+        self.assertEqual(headers['Content-Encoding'], 'deflate')
+        for accept_encoding in ('', 'identity', 'gzip;q=0, deflate;q=0', 'compress'):
+            status, headers, body = self.compress(Response(self.text), accept_encoding=accept_encoding)
+            self.assertNotIn('Content-Encoding', headers)
+            self.assertEqual(headers['Vary'], 'Accept-Encoding')
+            self.assertEqual(body.decode(), self.text)
+
+    def test_skipped(self):
+        for rep in (
+                Response('small'),
+                Response(b'x' * 2048, content_type='image/png'),
+                Response(self.text, status=404),
+                Response(self.text, headers={'Content-Encoding': 'br'}),
+        ):
+            status, headers, body = self.compress(rep, accept_encoding='gzip')
+            self.assertNotEqual(headers.get('Content-Encoding'), 'gzip')
+            self.assertEqual(body, b''.join(rep))
+        headers = self.compress(Response(b'x' * 2048, content_type='image/png'), accept_encoding='gzip')[1]
+        self.assertNotIn('Vary', headers)
+
+    def test_streamed(self):
+        produced = []
+
+        def pieces():
+            for i in range(100):
+                produced.append(i)
+                yield f'<p>{i}</p>' * 50
+
+        app = Compress(response_app(Response(pieces())))
+        response = []
+        result = app(make_environ(accept_encoding='gzip'), lambda status, headers, exc_info=None: response.extend(headers))
+        self.assertEqual(dict(response)['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Length', dict(response))
+
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        chunks = iter(result)
+        # Each piece is sent compressed before the next is produced
+        first = decompressor.decompress(next(chunks))
+        self.assertEqual(first.decode(), '<p>0</p>' * 50)
+        self.assertEqual(produced, [0])
+        rest = b''.join(decompressor.decompress(chunk) for chunk in chunks) + decompressor.flush()
+        self.assertEqual((first + rest).decode(), ''.join(f'<p>{i}</p>' * 50 for i in range(100)))
+        result.close()
@@ -4,19 +4,23 @@ Usage:
 """
 
 import os
+import copy
+import pickle
 import unittest
 import tempfile
 import logging
+import sqlite3
+import threading
 
 from collections.abc import Iterable, Iterator
 
 from webgo import config
 from webgo import orm
 
-from webgo.exceptions import FieldError
+from webgo.exceptions import FieldError, PoolTimeout
 from webgo.orm import (
     Model, IntegerField, TextField, Many2one, User, NewId,
-    One2many,
+    One2many, Q, Count, Sum, Avg, Min, Max,
 )
 
 # orm.logger.disabled = True
@@ -25,6 +29,22 @@ logging.disable(logging.CRITICAL)
 ORIGINAL_DB_PATH = config.DB_FILE
 
 
+def trace_queries():
+    """ Return the list the SELECTs run by this thread will be appended to
+
+    The traced connection is closed with the pools, in tearDown.
+    """
+    pool = orm.get_pool()
+    # Released connections are reused last in first out
+    conn = pool.acquire()
+    pool.release(conn)
+    statements = []
+    conn.set_trace_callback(
+        lambda sql: statements.append(sql) if sql.lstrip().upper().startswith('SELECT') else None
+    )
+    return statements
+
+
 def setUpModule():
     pass
 
@@ -100,6 +120,720 @@ class RegularTest(unittest.TestCase):
         self.assertEqual(len(recs), 0)
 
 
+class StatementTest(unittest.TestCase):
+    def test_precompiled(self):
+        class Note(Model):
+            text = TextField()
+            rank = IntegerField()
+
+        self.assertEqual(Note.__columns__, ('text', 'rank'))
+        self.assertEqual(Note.__sql__['insert'], 'INSERT INTO note (text,rank) VALUES (?,?)')
+        self.assertEqual(Note.__sql__['update'], 'UPDATE note SET text=?,rank=? WHERE pk=?')
+        self.assertEqual(Note.__sql__['delete'], 'DELETE FROM note WHERE pk=?')
+        self.assertEqual(Note.__sql__['get'], 'SELECT note.text,note.rank,note.pk FROM note WHERE pk=?')
+
+
+class RowTest(unittest.TestCase):
+    def test_compact(self):
+        user = User(name='Guido', age=65)
+        self.assertFalse(hasattr(user, '__dict__'))
+        self.assertEqual(user.col_value, {'name': 'Guido', 'age': 65, 'pk': user.pk})
+        self.assertRaises(FieldError, setattr, user, 'nickname', 'BDFL')
+
+    def test_from_row(self):
+        row = ('Guido', 65, 1)
+        user = User._from_row(row)
+        self.assertIs(user._row, row)
+        self.assertEqual((user.name, user.age, user.pk), row)
+
+        user.age = 66
+        self.assertEqual(user.age, 66)
+        self.assertEqual(row, ('Guido', 65, 1))
+        self.assertEqual(user, User._from_row(('Guido', 66, 1)))
+        self.assertNotEqual(user, User._from_row(('Guido', 65, 1)))
+
+
+    def test_copy_pickle(self):
+        user = User._from_row(('Guido', 65, 1))
+        user._set_related('team', 'Python')
+        for other in (copy.copy(user), copy.deepcopy(user), pickle.loads(pickle.dumps(user))):
+            self.assertIsNot(other, user)
+            self.assertEqual(other.col_value, user.col_value)
+            self.assertEqual(other._get_related('team'), 'Python')
+            other.age = 66
+            self.assertEqual(user.age, 65)
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.dir.name, 'sqlite.db')
+
+    def tearDown(self):
+        orm.close_pools()
+        self.dir.cleanup()
+
+    def test_reuse(self):
+        pool = orm.ConnectionPool(self.db_path, size=2)
+        conn = pool.acquire()
+        pool.release(conn)
+        self.assertIs(pool.acquire(), conn)
+
+    def test_pragmas(self):
+        pool = orm.ConnectionPool(self.db_path)
+        conn = pool.acquire()
+        self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+        # NORMAL
+        self.assertEqual(conn.execute('PRAGMA synchronous').fetchone()[0], 1)
+        self.assertEqual(conn.execute('PRAGMA cache_size').fetchone()[0], -16 * 1024)
+
+    def test_size(self):
+        pool = orm.ConnectionPool(self.db_path, size=1, timeout=0.1)
+        conn = pool.acquire()
+        self.assertRaises(PoolTimeout, pool.acquire)
+
+        threading.Timer(0.05, pool.release, (conn,)).start()
+        pool.timeout = 5
+        self.assertIs(pool.acquire(), conn)
+
+    def test_release_rolls_back(self):
+        pool = orm.ConnectionPool(self.db_path, size=1)
+        conn = pool.acquire()
+        conn.execute('CREATE TABLE t (x int)')
+        conn.execute('INSERT INTO t VALUES (1)')
+        pool.release(conn)
+        conn = pool.acquire()
+        self.assertFalse(conn.in_transaction)
+        self.assertEqual(conn.execute('SELECT count(*) FROM t').fetchone()[0], 0)
+
+    def test_pool_per_database(self):
+        config.DB_FILE = self.db_path
+        self.addCleanup(setattr, config, 'DB_FILE', ORIGINAL_DB_PATH)
+        self.assertIs(orm.get_pool(), orm.get_pool(self.db_path))
+        self.assertIsNot(orm.get_pool(), orm.get_pool(self.db_path + '2'))
+
+
+class AtomicTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        class Account(Model):
+            name = TextField()
+            balance = IntegerField()
+
+        cls.model = Account
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        config.DB_FILE = os.path.join(self.dir.name, 'sqlite.db')
+        self.model.create_table()
+
+    def tearDown(self):
+        orm.close_pools()
+        config.DB_FILE = ORIGINAL_DB_PATH
+        self.dir.cleanup()
+
+    def test_commit(self):
+        with orm.atomic():
+            self.model(name='a', balance=1).save()
+            self.model(name='b', balance=2).save()
+        self.assertEqual(len(self.model.objects.query()), 2)
+
+    def test_rollback(self):
+        with self.assertRaises(ZeroDivisionError):
+            with orm.atomic():
+                account = self.model(name='a', balance=1)
+                account.save()
+                self.assertEqual(account.pk, 1)
+                1 / 0
+        self.assertEqual(len(self.model.objects.query()), 0)
+
+    def test_savepoint(self):
+        with orm.atomic():
+            self.model(name='a', balance=1).save()
+            try:
+                with orm.atomic():
+                    self.model(name='b', balance=2).save()
+                    raise ValueError
+            except ValueError:
+                pass
+        names = {account.name for account in self.model.objects.query()}
+        self.assertEqual(names, {'a'})
+
+    def test_sql_error_rolls_back(self):
+        with self.assertRaises(sqlite3.OperationalError):
+            with orm.atomic() as conn:
+                self.model(name='a', balance=1).save()
+                conn.execute('INSERT INTO missing VALUES (1)')
+        self.assertEqual(len(self.model.objects.query()), 0)
+
+    def test_waits_for_writer(self):
+        other = sqlite3.connect(config.DB_FILE, isolation_level=None, check_same_thread=False)
+        other.execute('BEGIN IMMEDIATE')
+        threading.Timer(0.1, other.execute, ('COMMIT',)).start()
+        self.model(name='a', balance=1).save()
+        self.assertEqual(len(self.model.objects.query()), 1)
+        other.close()
+
+    def test_concurrent_writers(self):
+        def deposit():
+            for _ in range(20):
+                with orm.atomic():
+                    self.model(name='a', balance=1).save()
+
+        threads = [threading.Thread(target=deposit) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        pks = {account.pk for account in self.model.objects.query()}
+        self.assertEqual(pks, set(range(1, 81)))
+
+
+class BulkTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        class Item(Model):
+            name = TextField()
+            price = IntegerField()
+
+        cls.model = Item
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        config.DB_FILE = os.path.join(self.dir.name, 'sqlite.db')
+        self.model.create_table()
+
+    def tearDown(self):
+        orm.close_pools()
+        config.DB_FILE = ORIGINAL_DB_PATH
+        self.dir.cleanup()
+
+    def prices(self):
+        return {item.pk: item.price for item in self.model.objects.query()}
+
+    def test_bulk_create(self):
+        self.model(name='first', price=0).save()
+        items = [self.model(name=f'item{i}', price=i) for i in range(1, 1001)]
+        self.model.objects.bulk_create(items)
+        self.assertEqual([item.pk for item in items], list(range(2, 1002)))
+        self.assertEqual(self.model.objects.get(pk=500).price, 499)
+        self.assertEqual(len(self.model.objects.query()), 1001)
+
+    def test_bulk_create_errors(self):
+        saved = self.model(name='a', price=1)
+        saved.save()
+        self.assertRaises(ValueError, self.model.objects.bulk_create, [saved])
+        self.assertRaises(TypeError, self.model.objects.bulk_create, [User(name='a', age=1)])
+        self.assertEqual(self.model.objects.bulk_create([]), [])
+
+    def test_bulk_update(self):
+        items = self.model.objects.bulk_create(self.model(name='a', price=i) for i in range(10))
+        for item in items:
+            item.price *= 10
+            item.name = 'b'
+        self.assertEqual(self.model.objects.bulk_update(items, ['price']), 10)
+        self.assertEqual(self.prices(), {i + 1: i * 10 for i in range(10)})
+        self.assertEqual({item.name for item in self.model.objects.query()}, {'a'})
+        self.assertRaises(FieldError, self.model.objects.bulk_update, items, ['pk'])
+
+    def test_update(self):
+        self.model.objects.bulk_create(self.model(name='a', price=i) for i in range(3))
+        self.model.objects.bulk_create(self.model(name='b', price=i) for i in range(2))
+        recset = self.model.objects.query(name='a')
+        self.assertEqual(recset.update(price=100), 3)
+        self.assertEqual({item.price for item in recset}, {100})
+        self.assertEqual(self.prices(), {1: 100, 2: 100, 3: 100, 4: 0, 5: 1})
+
+        self.assertEqual(self.model.objects.update(price=7), 5)
+        self.assertEqual(set(self.prices().values()), {7})
+        self.assertRaises(TypeError, recset.update, price='7')
+
+    def test_delete(self):
+        self.model.objects.bulk_create(self.model(name='a', price=i) for i in range(2000))
+        self.model.objects.bulk_create(self.model(name='b', price=i) for i in range(5))
+        recset = self.model.objects.query(name='a')
+        self.assertEqual(recset.delete(), 2000)
+        self.assertEqual(len(self.model.objects.query()), 5)
+        self.assertEqual(self.model.objects.delete(), 5)
+        self.assertEqual(len(self.model.objects.query()), 0)
+
+    def test_rollback_with_atomic(self):
+        with self.assertRaises(ValueError):
+            with orm.atomic():
+                self.model.objects.bulk_create(self.model(name='a', price=i) for i in range(5))
+                raise ValueError
+        self.assertEqual(len(self.model.objects.query()), 0)
+
+
+class QueryTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        class Member(Model):
+            name = TextField()
+            age = IntegerField()
+
+        cls.model = Member
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        config.DB_FILE = os.path.join(self.dir.name, 'sqlite.db')
+        self.model.create_table()
+        self.model.objects.bulk_create([
+            self.model(name='Guido', age=65),
+            self.model(name='Tim', age=70),
+            self.model(name='Barry', age=55),
+            self.model(name='Brett', age=40),
+            self.model(name='Carol', age=None),
+        ])
+
+    def tearDown(self):
+        orm.close_pools()
+        config.DB_FILE = ORIGINAL_DB_PATH
+        self.dir.cleanup()
+
+    def names(self, recset):
+        return [rec.name for rec in recset]
+
+    def test_lazy(self):
+        recset = self.model.objects.query(age__gt=50)
+        self.model(name='Raymond', age=60).save()
+        self.assertEqual(len(recset), 4)
+        # Fetched once, kept afterwards
+        self.model(name='Alex', age=60).save()
+        self.assertEqual(len(recset), 4)
+
+    def test_and(self):
+        recset = self.model.objects.query(age__gte=55, name__startswith='B')
+        self.assertEqual(self.names(recset), ['Barry'])
+        recset = self.model.objects.query(age__lt=70).query(age__ne=55)
+        self.assertEqual(set(self.names(recset)), {'Guido', 'Brett'})
+
+    def test_or_not(self):
+        recset = self.model.objects.query(Q(age__lt=50) | Q(name='Tim'))
+        self.assertEqual(set(self.names(recset)), {'Tim', 'Brett'})
+        recset = self.model.objects.query(~Q(name__in=['Tim', 'Guido']), age__isnull=False)
+        self.assertEqual(set(self.names(recset)), {'Barry', 'Brett'})
+        recset = self.model.objects.exclude(age__gt=50)
+        self.assertEqual(set(self.names(recset)), {'Brett'})
+
+    def test_lookups(self):
+        objects = self.model.objects
+        self.assertEqual(self.names(objects.query(age=None)), ['Carol'])
+        self.assertEqual(self.names(objects.query(name__contains='ar')), ['Barry', 'Carol'])
+        self.assertEqual(self.names(objects.query(name__endswith='o')), ['Guido'])
+        self.assertEqual(self.names(objects.query(name__in=[])), [])
+        self.assertEqual(len(objects.query(name__contains='%')), 0)
+        self.assertRaises(FieldError, objects.query, nickname='Guido')
+        self.assertRaises(FieldError, objects.query, age__between=1)
+
+    def test_in_generator(self):
+        pks = [rec.pk for rec in self.model.objects.query(age__gt=60)]
+        recset = self.model.objects.query(pk__in=(pk for pk in pks))
+        self.assertEqual(set(self.names(recset)), {'Guido', 'Tim'})
+        recset = self.model.objects.query(Q(name__in=iter(['Tim'])) | Q(age=40))
+        self.assertEqual(set(self.names(recset)), {'Tim', 'Brett'})
+
+    def test_order_by(self):
+        recset = self.model.objects.query(age__isnull=False).order_by('-age')
+        self.assertEqual(self.names(recset), ['Tim', 'Guido', 'Barry', 'Brett'])
+        recset = self.model.objects.order_by('name')
+        self.assertEqual(self.names(recset), ['Barry', 'Brett', 'Carol', 'Guido', 'Tim'])
+
+    def test_slice(self):
+        recset = self.model.objects.order_by('name')
+        self.assertEqual(self.names(recset[1:3]), ['Brett', 'Carol'])
+        self.assertEqual(self.names(recset[3:]), ['Guido', 'Tim'])
+        self.assertEqual(self.names(recset[1:4][1:]), ['Carol', 'Guido'])
+        self.assertEqual(self.names(recset[10:]), [])
+        self.assertEqual(recset[1].name, 'Brett')
+        self.assertRaises(IndexError, lambda: recset[10])
+        self.assertRaises(ValueError, lambda: recset[-1:])
+        self.assertRaises(TypeError, lambda: recset[:2].query(age=1))
+        self.assertEqual(recset[1:3]._sql('pk')[0].split('LIMIT')[1].strip(), '2 OFFSET 1')
+
+    def test_count_exists_first(self):
+        objects = self.model.objects
+        self.assertEqual(objects.count(), 5)
+        self.assertEqual(objects.query(age__gt=60).count(), 2)
+        self.assertEqual(objects.order_by('age')[1:3].count(), 2)
+        self.assertTrue(objects.query(name='Tim').exists())
+        self.assertFalse(objects.query(name='Nobody').exists())
+        self.assertEqual(objects.first().name, 'Guido')
+        self.assertEqual(objects.order_by('-age').first().name, 'Tim')
+        self.assertIsNone(objects.query(name='Nobody').first())
+        self.assertIsNone(objects.get(pk=100))
+
+    def test_sliced_first_get(self):
+        recset = self.model.objects.order_by('name')[1:3]
+        self.assertEqual(recset.first().name, 'Brett')
+        self.assertEqual(self.model.objects[2:].first().name, 'Barry')
+        self.assertIsNone(self.model.objects[10:].first())
+        brett, carol = recset
+        self.assertEqual(recset.get(carol.pk).name, 'Carol')
+        # Outside the slice
+        guido = self.model.objects.query(name='Guido').first()
+        self.assertIsNone(recset.get(guido.pk))
+
+    def test_set_operations(self):
+        old = self.model.objects.query(age__gte=65)
+        b = self.model.objects.query(name__startswith='B')
+        union = old | b
+        self.assertEqual(set(self.names(union)), {'Guido', 'Tim', 'Barry', 'Brett'})
+        self.assertEqual(union.model, self.model)
+        self.assertEqual(self.names(union.query(age__gt=60).order_by('age')), ['Guido', 'Tim'])
+        self.assertEqual(len(old & b), 0)
+
+    def test_iterate(self):
+        recset = self.model.objects.query(age__isnull=False).order_by('age')
+        records = recset.iterate(chunk_size=2)
+        self.assertIsInstance(records, Iterator)
+        self.assertEqual(self.names(records), ['Brett', 'Barry', 'Guido', 'Tim'])
+        self.assertIsNone(recset._result)
+        self.assertEqual(self.names(recset[1:3].iterate()), ['Barry', 'Guido'])
+
+    def test_iterate_releases_connection(self):
+        pool = orm.get_pool()
+        pool.timeout = 0.1
+        for _ in range(pool.size + 1):
+            records = self.model.objects.iterate(chunk_size=1)
+            next(records)
+            records.close()
+        self.assertEqual(pool._opened, 1)
+
+    def test_sliced_update_delete(self):
+        self.model.objects.order_by('-age')[:2].update(age=1)
+        self.assertEqual(self.model.objects.query(age=1).count(), 2)
+        self.assertEqual(self.model.objects.query(age__lt=50).delete(), 3)
+        self.assertEqual(set(self.names(self.model.objects)), {'Barry', 'Carol'})
+
+
+class IdentityMapTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        class Grade(Model):
+            score = IntegerField()
+            user = Many2one(related_model="User")
+
+        cls.model = Grade
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        config.DB_FILE = os.path.join(self.dir.name, 'sqlite.db')
+        self.model.create_table()
+        User.create_table()
+        self.users = User.objects.bulk_create(User(name=f'user{i}', age=i) for i in range(3))
+        self.model.objects.bulk_create(
+            self.model(score=i, user=self.users[i % 3].pk) for i in range(30)
+        )
+
+    def tearDown(self):
+        orm.close_pools()
+        config.DB_FILE = ORIGINAL_DB_PATH
+        self.dir.cleanup()
+
+    def test_many2one_without_map(self):
+        grades = list(self.model.objects.query())
+        queries = trace_queries()
+        for grade in grades:
+            grade.user
+        self.assertEqual(len(queries), 30)
+
+    def test_many2one_queried_once(self):
+        with orm.identity_map():
+            grades = list(self.model.objects.query())
+            queries = trace_queries()
+            users = {id(grade.user) for grade in grades}
+            self.assertEqual(len(queries), 3)
+            self.assertEqual(len(users), 3)
+
+    def test_query_returns_loaded_instances(self):
+        with orm.identity_map():
+            user = User.objects.get(pk=1)
+            user.age = 99
+            self.assertIs(User.objects.query(name='user0')[0], user)
+            self.assertIs(User.objects.get(pk=1), user)
+
+    def test_save_delete(self):
+        with orm.identity_map():
+            user = User(name='new', age=1)
+            user.save()
+            queries = trace_queries()
+            self.assertIs(User.objects.get(pk=user.pk), user)
+            self.assertEqual(queries, [])
+
+            pk = user.pk
+            user.delete()
+            self.assertIsNone(User.objects.get(pk=pk))
+
+    def test_set_level_writes(self):
+        with orm.identity_map():
+            user = User.objects.get(pk=1)
+            User.objects.query(pk=1).update(age=50)
+            self.assertEqual(User.objects.get(pk=1).age, 50)
+            self.assertIsNot(User.objects.get(pk=1), user)
+
+    def test_nested(self):
+        with orm.identity_map() as outer:
+            with orm.identity_map() as inner:
+                self.assertIs(inner, outer)
+            User.objects.get(pk=2)
+            self.assertIn((User, 2), outer)
+        self.assertIsNone(orm._identity_map.get())
+
+
+class EagerLoadingTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        class Author(Model):
+            name = TextField()
+            books = One2many('Book', 'author')
+
+        class Book(Model):
+            title = TextField()
+            author = Many2one(related_model="Author")
+
+        cls.author_model = Author
+        cls.book_model = Book
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        config.DB_FILE = os.path.join(self.dir.name, 'sqlite.db')
+        self.author_model.create_table()
+        self.book_model.create_table()
+        authors = self.author_model.objects.bulk_create(
+            self.author_model(name=f'author{i}') for i in range(5)
+        )
+        self.book_model.objects.bulk_create(
+            self.book_model(title=f'book{i}', author=authors[i % 4].pk) for i in range(20)
+        )
+        self.book_model(title='anonymous').save()
+
+    def tearDown(self):
+        orm.close_pools()
+        config.DB_FILE = ORIGINAL_DB_PATH
+        self.dir.cleanup()
+
+    def test_no_column_for_one2many(self):
+        with orm.DBConnect() as conn:
+            cols = [row[1] for row in conn.execute('PRAGMA table_info(author)')]
+        self.assertEqual(cols, ['name', 'pk'])
+
+    def test_select_related(self):
+        books = self.book_model.objects.select_related('author').query(title__startswith='book')
+        queries = trace_queries()
+        names = {book.title: book.author.name for book in books.order_by('pk')}
+        self.assertEqual(len(queries), 1)
+        self.assertIn('LEFT JOIN', queries[0])
+        self.assertEqual(names['book5'], 'author1')
+        self.assertEqual(len(names), 20)
+
+    def test_get_select_related(self):
+        book = self.book_model.objects.select_related('author').get(pk=2)
+        queries = trace_queries()
+        self.assertEqual(book.author.name, 'author1')
+        self.assertEqual(queries, [])
+
+    def test_select_related_null(self):
+        book = self.book_model.objects.select_related('author').query(title='anonymous').first()
+        queries = trace_queries()
+        self.assertIsNone(book.author)
+        self.assertEqual(queries, [])
+
+    def test_select_related_reassigned(self):
+        book = self.book_model.objects.select_related('author').first()
+        book.author = 5
+        self.assertEqual(book.author.name, 'author4')
+
+    def test_prefetch_one2many(self):
+        authors = self.author_model.objects.prefetch_related('books').order_by('pk')
+        queries = trace_queries()
+        counts = [len(author.books) for author in authors]
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(counts, [5, 5, 5, 5, 0])
+        self.assertEqual(
+            [book.title for book in authors[1].books],
+            ['book1', 'book5', 'book9', 'book13', 'book17'],
+        )
+
+    def test_prefetch_many2one(self):
+        books = self.book_model.objects.prefetch_related('author')
+        queries = trace_queries()
+        names = {book.author.name for book in books if book.author}
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(names, {'author0', 'author1', 'author2', 'author3'})
+
+    def test_iterate(self):
+        books = self.book_model.objects.select_related('author').order_by('pk')
+        titles = [(book.title, book.author and book.author.name) for book in books.iterate(chunk_size=8)]
+        self.assertEqual(len(titles), 21)
+        self.assertEqual(titles[6], ('book6', 'author2'))
+        self.assertEqual(titles[20], ('anonymous', None))
+
+    def test_invalid_fields(self):
+        self.assertRaises(FieldError, self.book_model.objects.select_related, 'title')
+        self.assertRaises(FieldError, self.author_model.objects.select_related, 'books')
+        self.assertRaises(FieldError, self.author_model.objects.prefetch_related, 'name')
+
+
+class AggregateTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        class Score(Model):
+            player = TextField()
+            points = IntegerField()
+
+        cls.model = Score
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        config.DB_FILE = os.path.join(self.dir.name, 'sqlite.db')
+        self.model.create_table()
+        self.model.objects.bulk_create(
+            self.model(player=player, points=points)
+            for player, points in [('ann', 10), ('bob', 4), ('ann', 6), ('cid', None), ('bob', 8)]
+        )
+
+    def tearDown(self):
+        orm.close_pools()
+        config.DB_FILE = ORIGINAL_DB_PATH
+        self.dir.cleanup()
+
+    def test_aggregate(self):
+        self.assertEqual(
+            self.model.objects.aggregate(Count(), Count('points'), Sum('points'), Min('points'), Max('points')),
+            {'count': 5, 'points__count': 4, 'points__sum': 28, 'points__min': 4, 'points__max': 10},
+        )
+        self.assertEqual(self.model.objects.aggregate(players=Count('player', distinct=True)), {'players': 3})
+
+    def test_aggregate_filtered(self):
+        self.assertEqual(self.model.objects.query(player='ann').aggregate(avg=Avg('points')), {'avg': 8.0})
+        self.assertEqual(self.model.objects.query(player='dan').aggregate(Sum('points')), {'points__sum': None})
+
+    def test_aggregate_sliced(self):
+        top = self.model.objects.query(points__isnull=False).order_by('-points')[:2]
+        self.assertEqual(top.aggregate(Sum('points')), {'points__sum': 18})
+
+    def test_annotate(self):
+        totals = self.model.objects.values('player').annotate(total=Sum('points'), n=Count()).order_by('-total')
+        self.assertEqual(list(totals), [
+            {'player': 'ann', 'total': 16, 'n': 2},
+            {'player': 'bob', 'total': 12, 'n': 2},
+            {'player': 'cid', 'total': None, 'n': 1},
+        ])
+
+    def test_keyword_aliases(self):
+        groups = self.model.objects.values('player').annotate(group=Count(), order=Sum('points')).order_by('-order')
+        self.assertEqual(list(groups)[0], {'player': 'ann', 'group': 2, 'order': 16})
+        self.assertEqual(self.model.objects.aggregate(select=Max('points')), {'select': 10})
+        self.assertRaises(FieldError, self.model.objects.aggregate, **{'a"b': Max('points')})
+
+    def test_values(self):
+        values = self.model.objects.query(player='bob').values('points')
+        self.assertEqual(list(values), [{'points': 4}, {'points': 8}])
+        self.assertEqual(values.order_by('-points')[0], {'points': 8})
+
+    def test_invalid(self):
+        self.assertRaises(FieldError, self.model.objects.aggregate, Sum('nope'))
+        self.assertRaises(FieldError, self.model.objects.values, 'nope')
+        self.assertRaises(FieldError, self.model.objects.values('player').annotate, points=Sum('points'))
+        self.assertRaises(FieldError, self.model.objects.values('player').order_by, 'points')
+        self.assertRaises(TypeError, self.model.objects.aggregate, total='points')
+
+
+class IndexTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        class Shelf(Model):
+            label = TextField(unique=True)
+
+        class Volume(Model):
+            title = TextField(index=True)
+            year = IntegerField()
+            shelf = Many2one(related_model='Shelf')
+
+            class Meta:
+                indexes = [('year', 'title')]
+
+        cls.shelf_model = Shelf
+        cls.volume_model = Volume
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        config.DB_FILE = os.path.join(self.dir.name, 'sqlite.db')
+        self.shelf_model.create_table()
+        self.volume_model.create_table()
+
+    def tearDown(self):
+        orm.close_pools()
+        config.DB_FILE = ORIGINAL_DB_PATH
+        self.dir.cleanup()
+
+    def index_names(self, table):
+        with orm.DBConnect() as conn:
+            return {row[1] for row in conn.execute(f'PRAGMA index_list({table})')}
+
+    def test_indexes_created(self):
+        self.assertEqual(
+            self.index_names('volume'),
+            {'ix_volume_title', 'ix_volume_shelf', 'ix_volume_year_title'},
+        )
+        self.assertEqual(self.index_names('shelf'), {'ux_shelf_label'})
+
+    def test_many2one_lookup_uses_index(self):
+        sql, params = self.volume_model.objects.query(shelf=1)._select()
+        with orm.DBConnect() as conn:
+            plan = ' '.join(row[-1] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params))
+        self.assertIn('USING INDEX ix_volume_shelf', plan)
+
+    def test_unique(self):
+        self.shelf_model(label='A').save()
+        self.assertRaises(sqlite3.IntegrityError, self.shelf_model.objects.bulk_create,
+                          [self.shelf_model(label='A')])
+
+    def test_unknown_field(self):
+        with self.assertRaises(FieldError):
+            class Broken(Model):
+                name = TextField()
+
+                class Meta:
+                    indexes = [('name', 'nope')]
+
+    def test_migrate(self):
+        class Ledger(Model):
+            amount = IntegerField(index=True)
+
+        Ledger.create_table()
+        Ledger(amount=3).save()
+
+        class Ledger(Model):
+            amount = IntegerField()
+            memo = TextField(unique=True)
+            shelf = Many2one(related_model='Shelf')
+
+        planned = Ledger.migrate(dry_run=True)
+        self.assertEqual(self.index_names('ledger'), {'ix_ledger_amount'})
+        self.assertEqual(Ledger.migrate(), planned)
+        self.assertEqual(planned[0], 'ALTER TABLE ledger ADD COLUMN memo text')
+        self.assertIn('DROP INDEX ix_ledger_amount', planned)
+        self.assertEqual(self.index_names('ledger'), {'ux_ledger_memo', 'ix_ledger_shelf'})
+
+        rec = Ledger.objects.get(pk=1)
+        self.assertEqual((rec.amount, rec.memo), (3, None))
+        rec.memo = 'paid'
+        rec.save()
+        self.assertEqual(Ledger.objects.query(memo='paid').count(), 1)
+        # Up to date
+        self.assertEqual(Ledger.migrate(), [])
+
+    def test_migrate_creates_table(self):
+        class Drawer(Model):
+            name = TextField(index=True)
+
+        statements = Drawer.migrate()
+        self.assertEqual(statements[0], 'CREATE TABLE drawer (name text,pk INTEGER PRIMARY KEY AUTOINCREMENT)')
+        self.assertEqual(self.index_names('drawer'), {'ix_drawer_name'})
+
+
 class Many2oneTest(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -0,0 +1,62 @@
+"""
+Usage:
+    $ python -m unittest tests/test_routing.py
+"""
+
+import unittest
+
+from webgo.exceptions import NotFound, MethodNotAllowed
+from webgo.routing import Router
+
+
+class RouterTest(unittest.TestCase):
+    def setUp(self):
+        self.router = router = Router()
+        router.add('GET', '/', 'index')
+        router.add('GET', '/user/me', 'me')
+        router.add('GET', '/user/<int:id>', 'user')
+        router.add('POST', '/user/<int:id>', 'update_user')
+        router.add('GET', '/user/<name>', 'user_by_name')
+        router.add('GET', '/user/<int:id>/exam/<int:exam_id>', 'exam')
+        router.add('GET', '/price/<float:amount>', 'price')
+        router.add('GET', '/static/<path:rest>', 'static')
+        router.add('GET', '/static/favicon.ico', 'favicon')
+
+    def test_static(self):
+        self.assertEqual(self.router.match('GET', '/'), ('index', {}))
+        self.assertEqual(self.router.match('GET', '/user/me'), ('me', {}))
+
+    def test_typed_params(self):
+        self.assertEqual(self.router.match('GET', '/user/42'), ('user', {'id': 42}))
+        self.assertEqual(self.router.match('GET', '/user/guido'), ('user_by_name', {'name': 'guido'}))
+        self.assertEqual(
+            self.router.match('GET', '/user/1/exam/2'),
+            ('exam', {'id': 1, 'exam_id': 2})
+        )
+        self.assertEqual(self.router.match('GET', '/price/9.5'), ('price', {'amount': 9.5}))
+
+    def test_wildcard(self):
+        self.assertEqual(
+            self.router.match('GET', '/static/css/demo.css'),
+            ('static', {'rest': 'css/demo.css'})
+        )
+        self.assertEqual(self.router.match('GET', '/static/favicon.ico'), ('favicon', {}))
+
+    def test_method_dispatch(self):
+        self.assertEqual(self.router.match('POST', '/user/7'), ('update_user', {'id': 7}))
+        with self.assertRaises(MethodNotAllowed) as cm:
+            self.router.match('DELETE', '/user/7')
+        self.assertEqual(cm.exception.allowed, ['GET', 'POST'])
+
+    def test_not_found(self):
+        for path in ('/nope', '/user', '/user/1/exam/x', '/price/cheap', '/user/'):
+            with self.assertRaises(NotFound):
+                self.router.match('GET', path)
+
+    def test_bad_template(self):
+        self.assertRaises(ValueError, self.router.add, 'GET', '/<uuid:id>', 'x')
+        self.assertRaises(ValueError, self.router.add, 'GET', '/<path:p>/x', 'x')
+
+    def test_routes(self):
+        self.assertEqual(len(self.router), 9)
+        self.assertIn(('GET', '/user/<int:id>', 'user'), list(self.router.routes()))
@@ -0,0 +1,580 @@
+"""
+Usage:
+    $ python -m unittest tests/test_server.py
+"""
+
+import os
+import sys
+import time
+import signal
+import socket
+import tempfile
+import tracemalloc
+import subprocess
+import http.client
+import logging
+import threading
+import unittest
+
+from webgo.servers import Server, SelectorServer, AsyncServer
+from webgo.servers.server import HTTPSocketIO, InputStream, RequestError, RECV_SIZE
+from webgo.webgoapp import AsgiApplication
+from webgo.wsgirequest import Request, Response, FileResponse, BLOCK_SIZE
+
+logging.disable(logging.CRITICAL)
+
+
+def echo_app(environ, start_response):
+    request = Request(environ)
+    if request.method == 'POST':
+        body = request.buffer.decode()
+    else:
+        body = request.path
+    rep = Response(body=body)
+    start_response(rep.status, rep.headers)
+    return rep
+
+
+def slow_app(environ, start_response):
+    time.sleep(0.3)
+    return echo_app(environ, start_response)
+
+
+def start_server(server_class, app=echo_app, **kwargs):
+    server = server_class(('127.0.0.1', 0), **kwargs)
+    server.set_app(app)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def request(address, raw):
+    with socket.create_connection(address, timeout=5) as conn:
+        conn.sendall(raw)
+        chunks = []
+        while chunk := conn.recv(4096):
+            chunks.append(chunk)
+    return b''.join(chunks)
+
+
+async def asgi_echo_app(scope, receive, send):
+    message = await receive()
+    body = message['body'] if scope['method'] == 'POST' else scope['path'].encode()
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-length', str(len(body)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def stream_app(environ, start_response):
+    rep = Response(body=(f'{i},' for i in range(1000)))
+    start_response(rep.status, rep.headers)
+    return rep
+
+
+async def asgi_stream_app(scope, receive, send):
+    await receive()
+    await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+    for i in range(1000):
+        await send({'type': 'http.response.body', 'body': f'{i},'.encode(), 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+class ServerTest(unittest.TestCase):
+    server_class = Server
+    app = staticmethod(echo_app)
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = start_server(cls.server_class, cls.app)
+
+    def test_get(self):
+        response = request(
+            self.server.address,
+            b'GET /hello HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n'
+        )
+        self.assertTrue(response.startswith(b'HTTP/1.1 200 OK\r\n'))
+        self.assertTrue(response.endswith(b'\r\n\r\n/hello'))
+
+    def test_post(self):
+        response = request(
+            self.server.address,
+            b'POST / HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n'
+            b'Content-Type: text/plain\r\nContent-Length: 5\r\n\r\nGuido'
+        )
+        self.assertTrue(response.endswith(b'\r\n\r\nGuido'))
+
+    def test_keep_alive(self):
+        conn = http.client.HTTPConnection(*self.server.address, timeout=5)
+        for path in ('/one', '/two', '/three'):
+            conn.request('GET', path)
+            response = conn.getresponse()
+            self.assertEqual(response.read(), path.encode())
+            self.assertEqual(response.getheader('Connection'), 'keep-alive')
+            sock = conn.sock
+        self.assertIs(conn.sock, sock)
+        conn.close()
+
+    def test_head(self):
+        response = request(
+            self.server.address,
+            b'HEAD /hello HTTP/1.1\r\nHost: localhost\r\n\r\n'
+            b'GET /next HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n'
+        )
+        first, _, second = response.partition(b'\r\n\r\n')
+        self.assertIn(b'content-length: 6', first.lower())
+        self.assertTrue(second.startswith(b'HTTP/1.1 200 OK\r\n'))
+        self.assertTrue(second.endswith(b'\r\n\r\n/next'))
+
+    def test_unicode(self):
+        conn = http.client.HTTPConnection(*self.server.address, timeout=5)
+        for _ in range(2):
+            conn.request('POST', '/', body='héllo ✓'.encode())
+            response = conn.getresponse()
+            self.assertEqual(response.read().decode(), 'héllo ✓')
+        conn.close()
+
+    def test_pipelining(self):
+        response = request(
+            self.server.address,
+            b'GET /one HTTP/1.1\r\nHost: localhost\r\n\r\n'
+            b'POST / HTTP/1.1\r\nHost: localhost\r\nContent-Length: 3\r\n\r\ntwo'
+            b'GET /three HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n'
+        )
+        self.assertEqual(response.count(b'HTTP/1.1 200 OK'), 3)
+        self.assertLess(response.index(b'/one'), response.index(b'two'))
+        self.assertLess(response.index(b'two'), response.index(b'/three'))
+
+    def test_transfer_encoding(self):
+        # The chunked body would otherwise be served as a second request
+        response = request(
+            self.server.address,
+            b'POST / HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n'
+            b'GET /smuggled HTTP/1.1\r\nHost: x\r\n\r\n'
+        )
+        self.assertTrue(response.startswith(b'HTTP/1.1 501 Not Implemented\r\n'))
+        self.assertIn(b'Connection: close', response)
+        self.assertNotIn(b'smuggled', response)
+
+        response = request(
+            self.server.address,
+            b'POST / HTTP/1.1\r\nHost: x\r\nContent-Length: 3\r\nTransfer-Encoding: chunked\r\n\r\n'
+            b'0\r\n\r\nGET /smuggled HTTP/1.1\r\nHost: x\r\n\r\n'
+        )
+        self.assertTrue(response.startswith(b'HTTP/1.1 400 Bad Request\r\n'))
+        self.assertNotIn(b'smuggled', response)
+
+        response = request(
+            self.server.address,
+            b'POST / HTTP/1.1\r\nHost: x\r\ncontent-length: 3\r\ntransfer-encoding: chunked\r\n\r\n'
+            b'0\r\n\r\nGET /smuggled HTTP/1.1\r\nHost: x\r\n\r\n'
+        )
+        self.assertTrue(response.startswith(b'HTTP/1.1 400 Bad Request\r\n'))
+        self.assertNotIn(b'smuggled', response)
+
+    def test_header_case(self):
+        # The body would otherwise be served as a second request
+        response = request(
+            self.server.address,
+            b'POST / HTTP/1.1\r\nhost: x\r\nconnection: close\r\ncontent-length: 35\r\n\r\n'
+            b'GET /smuggled HTTP/1.1\r\nHost: x\r\n\r\n'
+        )
+        self.assertEqual(response.count(b'HTTP/1.1 '), 1)
+        self.assertTrue(response.endswith(b'\r\n\r\nGET /smuggled HTTP/1.1\r\nHost: x\r\n\r\n'))
+
+    def test_max_body_size(self):
+        server = start_server(self.server_class, self.app, max_body_size=4)
+        response = request(
+            server.address,
+            b'POST / HTTP/1.1\r\nHost: localhost\r\nContent-Length: 5\r\n\r\nGuido'
+        )
+        self.assertTrue(response.startswith(b'HTTP/1.1 413 Payload Too Large\r\n'))
+        self.assertIn(b'Connection: close', response)
+
+    def test_http10_closes(self):
+        response = request(self.server.address, b'GET /x HTTP/1.0\r\nHost: localhost\r\n\r\n')
+        self.assertIn(b'Connection: close', response)
+
+    def test_max_requests(self):
+        server = start_server(self.server_class, self.app, max_requests=2)
+        response = request(
+            server.address,
+            b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n' * 3
+        )
+        self.assertEqual(response.count(b'HTTP/1.1 200 OK'), 2)
+        self.assertIn(b'Connection: close', response)
+
+    def test_idle_connections_free_workers(self):
+        server = start_server(self.server_class, self.app, threads=2)
+        idle = [http.client.HTTPConnection(*server.address, timeout=5) for _ in range(2)]
+        for conn in idle:
+            conn.request('GET', '/')
+            conn.getresponse().read()
+        start = time.monotonic()
+        response = request(server.address, b'GET / HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n')
+        self.assertTrue(response.startswith(b'HTTP/1.1 200 OK\r\n'))
+        self.assertLess(time.monotonic() - start, 1)
+        for conn in idle:
+            conn.close()
+
+    def test_idle_timeout(self):
+        server = start_server(self.server_class, self.app, keepalive_timeout=0.2)
+        start = time.monotonic()
+        response = request(server.address, b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        self.assertIn(b'Connection: keep-alive', response)
+        self.assertLess(time.monotonic() - start, 2)
+
+
+class SelectorServerTest(ServerTest):
+    server_class = SelectorServer
+
+    def test_split_request(self):
+        with socket.create_connection(self.server.address, timeout=5) as conn:
+            conn.sendall(b'POST / HTTP/1.1\r\nConnection: close\r\nHost: local')
+            conn.sendall(b'host\r\nContent-Length: 5\r\n\r\nGu')
+            conn.sendall(b'ido')
+            response = b''.join(iter(lambda: conn.recv(4096), b''))
+        self.assertTrue(response.endswith(b'\r\n\r\nGuido'))
+
+    def test_bad_request(self):
+        response = request(self.server.address, b'GET / HTTP/1.1\r\n\r\n')
+        self.assertTrue(response.startswith(b'HTTP/1.1 400 Bad Request'))
+
+    def test_large_body(self):
+        def head_app(environ, start_response):
+            rep = Response(body=environ['wsgi.input'].read(5))
+            start_response(rep.status, rep.headers)
+            return rep
+
+        server = start_server(self.server_class, head_app, max_body_size=10 ** 10)
+        server.max_buffered_body = 16
+        with socket.create_connection(server.address, timeout=5) as conn:
+            # Served before the body is received, nor held whole by the loop
+            conn.sendall(b'POST / HTTP/1.1\r\nHost: localhost\r\nContent-Length: 10000000000\r\n\r\nGuido')
+            response = b''
+            while not response.endswith(b'Guido') and (chunk := conn.recv(4096)):
+                response += chunk
+        self.assertTrue(response.startswith(b'HTTP/1.1 200 OK\r\n'))
+
+    def test_idle_connections(self):
+        idle = [socket.create_connection(self.server.address) for _ in range(100)]
+        try:
+            self.test_get()
+        finally:
+            for conn in idle:
+                conn.close()
+
+
+class SendfileTest(unittest.TestCase):
+    content = bytes(range(256)) * 1024
+
+    @classmethod
+    def setUpClass(cls):
+        cls.file = tempfile.NamedTemporaryFile()
+        cls.file.write(cls.content)
+        cls.file.flush()
+
+        def file_app(environ, start_response):
+            rep = FileResponse(cls.file.name, Request(environ))
+            start_response(rep.status, rep.headers)
+            return environ['wsgi.file_wrapper'](rep.open(), BLOCK_SIZE)
+
+        cls.server = start_server(Server, file_app)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.file.close()
+
+    def test_sendfile(self):
+        conn = http.client.HTTPConnection(*self.server.address, timeout=5)
+        conn.request('GET', '/')
+        response = conn.getresponse()
+        self.assertEqual(response.read(), self.content)
+
+        conn.request('GET', '/', headers={'Range': 'bytes=1000-1999'})
+        response = conn.getresponse()
+        self.assertEqual(response.status, 206)
+        self.assertEqual(response.read(), self.content[1000:2000])
+
+        conn.request('GET', '/', headers={'If-None-Match': response.getheader('ETag')})
+        response = conn.getresponse()
+        self.assertEqual(response.status, 304)
+        self.assertEqual(response.read(), b'')
+        self.assertEqual(response.getheader('Connection'), 'keep-alive')
+        conn.close()
+
+
+class AsyncBodyTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        async def app(scope, receive, send):
+            sizes = []
+            more_body = True
+            while more_body:
+                message = await receive()
+                sizes.append(len(message['body']))
+                more_body = message['more_body']
+            body = f'{len(sizes)} {max(sizes)} {sum(sizes)}'.encode()
+            await send({'type': 'http.response.start', 'status': 200,
+                        'headers': [(b'content-length', str(len(body)).encode())]})
+            await send({'type': 'http.response.body', 'body': body})
+
+        cls.server = start_server(AsyncServer, app)
+
+    def test_streamed(self):
+        conn = http.client.HTTPConnection(*self.server.address, timeout=5)
+        conn.request('POST', '/', body=b'x' * 1000000)
+        pieces, largest, total = map(int, conn.getresponse().read().split())
+        self.assertGreater(pieces, 1)
+        self.assertLessEqual(largest, RECV_SIZE)
+        self.assertEqual(total, 1000000)
+        # The connection is still in step
+        conn.request('POST', '/', body=b'xyz')
+        self.assertEqual(conn.getresponse().read(), b'1 3 3')
+        conn.close()
+
+
+class AsyncSendfileTest(unittest.TestCase):
+    content = bytes(range(256)) * 1024
+
+    @classmethod
+    def setUpClass(cls):
+        cls.file = tempfile.NamedTemporaryFile()
+        cls.file.write(cls.content)
+        cls.file.flush()
+
+        app = AsgiApplication.__new__(AsgiApplication)
+        app.executor = None
+
+        async def build_response_async(request):
+            return FileResponse(cls.file.name, request)
+
+        app.build_response_async = build_response_async
+        cls.server = start_server(AsyncServer, app)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.file.close()
+
+    def test_file(self):
+        conn = http.client.HTTPConnection(*self.server.address, timeout=5)
+        conn.request('GET', '/')
+        response = conn.getresponse()
+        self.assertEqual(response.getheader('Content-Length'), str(len(self.content)))
+        self.assertIsNone(response.getheader('Transfer-Encoding'))
+        self.assertEqual(response.read(), self.content)
+
+        conn.request('GET', '/', headers={'Range': 'bytes=1000-1999'})
+        response = conn.getresponse()
+        self.assertEqual(response.status, 206)
+        self.assertEqual(response.read(), self.content[1000:2000])
+
+        conn.request('GET', '/', headers={'If-None-Match': response.getheader('ETag')})
+        response = conn.getresponse()
+        self.assertEqual(response.status, 304)
+        self.assertEqual(response.read(), b'')
+        self.assertEqual(response.getheader('Connection'), 'keep-alive')
+        conn.close()
+
+
+class AsyncServerTest(ServerTest):
+    server_class = AsyncServer
+    app = staticmethod(asgi_echo_app)
+
+
+class StreamingTest(unittest.TestCase):
+    server_class = Server
+    app = staticmethod(stream_app)
+    content = ''.join(f'{i},' for i in range(1000)).encode()
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = start_server(cls.server_class, cls.app)
+
+    def test_chunked(self):
+        conn = http.client.HTTPConnection(*self.server.address, timeout=5)
+        for _ in range(2):
+            conn.request('GET', '/')
+            response = conn.getresponse()
+            self.assertEqual(response.getheader('Transfer-Encoding'), 'chunked')
+            self.assertIsNone(response.getheader('Content-Length'))
+            self.assertEqual(response.read(), self.content)
+            self.assertEqual(response.getheader('Connection'), 'keep-alive')
+            sock = conn.sock
+        self.assertIs(conn.sock, sock)
+        conn.close()
+
+    def test_http10(self):
+        response = request(self.server.address, b'GET / HTTP/1.0\r\nHost: localhost\r\n\r\n')
+        self.assertNotIn(b'chunked', response)
+        self.assertIn(b'Connection: close', response)
+        self.assertTrue(response.endswith(b'\r\n\r\n' + self.content))
+
+
+class SelectorStreamingTest(StreamingTest):
+    server_class = SelectorServer
+
+
+class AsyncStreamingTest(StreamingTest):
+    server_class = AsyncServer
+    app = staticmethod(asgi_stream_app)
+
+
+class HTTPSocketIOTest(unittest.TestCase):
+    def setUp(self):
+        self.reader, self.writer = socket.socketpair()
+        self.http_io = HTTPSocketIO(self.reader)
+
+    def tearDown(self):
+        self.reader.close()
+        self.writer.close()
+
+    def test_head_and_body(self):
+        self.writer.sendall(
+            b'POST / HTTP/1.1\r\nHost: localhost\r\nContent-Length: 11\r\n\r\n'
+            b'line1\nline2GET /next'
+        )
+        head = self.http_io.read_head()
+        self.assertTrue(head.endswith(b'Content-Length: 11\r\n\r\n'))
+        stream = InputStream(self.http_io, 11)
+        self.assertEqual(list(stream), [b'line1\n', b'line2'])
+        self.assertEqual(stream.read(), b'')
+        self.assertEqual(self.http_io.read(9), b'GET /next')
+
+    def test_read_grows(self):
+        # The declared length isn't allocated ahead of the bytes
+        self.writer.sendall(b'hello')
+        self.writer.close()
+        tracemalloc.start()
+        data = InputStream(self.http_io, 2 ** 31).read()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        self.assertEqual(data, b'hello')
+        self.assertLess(peak, 1024 * 1024)
+
+    def test_large_read(self):
+        payload = bytes(range(256)) * 4096
+        sender = threading.Thread(target=self.writer.sendall, args=(payload,))
+        sender.start()
+        self.assertEqual(self.http_io.read(len(payload)), payload)
+        sender.join()
+
+    def test_bare_lf(self):
+        self.writer.sendall(b'GET / HTTP/1.0\nHost: localhost\n\n')
+        self.assertEqual(self.http_io.read_head(), b'GET / HTTP/1.0\nHost: localhost\n\n')
+
+    def test_eof(self):
+        self.writer.close()
+        self.assertEqual(self.http_io.read_head(), b'')
+
+
+class BuildEnvironTest(unittest.TestCase):
+    def test_line_ends(self):
+        # Only CRLF and LF end lines, NEL is a character of the value
+        environ = Server.build_environ(b'POST / HTTP/1.1\r\nHost: x\r\nX-A: a\x85Content-Length: 5\r\n\r\n')
+        self.assertNotIn('CONTENT_LENGTH', environ)
+        self.assertEqual(environ['HTTP_X_A'], 'a\x85Content-Length: 5')
+        environ = Server.build_environ(b'GET / HTTP/1.1\nHost: x\nX-A: a\n\n')
+        self.assertEqual(environ['HTTP_X_A'], 'a')
+
+    def test_control_chars(self):
+        for char in (b'\x00', b'\x0b', b'\x0c', b'\x1c', b'\x1e', b'\r', b'\x7f'):
+            with self.assertRaises(RequestError):
+                Server.build_environ(b'POST / HTTP/1.1\r\nHost: x\r\nX-A: a' + char + b'Content-Length: 5\r\n\r\n')
+        environ = Server.build_environ(b'GET / HTTP/1.1\r\nHost: x\r\nX-A: a\tb\r\n\r\n')
+        self.assertEqual(environ['HTTP_X_A'], 'a\tb')
+
+
+class WorkerPoolTest(unittest.TestCase):
+    def _burst(self, **kwargs):
+        server = start_server(Server, slow_app, threads=1, queue_size=1, **kwargs)
+        results = [None] * 4
+
+        def call(i):
+            results[i] = request(
+                server.address,
+                b'GET / HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n'
+            )
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return server, results
+
+    def test_reject_when_full(self):
+        server, results = self._burst()
+        statuses = sorted(r.split(b'\r\n', 1)[0] for r in results)
+        self.assertIn(b'HTTP/1.1 503 Service Unavailable', statuses)
+        self.assertIn(b'HTTP/1.1 200 OK', statuses)
+        self.assertEqual(server.pool.stats()['rejected'], statuses.count(b'HTTP/1.1 503 Service Unavailable'))
+
+    def test_wait_when_full(self):
+        server, results = self._burst(block_when_full=True)
+        self.assertTrue(all(r.startswith(b'HTTP/1.1 200 OK') for r in results))
+        stats = server.pool.stats()
+        self.assertEqual(stats['rejected'], 0)
+        self.assertGreater(stats['max_wait'], 0.2)
+
+
+PREFORK_SCRIPT = """
+import os
+from webgo.servers import Server, Arbiter
+from webgo.wsgirequest import Response
+
+def app(environ, start_response):
+    rep = Response(body=str(os.getpid()))
+    start_response(rep.status, rep.headers)
+    return rep
+
+def make_server():
+    server = Server(('127.0.0.1', 0))
+    server.set_app(app)
+    print(server.address[1], flush=True)
+    return server
+
+Arbiter(make_server, 2, graceful_timeout=5).run()
+"""
+
+
+class ArbiterTest(unittest.TestCase):
+    def setUp(self):
+        self.proc = subprocess.Popen(
+            [sys.executable, '-c', PREFORK_SCRIPT],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        )
+        self.address = ('127.0.0.1', int(self.proc.stdout.readline()))
+
+    def tearDown(self):
+        if self.proc.poll() is None:
+            self.proc.terminate()
+        self.proc.wait()
+        self.proc.stdout.close()
+
+    def worker_pid(self):
+        response = request(
+            self.address,
+            b'GET / HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n'
+        )
+        return int(response.rsplit(b'\r\n\r\n', 1)[1])
+
+    def test_restart_and_terminate(self):
+        pid = self.worker_pid()
+        self.assertNotEqual(pid, self.proc.pid)
+        os.kill(pid, signal.SIGKILL)
+
+        deadline = time.monotonic() + 5
+        pids = set()
+        while len(pids - {pid}) < 2 and time.monotonic() < deadline:
+            try:
+                pids.add(self.worker_pid())
+            except ConnectionResetError:
+                # Accepted by the killed worker before the signal landed
+                pass
+        self.assertEqual(len(pids - {pid}), 2)
+
+        self.proc.send_signal(signal.SIGTERM)
+        self.assertEqual(self.proc.wait(timeout=10), 0)
@@ -0,0 +1,161 @@
+"""
+Usage:
+    $ python -m unittest tests/test_template.py
+"""
+
+import os
+import gzip
+import unittest
+import tempfile
+
+from webgo import template
+from webgo.template import AssetCache, AssetResponse, setup_templates
+from webgo.wsgirequest import Request, FileResponse
+
+
+def make_request(**headers):
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/'}
+    for name, value in headers.items():
+        environ[f'HTTP_{name.upper()}'] = value
+    return Request(environ)
+
+
+class AssetCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.css = self.write('demo.css', b'body { color: red; }\n' * 100)
+        self.png = self.write('logo.png', os.urandom(2048))
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write(self, name, content, mtime=None):
+        path = os.path.join(self.dir.name, name)
+        with open(path, 'wb') as fp:
+            fp.write(content)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def test_variants(self):
+        cache = AssetCache()
+        css = cache.get(self.css)
+        self.assertEqual(gzip.decompress(css.variants['gzip']), css.variants['identity'])
+        # Not compressible, only kept as is
+        self.assertEqual(list(cache.get(self.png).variants), ['identity'])
+        self.assertEqual(cache.size, css.size + 2048)
+
+    def test_negotiation(self):
+        cache = AssetCache(use_brotli=False)
+        asset = cache.get(self.css)
+
+        rep = AssetResponse(asset, make_request(accept_encoding='gzip, deflate'))
+        headers = dict(rep.headers)
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertEqual(headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(gzip.decompress(b''.join(rep)), asset.variants['identity'])
+
+        for accept_encoding in (None, 'identity', 'gzip;q=0'):
+            rep = AssetResponse(asset, make_request(accept_encoding=accept_encoding or ''))
+            self.assertNotIn('Content-Encoding', dict(rep.headers))
+            self.assertEqual(b''.join(rep), asset.variants['identity'])
+
+    def test_not_modified(self):
+        cache = AssetCache()
+        asset = cache.get(self.css)
+        etag = dict(FileResponse(self.css).headers)['ETag']
+        rep = AssetResponse(asset, make_request(if_none_match=etag))
+        self.assertEqual(rep.status, '304 Not Modified')
+        self.assertEqual(b''.join(rep), b'')
+
+        etag = asset.etag('gzip')
+        rep = AssetResponse(asset, make_request(if_none_match=etag, accept_encoding='gzip'))
+        self.assertEqual(rep.status, '304 Not Modified')
+        rep = AssetResponse(asset, make_request(if_none_match=etag))
+        self.assertEqual(rep.status, '200 OK')
+
+    def test_mtime_invalidation(self):
+        cache = AssetCache()
+        self.assertIs(cache.get(self.css), cache.get(self.css))
+        self.assertEqual(cache.stats()['hits'], 1)
+
+        self.write('demo.css', b'p {}', mtime=os.stat(self.css).st_mtime + 10)
+        asset = cache.get(self.css)
+        self.assertEqual(asset.variants, {'identity': b'p {}'})
+        self.assertEqual(cache.size, asset.size)
+
+    def test_lru_eviction(self):
+        paths = [self.write(f'{i}.bin', bytes(1000)) for i in range(3)]
+        cache = AssetCache(max_size=2500)
+        cache.get(paths[0])
+        cache.get(paths[1])
+        cache.get(paths[0])
+        cache.get(paths[2])
+        self.assertIn(paths[0], cache)
+        self.assertNotIn(paths[1], cache)
+        self.assertEqual(cache.size, 2000)
+
+    def test_too_large(self):
+        cache = AssetCache(max_file_size=1024)
+        self.assertIsNone(cache.get(self.png))
+        self.assertEqual(cache.size, 0)
+
+    def test_preload(self):
+        cache = AssetCache(max_size=1)
+        cache.preload([self.css, os.path.join(self.dir.name, 'missing.js')])
+        self.assertEqual(cache.size, 0)
+        cache = AssetCache()
+        cache.preload([self.css, self.png, os.path.join(self.dir.name, 'missing.js')])
+        self.assertEqual(cache.stats()['files'], 2)
+
+
+class TemplateEnvironmentTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.templates = os.path.join(self.dir.name, 'templates')
+        self.cache = os.path.join(self.dir.name, 'cache')
+        os.makedirs(os.path.join(self.templates, 'parts'))
+        self.write('index.html', '{% include "parts/title.html" %} {{ name }}')
+        self.write('parts/title.html', '<h1>Hello</h1>')
+
+    def tearDown(self):
+        template.env = None
+        self.dir.cleanup()
+
+    def write(self, name, content):
+        path = os.path.join(self.templates, name)
+        with open(path, 'w') as fp:
+            fp.write(content)
+        # Newer than the compiled template, whatever the clock resolution
+        os.utime(path, (os.path.getmtime(path) + 10,) * 2)
+
+    def render(self):
+        return template.render(None, 'index.html', {'name': 'Guido'})
+
+    def test_reload(self):
+        setup_templates(self.templates)
+        self.assertEqual(self.render(), '<h1>Hello</h1> Guido')
+        self.write('parts/title.html', '<h1>Bye</h1>')
+        self.assertEqual(self.render(), '<h1>Bye</h1> Guido')
+
+    def test_production(self):
+        setup_templates(self.templates, auto_reload=False, bytecode_cache=self.cache, precompile=True)
+        self.assertEqual(len(os.listdir(self.cache)), 2)
+        self.write('parts/title.html', '<h1>Bye</h1>')
+        # Compiled once, not checked again
+        self.assertEqual(self.render(), '<h1>Hello</h1> Guido')
+
+    def test_bytecode_cache(self):
+        setup_templates(self.templates, auto_reload=False, bytecode_cache=self.cache, precompile=True)
+        compiled = set(os.listdir(self.cache))
+        env = setup_templates(self.templates, auto_reload=False, bytecode_cache=self.cache)
+        # Loaded from the cache, nothing compiled
+        env.compile = None
+        self.assertEqual(self.render(), '<h1>Hello</h1> Guido')
+        self.assertEqual(set(os.listdir(self.cache)), compiled)
+
+    def test_stream(self):
+        setup_templates(self.templates)
+        pieces = list(template.stream(None, 'index.html', {'name': 'Guido'}, buffer_size=1))
+        self.assertGreater(len(pieces), 1)
+        self.assertEqual(''.join(pieces), '<h1>Hello</h1> Guido')
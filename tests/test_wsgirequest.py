@@ -0,0 +1,127 @@
+"""
+Usage:
+    $ python -m unittest tests/test_wsgirequest.py
+"""
+
+import os
+import unittest
+import tempfile
+from email.utils import formatdate
+
+from webgo.wsgirequest import Request, Response, FileResponse
+
+
+def make_request(**headers):
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/'}
+    for name, value in headers.items():
+        environ[f'HTTP_{name.upper()}'] = value
+    return Request(environ)
+
+
+class ResponseTest(unittest.TestCase):
+    def test_str(self):
+        rep = Response(body='hello')
+        self.assertEqual(rep.content_length, 5)
+        self.assertEqual(list(rep), [b'hello'])
+
+    def test_encoding(self):
+        rep = Response(body='héllo wörld ✓')
+        self.assertEqual(b''.join(rep), 'héllo wörld ✓'.encode())
+        headers = dict(rep.headers)
+        self.assertEqual(headers['Content-type'], 'text/html; charset=utf-8')
+        self.assertEqual(headers['Content-Length'], str(len('héllo wörld ✓'.encode())))
+        # Encoded once, the same buffer is handed out
+        self.assertIs(next(iter(rep)), next(iter(rep)))
+
+        rep = Response(body='{"a": "é"}', content_type='application/json', charset='latin-1')
+        self.assertEqual(dict(rep.headers)['Content-type'], 'application/json; charset=latin-1')
+        self.assertEqual(rep.content_length, 10)
+
+    def test_bytes(self):
+        data = bytes(range(256))
+        rep = Response(body=memoryview(data)[16:], content_type='application/octet-stream')
+        self.assertEqual(rep.content_length, 240)
+        self.assertEqual(dict(rep.headers)['Content-type'], 'application/octet-stream')
+        self.assertEqual(b''.join(rep), data[16:])
+        self.assertEqual(list(Response(body=b'')), [])
+
+    def test_status_and_headers(self):
+        rep = Response(body='', status=201, headers={'Location': '/user/1'})
+        self.assertEqual(rep.status, '201 Created')
+        self.assertEqual(dict(rep.headers)['Location'], '/user/1')
+        self.assertEqual(dict(rep.headers)['Content-Length'], '0')
+        self.assertNotIn('Content-Length', dict(Response(status=304).headers))
+
+    def test_streamed(self):
+        closed = []
+
+        def pieces():
+            try:
+                yield 'hello'
+                yield ''
+                yield b' world'
+            finally:
+                closed.append(True)
+
+        rep = Response(body=pieces())
+        self.assertIsNone(rep.content_length)
+        chunks = iter(rep)
+        self.assertEqual(next(chunks), b'hello')
+        rep.close()
+        self.assertEqual(closed, [True])
+
+        self.assertEqual(list(Response(body=pieces())), [b'hello', b' world'])
+
+
+class FileResponseTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'logo.png')
+        self.content = bytes(range(256)) * 4
+        with open(self.path, 'wb') as fp:
+            fp.write(self.content)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_whole_file(self):
+        rep = FileResponse(self.path, make_request(), content_type='image/png')
+        self.assertEqual(rep.status, '200 OK')
+        self.assertEqual(b''.join(rep), self.content)
+        headers = dict(rep.headers)
+        self.assertEqual(headers['Content-type'], 'image/png')
+        self.assertEqual(headers['Content-Length'], len(self.content))
+        self.assertEqual(headers['ETag'], rep.etag)
+
+    def test_if_none_match(self):
+        etag = FileResponse(self.path).etag
+        rep = FileResponse(self.path, make_request(if_none_match=f'"other", W/{etag}'))
+        self.assertEqual(rep.status, '304 Not Modified')
+        self.assertEqual(b''.join(rep), b'')
+        self.assertNotIn('Content-Length', dict(rep.headers))
+
+        rep = FileResponse(self.path, make_request(if_none_match='"other"'))
+        self.assertEqual(rep.status, '200 OK')
+
+    def test_if_modified_since(self):
+        mtime = os.stat(self.path).st_mtime
+        rep = FileResponse(self.path, make_request(if_modified_since=formatdate(mtime, usegmt=True)))
+        self.assertEqual(rep.status, '304 Not Modified')
+        rep = FileResponse(self.path, make_request(if_modified_since=formatdate(mtime - 60, usegmt=True)))
+        self.assertEqual(rep.status, '200 OK')
+
+    def test_range(self):
+        for spec, first, last in (('10-19', 10, 19), ('1000-', 1000, 1023), ('-24', 1000, 1023), ('1020-2000', 1020, 1023)):
+            rep = FileResponse(self.path, make_request(range=f'bytes={spec}'))
+            self.assertEqual(rep.status, '206 Partial Content')
+            self.assertEqual(b''.join(rep), self.content[first:last + 1])
+            self.assertEqual(dict(rep.headers)['Content-Range'], f'bytes {first}-{last}/1024')
+
+    def test_range_not_satisfiable(self):
+        rep = FileResponse(self.path, make_request(range='bytes=2000-'))
+        self.assertEqual(rep.status, '416 Range Not Satisfiable')
+        self.assertEqual(dict(rep.headers)['Content-Range'], 'bytes */1024')
+
+    def test_if_range_mismatch(self):
+        rep = FileResponse(self.path, make_request(range='bytes=0-9', if_range='"stale"'))
+        self.assertEqual(rep.status, '200 OK')
@@ -9,6 +9,24 @@ logging.basicConfig(
 
 DB_FILE = 'sqlite.db'
 
+# Connections kept open to the database by each process
+DB_POOL_SIZE = 8
+
+# Seconds a connection waits for another to release a lock
+DB_BUSY_TIMEOUT = 5
+
+# Prepared statements kept by each connection, reused when the same SQL runs again
+DB_CACHED_STATEMENTS = 256
+
+# Applied once to every new connection
+DB_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'mmap_size': 64 * 1024 * 1024,
+    # Negative means KiB rather than pages
+    'cache_size': -16 * 1024,
+}
+
 project = None
 
 
@@ -1,2 +1,17 @@
 class FieldError(Exception):
     pass
+
+
+class PoolTimeout(Exception):
+    """ No database connection was released in time """
+
+
+class NotFound(Exception):
+    """ No route matches the path """
+
+
+class MethodNotAllowed(Exception):
+    """ The path is routed, but not for the method """
+    def __init__(self, allowed):
+        super().__init__(allowed)
+        self.allowed = allowed
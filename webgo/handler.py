@@ -1,30 +1,37 @@
 import webob
+import inspect
 from typing import Callable, NewType
 
 Request = NewType('Request', webob.Request)
 
 
-def get(path):
-    return _query(path, method='GET')
+def get(path, cache=None):
+    return _query(path, method='GET', cache=cache)
 
 
 def post(path):
     return _query(path, method='POST')
 
 
-def _query(path, method):
-    return lambda func: _Handler(func, path, method=method)
+def _query(path, method, cache=None):
+    return lambda func: _Handler(func, path, method=method, cache=cache)
 
 
 class _Handler:
     """ Handlers wrap functions to provide resource interface
     They handle requests by calling the underlying functions
+
+    The functions may be ``async def``, then ``response_attached`` returns a coroutine.
+    Parameters of the path, like ``id`` of '/user/<int:id>', are passed as keywords.
+    ``cache`` is the seconds responses can be cached for, sent as Cache-Control max-age.
     """
-    def __init__(self, func: Callable[[Request], str], path, method):
+    def __init__(self, func: Callable[[Request], str], path, method, cache=None):
         self.origin_func = func
         self.path = path
         self.method = method
+        self.cache = cache
+        self.is_async = inspect.iscoroutinefunction(func)
 
-    def response_attached(self, request) -> str:
-        return self.origin_func(request)
+    def response_attached(self, request, **params) -> str:
+        return self.origin_func(request, **params)
 
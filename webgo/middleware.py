@@ -0,0 +1,630 @@
+import json
+import time
+import zlib
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+
+from webgo.template import MIN_COMPRESS_SIZE, brotli, _compressible, _parse_accept_encoding
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SIZE = 32 * 1024 * 1024
+# Larger bodies are sent but not kept
+DEFAULT_MAX_ENTRY_SIZE = 1024 * 1024
+# Seconds a request waits for the one computing the same response
+WAIT_TIMEOUT = 10
+# Seconds another worker is left to refresh an entry before trying itself
+LEASE_TIMEOUT = 30
+# Seconds a write waits for another worker's to finish
+BUSY_TIMEOUT = 5
+# Keys whose responses weren't kept last time, remembered at most
+MAX_UNCACHEABLE_KEYS = 4096
+
+CACHEABLE_METHODS = ('GET', 'HEAD')
+# Requests on behalf of a user, whose responses are the user's
+CREDENTIAL_HEADERS = ('HTTP_AUTHORIZATION', 'HTTP_COOKIE')
+# Responses to those that may be shared still, refer to RFC 7234 section 3.2
+SHARED_DIRECTIVES = {'public', 's-maxage', 'must-revalidate'}
+# Responses for one client only, or that mustn't be kept
+UNCACHEABLE_DIRECTIVES = {'no-store', 'no-cache', 'private'}
+
+
+class CacheEntry:
+    """ A response kept by a cache backend """
+    __slots__ = ('status', 'headers', 'body', 'expires')
+
+    def __init__(self, status, headers, body, expires):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.expires = expires
+
+    @property
+    def fresh(self):
+        return self.expires > time.time()
+
+    @property
+    def size(self):
+        return len(self.body) + sum(len(k) + len(str(v)) for k, v in self.headers)
+
+
+class MemoryCacheBackend:
+    """ Entries kept in the memory of the process, up to ``max_size`` bytes
+
+    The least recently used entries are evicted first.
+    """
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE):
+        self.max_size = max_size
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = entry
+            self.size += entry.size + len(key)
+            while self.size > self.max_size:
+                self._discard(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.size + len(key)
+
+    def lease(self, key, timeout=LEASE_TIMEOUT):
+        """ Whether this process may refresh ``key``, always as no other shares the entries """
+        return True
+
+    def release(self, key):
+        pass
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCacheBackend:
+    """ Entries kept in a SQLite database, shared by all processes using the file
+
+    Worker processes then render a response once between all of them,
+    and entries outlive restarts. Least recently used entries are deleted
+    once the bodies take more than ``max_size`` bytes.
+    """
+    def __init__(self, path, max_size=DEFAULT_CACHE_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    key TEXT PRIMARY KEY, status TEXT, headers TEXT, body BLOB,
+                    size INTEGER, expires REAL, used REAL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_response_cache_used ON response_cache (used)")
+            conn.execute("CREATE TABLE IF NOT EXISTS response_cache_lease (key TEXT PRIMARY KEY, until REAL)")
+
+    def _connect(self):
+        # One connection per thread, opened once
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)
+            conn.execute('PRAGMA journal_mode=wal')
+            conn.execute('PRAGMA synchronous=normal')
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT status, headers, body, expires, used FROM response_cache WHERE key=?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        status, headers, body, expires, used = row
+        now = time.time()
+        # Recency is coarse, to spare a write on most hits
+        if used < now - 1:
+            self._touch(conn, key, now)
+        return CacheEntry(status, [tuple(header) for header in json.loads(headers)], body, expires)
+
+    @staticmethod
+    def _touch(conn, key, now):
+        """ Mark ``key`` used, unless another worker is writing
+
+        Recency only orders evictions, a hit mustn't wait on the write lock for it.
+        """
+        conn.execute('PRAGMA busy_timeout=0')
+        try:
+            with conn:
+                conn.execute("UPDATE response_cache SET used=? WHERE key=?", (now, key))
+        except sqlite3.OperationalError:
+            pass
+        finally:
+            conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT * 1000}')
+
+    def set(self, key, entry):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, entry.status, json.dumps(entry.headers), entry.body,
+                 entry.size + len(key), entry.expires, time.time()),
+            )
+            size = conn.execute("SELECT total(size) FROM response_cache").fetchone()[0]
+            if size > self.max_size:
+                self._evict(conn, size - self.max_size)
+
+    @staticmethod
+    def _evict(conn, excess):
+        """ Delete the least recently used entries until ``excess`` bytes are freed """
+        rows = conn.execute("SELECT key, size FROM response_cache ORDER BY used")
+        keys = []
+        for key, size in rows:
+            keys.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        conn.executemany("DELETE FROM response_cache WHERE key=?", keys)
+
+    def delete(self, key):
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM response_cache WHERE key=?", (key,))
+
+    def lease(self, key, timeout=LEASE_TIMEOUT):
+        """ Whether this process may refresh ``key``, no other one being at it """
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            conn.execute("DELETE FROM response_cache_lease WHERE key=? AND until<?", (key, now))
+            return conn.execute(
+                "INSERT OR IGNORE INTO response_cache_lease VALUES (?, ?)", (key, now + timeout)
+            ).rowcount == 1
+
+    def release(self, key):
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM response_cache_lease WHERE key=?", (key,))
+
+    def clear(self):
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM response_cache")
+            conn.execute("DELETE FROM response_cache_lease")
+
+    def __len__(self):
+        return self._connect().execute("SELECT count(*) FROM response_cache").fetchone()[0]
+
+
+class ResponseCache:
+    """ Response-cache Middleware
+
+    Successful GET and HEAD responses are kept in ``backend`` and answered
+    from it until they expire, without calling the application.
+
+    How long a response is kept is, in this order:
+        - the TTL of the longest prefix of the path in ``routes``, 0 to never cache
+        - the max-age of its Cache-Control header, as ``@get(path, cache=60)`` sets
+        - ``ttl``, 0 to only cache responses with a max-age
+    Requests with Authorization or Cookie are never answered from the cache,
+    and their responses are only kept if Cache-Control says public, s-maxage or must-revalidate.
+    Responses with Set-Cookie, or Cache-Control private, no-store or no-cache aren't kept,
+    nor those without a Content-Length or longer than ``max_entry_size``, which are
+    streamed as they come.
+
+    The key is made of the method, path, query string and the ``vary`` request headers.
+
+    Only one request computes a missing or expired response at a time.
+    Requests for it meanwhile get the expired one, or wait for the new one.
+    Those for responses that weren't kept last time don't wait for each other.
+    """
+    def __init__(
+            self,
+            app,
+            backend=None,
+            ttl=0,
+            routes=None,
+            vary=('Accept-Encoding',),
+            max_entry_size=DEFAULT_MAX_ENTRY_SIZE,
+    ):
+        self.app = app
+        self.backend = MemoryCacheBackend() if backend is None else backend
+        self.ttl = ttl
+        # Longest prefixes first
+        self.routes = sorted((routes or {}).items(), key=lambda item: len(item[0]), reverse=True)
+        self.vary = [f"HTTP_{name.upper().replace('-', '_')}" for name in vary]
+        self.varied = {name.lower() for name in vary}
+        self.max_entry_size = max_entry_size
+        self._stats = {'hits': 0, 'misses': 0, 'stale': 0}
+        # Events of the keys being computed, set once they are
+        self._computing = {}
+        # Keys whose last response wasn't kept, least recently seen first
+        self._uncacheable = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, environ):
+        return '\n'.join([
+            environ['REQUEST_METHOD'],
+            environ['PATH_INFO'],
+            environ.get('QUERY_STRING', ''),
+            *(environ.get(name, '') for name in self.vary),
+        ])
+
+    def route_ttl(self, path):
+        for prefix, ttl in self.routes:
+            if path.startswith(prefix):
+                return ttl
+        return None
+
+    def __call__(self, environ, start_response):
+        route_ttl = self.route_ttl(environ['PATH_INFO'])
+        if environ['REQUEST_METHOD'] not in CACHEABLE_METHODS or route_ttl == 0:
+            return self.app(environ, start_response)
+
+        key = self.key(environ)
+        if any(name in environ for name in CREDENTIAL_HEADERS):
+            # Possibly personalized, it's kept only if it says it can be shared
+            self._count('misses')
+            return self._compute(key, environ, start_response, route_ttl, shared=True)
+
+        entry = self.backend.get(key)
+        if entry is not None and entry.fresh:
+            self._count('hits')
+            return self._send(entry, start_response)
+        if entry is None and key in self._uncacheable:
+            # Not kept last time, waiting for another request wouldn't help
+            self._count('misses')
+            return self._compute(key, environ, start_response, route_ttl)
+
+        with self._lock:
+            event = self._computing.get(key)
+            if event is None:
+                self._computing[key] = threading.Event()
+        if event is not None:
+            # Another request is computing it
+            if entry is None:
+                event.wait(WAIT_TIMEOUT)
+                entry = self.backend.get(key)
+            if entry is not None:
+                self._count('hits' if entry.fresh else 'stale')
+                return self._send(entry, start_response)
+            return self.app(environ, start_response)
+
+        try:
+            if entry is not None and not self.backend.lease(key):
+                # Refreshed by another process
+                self._count('stale')
+                return self._send(entry, start_response)
+            try:
+                self._count('misses')
+                return self._compute(key, environ, start_response, route_ttl)
+            finally:
+                self.backend.release(key)
+        finally:
+            with self._lock:
+                self._computing.pop(key).set()
+
+    def _compute(self, key, environ, start_response, route_ttl, shared=False):
+        """ Run the application, keep its response if allowed, and send it
+
+        With ``shared``, only responses Cache-Control says may be shared are kept,
+        those that aren't tell nothing of the key's other responses.
+        """
+        response = []
+
+        def capture(status, headers, exc_info=None):
+            response[:] = [status, list(headers)]
+            return start_response(status, headers, exc_info)
+
+        result = self.app(environ, capture)
+        if not response or isinstance(result, environ.get('wsgi.file_wrapper', ())):
+            # Files are sent from disk, not kept
+            return result
+        status, headers = response
+        ttl = self._ttl(status, headers, route_ttl, shared)
+        length = self._length(headers, result)
+        if not ttl or length is None or length > self.max_entry_size:
+            # Streamed, or too large to be kept, the body is sent as it comes
+            if not shared:
+                self._remember(key, kept=False)
+            return result
+
+        pieces = []
+        size = 0
+        iterator = iter(result)
+        for piece in iterator:
+            pieces.append(piece)
+            size += len(piece)
+            if size > self.max_entry_size:
+                # Longer than its Content-Length, the rest is streamed
+                if not shared:
+                    self._remember(key, kept=False)
+                return _resume(pieces, iterator, result)
+        if hasattr(result, 'close'):
+            result.close()
+        body = b''.join(pieces)
+        if not any(k.lower() == 'content-length' for k, _ in headers):
+            headers.append(('Content-Length', str(len(body))))
+        self.backend.set(key, CacheEntry(status, headers, body, time.time() + ttl))
+        self._remember(key, kept=True)
+        return [body]
+
+    def _remember(self, key, kept):
+        with self._lock:
+            if kept:
+                self._uncacheable.pop(key, None)
+                return
+            self._uncacheable[key] = True
+            self._uncacheable.move_to_end(key)
+            if len(self._uncacheable) > MAX_UNCACHEABLE_KEYS:
+                self._uncacheable.popitem(last=False)
+
+    @staticmethod
+    def _length(headers, result):
+        """ The length of the body if known before reading it, else None """
+        for name, value in headers:
+            if name.lower() == 'content-length':
+                return int(value)
+        if isinstance(result, (list, tuple)):
+            return sum(len(piece) for piece in result)
+        return getattr(result, 'content_length', None)
+
+    def _ttl(self, status, headers, route_ttl, shared=False):
+        """ Seconds the response can be kept, 0 if it can't """
+        if not status.startswith('200'):
+            return 0
+        header_names = {k.lower(): str(v) for k, v in headers}
+        if 'set-cookie' in header_names:
+            return 0
+        vary = {name.strip().lower() for name in header_names.get('vary', '').split(',')} - {''}
+        if not vary <= self.varied:
+            # It depends on headers the key isn't made of
+            return 0
+        directives = {}
+        for directive in header_names.get('cache-control', '').split(','):
+            name, _, value = directive.strip().lower().partition('=')
+            directives[name] = value
+        if UNCACHEABLE_DIRECTIVES & directives.keys():
+            return 0
+        if shared and not SHARED_DIRECTIVES & directives.keys():
+            return 0
+        if route_ttl is not None:
+            return route_ttl
+        try:
+            return int(directives.get('s-maxage') or directives['max-age'])
+        except (KeyError, ValueError):
+            return self.ttl
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        """ Entries kept, responses answered from them, fresh or expired, and computed """
+        with self._lock:
+            return {'entries': len(self.backend), **self._stats}
+
+    @staticmethod
+    def _send(entry, start_response):
+        start_response(entry.status, list(entry.headers))
+        return [entry.body]
+
+
+def _resume(pieces, iterator, result):
+    """ Send the ``pieces`` read, then the rest of ``result`` """
+    try:
+        yield from pieces
+        yield from iterator
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+
+
+class _ZlibCompressor:
+    """ gzip, or deflate which is the zlib format in HTTP """
+    def __init__(self, wbits, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+
+    def compress(self, data):
+        # Flushed, so each piece of a stream reaches the client as it's produced
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class _BrotliCompressor:
+    def __init__(self, level):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class _ZstdCompressor:
+    def __init__(self, level):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data) + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+# Encodings by preference, with their compressor for a level of 1 to 9
+COMPRESSORS = {
+    'br': lambda level: _BrotliCompressor(level),
+    'zstd': lambda level: _ZstdCompressor(level),
+    'gzip': lambda level: _ZlibCompressor(16 + zlib.MAX_WBITS, level),
+    'deflate': lambda level: _ZlibCompressor(zlib.MAX_WBITS, level),
+}
+AVAILABLE_ENCODINGS = tuple(
+    encoding for encoding, module in (('br', brotli), ('zstd', zstandard), ('gzip', zlib), ('deflate', zlib))
+    if module is not None
+)
+DEFAULT_COMPRESS_LEVEL = 6
+
+
+class _CompressedBody:
+    """ The body of a response compressed piece by piece as it's sent """
+    def __init__(self, result, compressor):
+        self.result = result
+        self.compressor = compressor
+
+    def __iter__(self):
+        for data in self.result:
+            if data:
+                if data := self.compressor.compress(data):
+                    yield data
+        yield self.compressor.finish()
+
+    def close(self):
+        if hasattr(self.result, 'close'):
+            self.result.close()
+
+
+class Compress:
+    """ Compression Middleware
+
+    Responses are compressed in the encoding preferred by Accept-Encoding,
+    among ``encodings``: brotli and zstd when installed, gzip and deflate.
+    Only textual types are, not images, archives and the like whose
+    Content-Type, as static files get it from their extension, says are compressed already.
+    Bodies of known length shorter than ``min_size`` are left as they are,
+    streamed ones are compressed as their pieces come, keeping memory bounded.
+    Responses encoded already, partial or without content aren't touched.
+    """
+    def __init__(self, app, min_size=MIN_COMPRESS_SIZE, level=DEFAULT_COMPRESS_LEVEL, encodings=AVAILABLE_ENCODINGS):
+        self.app = app
+        self.min_size = min_size
+        self.level = level
+        self.encodings = [encoding for encoding in AVAILABLE_ENCODINGS if encoding in encodings]
+
+    def negotiate(self, accept_encoding):
+        """ The encoding to compress in, None for none """
+        if not accept_encoding:
+            return None
+        accepted = _parse_accept_encoding(accept_encoding)
+        best, quality = None, 0
+        for encoding in self.encodings:
+            q = accepted.get(encoding, accepted.get('*', 0))
+            if q > quality:
+                best, quality = encoding, q
+        return best
+
+    def __call__(self, environ, start_response):
+        response = []
+        started = []
+
+        def capture(status, headers, exc_info=None):
+            response[:] = [status, list(headers), exc_info]
+            return write
+
+        def write(data):
+            # Written before the body is returned, sent as is
+            if not started:
+                started.append(start_response(*response))
+            return started[0](data)
+
+        encoding = self.negotiate(environ.get('HTTP_ACCEPT_ENCODING'))
+        # Tags of compressed responses, validated by the application as the uncompressed ones
+        tags = {}
+        if encoding is not None and 'HTTP_IF_NONE_MATCH' in environ:
+            tags = _strip_encoding(environ['HTTP_IF_NONE_MATCH'], encoding)
+            if tags:
+                environ = dict(environ, HTTP_IF_NONE_MATCH=', '.join([environ['HTTP_IF_NONE_MATCH'], *tags]))
+
+        result = self.app(environ, capture)
+        if started:
+            return result
+        status, headers, exc_info = response
+        header_names = {k.lower(): str(v) for k, v in headers}
+        if status.startswith('304') and header_names.get('etag') in tags:
+            # What the client holds is the compressed response
+            headers = _set_header(headers, 'ETag', tags[header_names['etag']])
+        content_type = header_names.get('content-type', '').partition(';')[0].strip()
+        if not _compressible(content_type) and not content_type.endswith(('+json', '+xml')):
+            start_response(status, headers, exc_info)
+            return result
+
+        vary = header_names.get('vary')
+        if vary is None or 'accept-encoding' not in vary.lower():
+            # Caches must keep each encoding apart
+            headers = _set_header(headers, 'Vary', f'{vary}, Accept-Encoding' if vary else 'Accept-Encoding')
+        length = header_names.get('content-length')
+        if (
+            encoding is None
+            or not status.startswith('200')
+            or environ['REQUEST_METHOD'] == 'HEAD'
+            or header_names.get('content-encoding', 'identity') != 'identity'
+            or (length is not None and int(length) < self.min_size)
+        ):
+            start_response(status, headers, exc_info)
+            return result
+
+        headers = _set_header(headers, 'Content-Encoding', encoding)
+        if 'etag' in header_names:
+            # Another representation, another tag
+            etag = header_names['etag']
+            headers = _set_header(headers, 'ETag', f'{etag[:-1]}-{encoding}"' if etag.endswith('"') else etag)
+        compressor = COMPRESSORS[encoding](self.level)
+        if length is None or isinstance(result, environ.get('wsgi.file_wrapper', ())):
+            start_response(status, _set_header(headers, 'Content-Length', None), exc_info)
+            return _CompressedBody(result, compressor)
+
+        # Whole in memory already, compressed at once and its length told
+        try:
+            body = compressor.compress(b''.join(result)) + compressor.finish()
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        start_response(status, _set_header(headers, 'Content-Length', str(len(body))), exc_info)
+        return [body]
+
+
+def _strip_encoding(if_none_match, encoding):
+    """ Map the tags of ``if_none_match`` suffixed with ``encoding`` to their compressed ones """
+    suffix = f'-{encoding}"'
+    tags = {}
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag.endswith(suffix):
+            tags[tag[:-len(suffix)] + '"'] = tag
+    return tags
+
+
+def _set_header(headers, name, value):
+    """ Return ``headers`` with ``name`` replaced by ``value``, or removed if None """
+    headers = [(k, v) for k, v in headers if k.lower() != name.lower()]
+    if value is not None:
+        headers.append((name, value))
+    return headers
@@ -1,13 +1,17 @@
+import os
+import time
+import queue
 import sqlite3
+import itertools
 import threading
+import contextlib
+import contextvars
 import logging
 from collections import abc
 
-from webgo.exceptions import FieldError
+from webgo.exceptions import FieldError, PoolTimeout
 from webgo import config
 
-lock = threading.Lock()
-
 logger = logging.getLogger(__name__)
 
 
@@ -18,6 +22,13 @@ class MyConnection(sqlite3.Connection):
     def cursor(self, *args, **kwargs):
         return super().cursor(MyCursor)
 
+    def execute(self, *args, **kwargs):
+        # The builtin shortcut doesn't create its cursor through ``cursor``
+        return self.cursor().execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        return self.cursor().executemany(*args, **kwargs)
+
 
 class MyCursor(sqlite3.Cursor):
     def execute(self, *args, **kwargs):
@@ -27,19 +38,258 @@ class MyCursor(sqlite3.Cursor):
         values = tuple(map(lambda x: None if isinstance(x, NewId) else x, values))
         return super().execute(sql, values)
 
+    def executemany(self, sql, seq_of_values):
+        return super().executemany(
+            sql,
+            (tuple(None if isinstance(x, NewId) else x for x in values) for values in seq_of_values)
+        )
 
-class DBConnect:
-    """ DB connection context manager """
-    def __init__(self):
-        self.conn = sqlite3.connect(
-            database=config.DB_FILE,
-            factory=MyConnection
+
+DEFAULT_POOL_TIMEOUT = 30
+
+
+class ConnectionPool:
+    """ Connections to one database file, kept open for reuse
+
+    Connections are opened on demand, up to ``size`` of them,
+    beyond which ``acquire`` waits for one to be released.
+    ``pragmas`` are applied once, when a connection is opened,
+    so a query only costs its statement.
+    """
+    def __init__(self, database, size=config.DB_POOL_SIZE, timeout=DEFAULT_POOL_TIMEOUT, pragmas=None):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = config.DB_PRAGMAS if pragmas is None else pragmas
+        # Last released first, so the same few connections stay warm
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            can_open = self._opened < self.size
+            if can_open:
+                self._opened += 1
+        if can_open:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise PoolTimeout(
+                f'No connection to {self.database} released within {self.timeout}s'
+            ) from None
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            database=self.database,
+            factory=MyConnection,
+            timeout=config.DB_BUSY_TIMEOUT,
+            cached_statements=config.DB_CACHED_STATEMENTS,
+            # Connections are handed from thread to thread, one at a time
+            check_same_thread=False,
         )
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name}={value}')
+        return conn
+
+    def close(self):
+        """ Close the idle connections """
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(database=None):
+    """ Return the pool of this process to ``database``, config.DB_FILE by default """
+    key = (os.getpid(), database or config.DB_FILE)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            # Connections inherited through fork mustn't be used by the child
+            for stale in [k for k in _pools if k[0] != key[0]]:
+                del _pools[stale]
+            pool = _pools.setdefault(key, ConnectionPool(key[1], config.DB_POOL_SIZE))
+    return pool
+
+
+def close_pools():
+    """ Close the idle connections of every pool of this process """
+    pid = os.getpid()
+    with _pools_lock:
+        for key in [k for k in _pools if k[0] == pid]:
+            _pools.pop(key).close()
+
+
+# Bound parameters of one ``pk IN (...)``, below SQLite's historical limit of 999
+MAX_IN_PARAMS = 900
+
+# Rows fetched at once by ``RecordSet.iterate``
+DEFAULT_CHUNK_SIZE = 1000
+
+BUSY_RETRIES = 5
+BUSY_BACKOFF = 0.01
+
+# The connection of the ``atomic`` block being run, per thread or task
+_atomic_conn = contextvars.ContextVar('atomic_conn', default=None)
+_savepoint_ids = itertools.count()
+
+
+def _begin_immediate(conn):
+    """ Begin a transaction holding the write lock from the start
+
+    A deferred transaction that reads then writes can fail on a lock
+    it can't wait for; taking it up front lets SQLite's busy timeout apply.
+    It's retried with backoff if the database is still locked after that.
+    """
+    for attempt in range(BUSY_RETRIES):
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            return
+        except sqlite3.OperationalError as e:
+            busy = 'locked' in str(e) or 'busy' in str(e)
+            if not busy or attempt == BUSY_RETRIES - 1:
+                raise
+            logger.debug(f'Database busy, retrying BEGIN IMMEDIATE ({attempt + 1})')
+            time.sleep(BUSY_BACKOFF * 2 ** attempt)
+
+
+@contextlib.contextmanager
+def atomic():
+    """ Run the block in one transaction, committed if it completes
+
+        >>> with atomic():
+        ...     order.save()
+        ...     line.save()
+
+    The transaction begins with BEGIN IMMEDIATE on a connection of the pool,
+    used by all ORM calls of the block in the same thread or task.
+    A nested block is a savepoint, rolled back alone if it raises.
+    """
+    conn = _atomic_conn.get()
+    if conn is not None:
+        savepoint = f'webgo_{next(_savepoint_ids)}'
+        conn.execute(f'SAVEPOINT {savepoint}')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute(f'ROLLBACK TO {savepoint}')
+            conn.execute(f'RELEASE {savepoint}')
+            raise
+        conn.execute(f'RELEASE {savepoint}')
+        return
+
+    pool = get_pool()
+    conn = pool.acquire()
+    token = _atomic_conn.set(conn)
+    try:
+        _begin_immediate(conn)
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+    finally:
+        _atomic_conn.reset(token)
+        pool.release(conn)
+
+
+# Records loaded within the ``identity_map`` block being run, by (model, pk)
+_identity_map = contextvars.ContextVar('identity_map', default=None)
+
+
+@contextlib.contextmanager
+def identity_map():
+    """ Share the records loaded within the block, one instance per (model, pk)
+
+    Getting a record already loaded, by ``objects.get`` or through
+    a Many2one field, returns that instance without a query, and queries
+    return the loaded instances rather than new copies. ``save`` and
+    ``delete`` keep the map up to date, set-level writes drop the
+    model's records from it.
+
+    The application runs every request in one. Nested blocks share the outer map.
+    """
+    records = _identity_map.get()
+    if records is not None:
+        yield records
+        return
+    records = {}
+    token = _identity_map.set(records)
+    try:
+        yield records
+    finally:
+        _identity_map.reset(token)
+
+
+def _identity_add(record):
+    records = _identity_map.get()
+    if records is not None:
+        records[type(record), record.pk] = record
+
+
+def _identity_discard(model, pk=None):
+    """ Drop the record of ``model`` with ``pk``, or all records of ``model`` """
+    records = _identity_map.get()
+    if not records:
+        return
+    if pk is not None:
+        records.pop((model, pk), None)
+    else:
+        for key in [key for key in records if key[0] is model]:
+            del records[key]
+
+
+class DBConnect:
+    """ DB connection context manager, borrowing a connection from the pool
+
+    Within ``atomic`` the block's connection is used instead,
+    errors propagate and committing is left to the block.
+    ``immediate`` begins the transaction with the write lock taken.
+    """
+    def __init__(self, immediate=False):
+        self.pool = None
+        self.conn = _atomic_conn.get()
+        if self.conn is None:
+            self.pool = get_pool()
+            self.conn = self.pool.acquire()
+            if immediate:
+                try:
+                    _begin_immediate(self.conn)
+                except Exception:
+                    self.pool.release(self.conn)
+                    raise
 
     def __enter__(self):
         return self.conn
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.pool is None:
+            return False
         if exc_type is None:
             self.conn.commit()
         elif issubclass(exc_type, sqlite3.Error):
@@ -47,7 +297,7 @@ class DBConnect:
             logger.warning(f'The DB operation error: {exc_val}', exc_info=True)
         else:
             logger.warning(f'Exception: {exc_val}', exc_info=True)
-        self.conn.close()
+        self.pool.release(self.conn)
         return True
 
 
@@ -69,23 +319,254 @@ class ModelMetaclass(type):
             attrs['__models__'] = mcs.models
             return type.__new__(mcs, name, bases, attrs)
         __fields__ = {}
+        __one2many__ = {}
         for k, v in attrs.items():
             if isinstance(v, Field):
                 if k == 'pk':
                     raise FieldError("Can't define Field named 'pk'")
                 v.col_name = k
-                __fields__[k] = v
+                # The other side of a Many2one, not a column of this table
+                if isinstance(v, One2many):
+                    __one2many__[k] = v
+                else:
+                    __fields__[k] = v
 
         __fields__['pk'] = Field(col_type='INTEGER PRIMARY KEY AUTOINCREMENT',
                                  col_name='pk')
+        # A record keeps its values in a list, in this order, pk last
+        for pos, field in enumerate(__fields__.values()):
+            field.pos = pos
+        attrs.setdefault('__slots__', ())
         attrs['__fields__'] = __fields__
-        attrs['__table__'] = name.lower()
+        attrs['__one2many__'] = __one2many__
+        attrs['__table__'] = table = name.lower()
         attrs['_pk'] = __fields__['pk']
 
+        # Statements of the model, built once and parameterized
+        # so that connections' statement caches serve them
+        columns = [k for k in __fields__ if k != 'pk']
+        selected = ','.join(f'{table}.{col}' for col in __fields__)
+        attrs['__columns__'] = tuple(columns)
+        attrs['__sql__'] = {
+            'columns': selected,
+            'insert': f"INSERT INTO {table} ({','.join(columns)}) VALUES ({','.join('?' * len(columns))})",
+            'update': f"UPDATE {table} SET {','.join(f'{col}=?' for col in columns)} WHERE pk=?",
+            'delete': f"DELETE FROM {table} WHERE pk=?",
+            'get': f"SELECT {selected} FROM {table} WHERE pk=?",
+        }
+        attrs['__indexes__'] = mcs.indexes(table, __fields__, attrs.pop('Meta', None))
+
         model = type.__new__(mcs, name, bases, attrs)
         mcs.models[name] = model
         return model
 
+    @staticmethod
+    def indexes(table, fields, meta):
+        """ Return the indexes of a table, as ``{name: (unique, columns)}``
+
+        They're those of fields declared with ``index`` or ``unique``
+        and the composite ones listed by ``Meta.indexes`` and ``Meta.unique_together``.
+        The name tells the columns and uniqueness, so a changed index gets a new name.
+        """
+        declared = [(field.unique, (name,)) for name, field in fields.items()
+                    if field.index or field.unique]
+        declared += [(False, tuple(cols)) for cols in getattr(meta, 'indexes', ())]
+        declared += [(True, tuple(cols)) for cols in getattr(meta, 'unique_together', ())]
+        indexes = {}
+        for unique, cols in declared:
+            for col in cols:
+                if col not in fields:
+                    raise FieldError(f"No such the field {col} to index")
+            indexes[f"{'ux' if unique else 'ix'}_{table}_{'_'.join(cols)}"] = (unique, cols)
+        return indexes
+
+
+def _like_pattern(value, lookup):
+    value = str(value).replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return {
+        'contains': f'%{value}%',
+        'startswith': f'{value}%',
+        'endswith': f'%{value}',
+    }[lookup]
+
+
+# SQL of comparison lookups, ``age__gt=18`` being 'age > ?'
+COMPARISONS = {
+    'exact': '=',
+    'ne': '!=',
+    'gt': '>',
+    'gte': '>=',
+    'lt': '<',
+    'lte': '<=',
+}
+LOOKUPS = {*COMPARISONS, 'in', 'isnull', 'contains', 'startswith', 'endswith'}
+
+
+def _lookup_sql(model, key, value):
+    """ Return the SQL and parameters of one ``field__lookup=value`` condition """
+    col, _, lookup = key.partition('__')
+    lookup = lookup or 'exact'
+    if col not in model.__fields__:
+        raise FieldError(f"No such the field {col}")
+    if lookup not in LOOKUPS:
+        raise FieldError(f"Unsupported lookup {lookup} of {col}")
+    if isinstance(value, NewId):
+        value = None
+
+    col = f'{model.__table__}.{col}'
+    if lookup == 'isnull' or (value is None and lookup in ('exact', 'ne')):
+        is_null = value if lookup == 'isnull' else lookup == 'exact'
+        return f"{col} IS {'' if is_null else 'NOT '}NULL", ()
+    if lookup == 'in':
+        values = [None if isinstance(v, NewId) else v for v in value]
+        if not values:
+            return '0', ()
+        return f"{col} IN ({','.join('?' * len(values))})", values
+    if lookup in COMPARISONS:
+        return f"{col} {COMPARISONS[lookup]} ?", (value,)
+    return f"{col} LIKE ? ESCAPE '\\'", (_like_pattern(value, lookup),)
+
+
+def _batches(items, size=MAX_IN_PARAMS):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _record(model, values, records=None):
+    """ Build the record of a row of ``model``'s columns
+
+    The record already in the identity map ``records`` is returned instead, if any.
+    """
+    if records is None:
+        return model._from_row(values)
+    # pk is the last column
+    key = (model, values[-1])
+    rec = records.get(key)
+    if rec is None:
+        rec = records[key] = model._from_row(values)
+    return rec
+
+
+class Q:
+    """ Conditions combined with ``&`` (AND), ``|`` (OR) and ``~`` (NOT)
+
+        >>> User.objects.query(Q(age__lt=18) | Q(age__gte=65), name__startswith='G')
+
+    Keyword conditions of one Q are ANDed, as they are in ``query``.
+    """
+    AND = 'AND'
+    OR = 'OR'
+
+    def __init__(self, *children, connector=AND, negated=False, **kwargs):
+        # Iterables of 'in' lookups are read once, generators included
+        kwargs = {
+            key: tuple(value) if key.endswith('__in') and value is not None else value
+            for key, value in kwargs.items()
+        }
+        self.children = [*children, *sorted(kwargs.items())]
+        self.connector = connector
+        self.negated = negated
+
+    def __and__(self, other):
+        return Q(self, other, connector=Q.AND)
+
+    def __or__(self, other):
+        return Q(self, other, connector=Q.OR)
+
+    def __invert__(self):
+        return Q(*self.children, connector=self.connector, negated=not self.negated)
+
+    def sql(self, model):
+        """ Return the WHERE expression and its parameters for ``model`` """
+        parts = []
+        params = []
+        for child in self.children:
+            if isinstance(child, Q):
+                sql, child_params = child.sql(model)
+                sql = f'({sql})'
+            else:
+                sql, child_params = _lookup_sql(model, *child)
+            parts.append(sql)
+            params.extend(child_params)
+        sql = f' {self.connector} '.join(parts) or '1'
+        if self.negated:
+            sql = f'NOT ({sql})'
+        return sql, params
+
+    def __repr__(self):
+        return f"<Q {'NOT ' if self.negated else ''}{self.connector} {self.children}>"
+
+
+class Aggregate:
+    """ An aggregate function of a field, computed by the database
+
+        >>> User.objects.query(age__gte=18).aggregate(Avg('age'), oldest=Max('age'))
+        {'age__avg': 41.5, 'oldest': 65}
+    """
+    function = None
+
+    def __init__(self, field, distinct=False):
+        self.field = field
+        self.distinct = distinct
+
+    @property
+    def default_alias(self):
+        return f'{self.field}__{self.function.lower()}'
+
+    def sql(self, model):
+        if self.field not in model.__fields__:
+            raise FieldError(f"No such the field {self.field}")
+        distinct = 'DISTINCT ' if self.distinct else ''
+        return f'{self.function}({distinct}{model.__table__}.{self.field})'
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.field!r})'
+
+
+class Count(Aggregate):
+    """ The number of records, or of non-null values of ``field`` """
+    function = 'COUNT'
+
+    def __init__(self, field='*', distinct=False):
+        super().__init__(field, distinct)
+
+    @property
+    def default_alias(self):
+        return 'count' if self.field == '*' else super().default_alias
+
+    def sql(self, model):
+        if self.field == '*':
+            return 'COUNT(*)'
+        return super().sql(model)
+
+
+class Sum(Aggregate):
+    function = 'SUM'
+
+
+class Avg(Aggregate):
+    function = 'AVG'
+
+
+class Min(Aggregate):
+    function = 'MIN'
+
+
+class Max(Aggregate):
+    function = 'MAX'
+
+
+def _aggregates(args, kwargs):
+    """ Return the aggregates by alias, named after their field and function if positional """
+    aggregates = {agg.default_alias: agg for agg in args}
+    aggregates.update(kwargs)
+    for alias, agg in aggregates.items():
+        if not isinstance(agg, Aggregate):
+            raise TypeError(f'{agg!r} is not an aggregate')
+        if not alias.isidentifier():
+            raise FieldError(f'Invalid alias {alias}')
+    return aggregates
+
 
 class RecordSet(abc.Set):
     """ Create a record set for result of query
@@ -94,76 +575,554 @@ class RecordSet(abc.Set):
         We can perform some operations come from set.
             '|', '&', ... and so on
 
+    A record set is lazy, chaining ``query``, ``order_by`` and slices
+    only builds the statement, which is run when the records are needed
+    and kept for subsequent uses. ``count`` and ``exists`` are
+    answered by the database when the records aren't fetched yet.
+
     Operations:
         >>> recset = MyModel.objects.query()
         >>> print(recest)
         <MyModel RecorcdSet (1,2,...)>
 
+        >>> recset = MyModel.objects.query(age__gte=18, name='Guido').order_by('-age')[:20]
+        >>> recset.count()
+        20
+
         >>> rec = MyModel.objects.get(pk=1)
         >>> print(rec)
         <Model:MyModel>
-
-
     """
     def __init__(self, iterable=None, model=None):
-        if iterable:
-            self._set = set(iterable)
         self.model = model
+        self._where = None
+        self._order = ()
+        self._offset = 0
+        self._limit = None
+        # Fetched records, in order
+        self._result = None
+        # Records the set was built from rather than a query, by pk
+        self._pks = None
+        # Related fields loaded along with the records
+        self._select_related = ()
+        self._prefetch_related = ()
+        if iterable is not None:
+            self._result = list(dict.fromkeys(iterable))
+            self._pks = [rec.pk for rec in self._result if rec.pk]
 
     def __get__(self, inst, class_):
         return self.__class__(model=class_)
 
-    def query(self, **kwargs):
-        """ Return a recordset including all specific records of table """
-        if len(kwargs) > 1:
-            raise KeyError('support search by one key word only')
-        if not kwargs:
-            kwargs[1] = 1
-        kw = list(kwargs.keys())[0]
-        cols = list(self.model.__fields__.keys())
-        colstr = ','.join(cols)
-        with DBConnect() as conn:
-            rows = conn.execute(f"""
-                    SELECT {colstr} FROM {self.model.__table__}
-                    WHERE {kw}=? 
-                """, (kwargs[kw], )
-                                ).fetchall()
-        return self.__class__(
-            (self.model(**dict(zip(cols, row))) for row in rows),
-            self.model
-        )
+    def _clone(self):
+        clone = self.__class__(model=self.model)
+        clone._where = self._where
+        clone._order = self._order
+        clone._offset = self._offset
+        clone._limit = self._limit
+        clone._pks = self._pks
+        clone._select_related = self._select_related
+        clone._prefetch_related = self._prefetch_related
+        return clone
+
+    @property
+    def _sliced(self):
+        return self._offset or self._limit is not None
+
+    def query(self, *conditions, **kwargs):
+        """ Return the records of the set matching all conditions
+
+        Keywords are ``field=value`` or ``field__lookup=value``, lookups being
+        exact, ne, gt, gte, lt, lte, in, isnull, contains, startswith and endswith.
+        ``Q`` objects combine conditions with OR and NOT.
+        """
+        if self._sliced:
+            raise TypeError("Can't filter a record set once sliced")
+        q = Q(*conditions, **kwargs)
+        q.sql(self.model)
+        clone = self._clone()
+        clone._where = q if self._where is None else self._where & q
+        return clone
+
+    filter = query
+
+    def exclude(self, *conditions, **kwargs):
+        """ Return the records of the set matching none of the conditions """
+        return self.query(~Q(*conditions, **kwargs))
+
+    def order_by(self, *fields):
+        """ Return the set ordered by ``fields``, descending for '-field' """
+        for field in fields:
+            if field.lstrip('-') not in self.model.__fields__:
+                raise FieldError(f"No such the field {field.lstrip('-')}")
+        if self._sliced:
+            raise TypeError("Can't reorder a record set once sliced")
+        clone = self._clone()
+        clone._order = fields
+        return clone
+
+    def select_related(self, *fields):
+        """ Return the set loading the records of Many2one ``fields`` in the same query
+
+        Each field is a LEFT JOIN on the related table,
+        its record is then set on the loaded records without further queries.
+        """
+        for field in fields:
+            if not isinstance(self.model.__fields__.get(field), Many2one):
+                raise FieldError(f"{field} is not a Many2one field of {self.model.__name__}")
+        clone = self._clone()
+        clone._select_related = (*self._select_related, *fields)
+        return clone
+
+    def prefetch_related(self, *fields):
+        """ Return the set loading the related records of ``fields`` once fetched
+
+        The records of a One2many or Many2one field are queried for all
+        loaded records at once, with ``WHERE ... IN (...)``, then set on them.
+        """
+        for field in fields:
+            if field not in self.model.__one2many__ \
+                    and not isinstance(self.model.__fields__.get(field), Many2one):
+                raise FieldError(f"{field} is not a relational field of {self.model.__name__}")
+        clone = self._clone()
+        clone._prefetch_related = (*self._prefetch_related, *fields)
+        return clone
 
     def get(self, pk):
         """ Return a single record """
         if pk is None:
             return None
-        cols = list(self.model.__fields__.keys())
-        colstr = ','.join(cols)
+        records = _identity_map.get()
+        if self._sliced:
+            # Looked for among the records of the slice
+            return next((rec for rec in self._fetch() if rec.pk == pk), None)
+        if self._where is not None or self._pks is not None or self._select_related:
+            return self.query(pk=pk).first()
+        if records:
+            rec = records.get((self.model, pk))
+            if rec is not None:
+                return rec
         with DBConnect() as conn:
-            row = conn.execute(f"""
-                    SELECT {colstr} FROM {self.model.__table__}
-                    WHERE pk={pk} 
-                """).fetchone()
-        return self.model(**dict(zip(cols, row)))
+            row = conn.execute(self.model.__sql__['get'], (pk,)).fetchone()
+        return None if row is None else self._load([row], records)[0]
+
+    def first(self):
+        """ Return the first record, by pk unless ordered or sliced, or None """
+        recset = self if self._order or self._sliced else self.order_by('pk')
+        for rec in recset[:1]:
+            return rec
+        return None
+
+    def count(self):
+        if self._result is not None:
+            return len(self._result)
+        sql, params = self._sql('1')
+        with DBConnect() as conn:
+            return conn.execute(f"SELECT count(*) FROM ({sql})", params).fetchone()[0]
 
-    def _row(self):
-        pass
+    def exists(self):
+        if self._result is not None:
+            return bool(self._result)
+        sql, params = self._sql('1', limit=1)
+        with DBConnect() as conn:
+            return conn.execute(sql, params).fetchone() is not None
+
+    def aggregate(self, *args, **kwargs):
+        """ Return a dict of aggregates computed over the records of the set
+
+        One statement is run, no record is loaded.
+        Positional aggregates are named ``field__function``.
+
+            >>> Exam.objects.query(user=1).aggregate(Count(), total=Sum('grade'))
+            {'count': 3, 'total': 240}
+        """
+        aggregates = _aggregates(args, kwargs)
+        if not aggregates:
+            return {}
+        columns = ','.join(f'{agg.sql(self.model)} AS "{alias}"' for alias, agg in aggregates.items())
+        sql, params = self._aggregate_sql(columns)
+        with DBConnect() as conn:
+            row = conn.execute(sql, params).fetchone()
+        return dict(zip(aggregates, row))
+
+    def values(self, *fields):
+        """ Return the values of ``fields`` of the records, as dicts
+
+        Followed by ``annotate``, records are grouped by those values
+        and each dict holds the aggregates of its group.
+
+            >>> Exam.objects.values('user').annotate(total=Sum('grade')).order_by('-total')
+            [{'user': 2, 'total': 270}, {'user': 1, 'total': 240}]
+        """
+        return ValuesSet(self, fields)
+
+    def _aggregate_sql(self, columns, group_by=''):
+        """ Return the SELECT of ``columns`` computed over the set, unordered """
+        table = self.model.__table__
+        if self._sliced:
+            # The slice of rows is taken first, named as the table
+            sql, params = self._sql(self.model.__sql__['columns'])
+            return f"SELECT {columns} FROM ({sql}) AS {table}{group_by}", params
+        where, params = self._where_sql()
+        return f"SELECT {columns} FROM {table}{where}{group_by}", params
+
+    def _where_sql(self):
+        parts = []
+        params = []
+        if self._pks is not None:
+            if not self._pks:
+                return ' WHERE 0', ()
+            parts.append(f"{self.model.__table__}.pk IN ({','.join('?' * len(self._pks))})")
+            params.extend(self._pks)
+        if self._where is not None:
+            sql, where_params = self._where.sql(self.model)
+            parts.append(sql)
+            params.extend(where_params)
+        if not parts:
+            return '', ()
+        return ' WHERE ' + ' AND '.join(parts), params
+
+    def _sql(self, columns, limit=None, joins=''):
+        """ Return the SELECT of ``columns`` of the set, and its parameters """
+        table = self.model.__table__
+        where, params = self._where_sql()
+        sql = f"SELECT {columns} FROM {table}{joins}{where}"
+        if self._order:
+            sql += ' ORDER BY ' + ','.join(
+                f'{table}.{field[1:]} DESC' if field.startswith('-') else f'{table}.{field}'
+                for field in self._order
+            )
+        if limit is None:
+            limit = self._limit
+        elif self._limit is not None:
+            limit = min(limit, self._limit)
+        if limit is not None or self._offset:
+            sql += f" LIMIT {-1 if limit is None else limit} OFFSET {self._offset}"
+        return sql, params
+
+    def _select(self):
+        """ Return the SELECT of the records, and related ones, and its parameters """
+        table = self.model.__table__
+        cols = [self.model.__sql__['columns']]
+        joins = []
+        for name in self._select_related:
+            related = self.model.__models__[self.model.__fields__[name].related_model]
+            alias = f'_{name}'
+            cols.append(','.join(f'{alias}.{col}' for col in related.__fields__))
+            joins.append(f" LEFT JOIN {related.__table__} AS {alias} ON {alias}.pk={table}.{name}")
+        return self._sql(','.join(cols), joins=''.join(joins))
+
+    def _fetch(self):
+        if self._result is None:
+            sql, params = self._select()
+            with DBConnect() as conn:
+                rows = conn.execute(sql, params).fetchall()
+            self._result = self._load(rows, _identity_map.get())
+        return self._result
+
+    def _load(self, rows, records=None):
+        """ Return the records of ``rows``, with the related ones set on them
+
+        Records already in the identity map ``records`` are returned in place of new ones.
+        """
+        width = len(self.model.__fields__)
+        result = []
+        for row in rows:
+            rec = _record(self.model, row[:width], records)
+            start = width
+            for name in self._select_related:
+                related = self.model.__models__[self.model.__fields__[name].related_model]
+                values = row[start:start + len(related.__fields__)]
+                start += len(values)
+                # LEFT JOIN of a null reference, pk being the last column
+                rec._set_related(name, None if values[-1] is None else _record(related, values, records))
+            result.append(rec)
+        self._prefetch(result)
+        return result
+
+    def _prefetch(self, result):
+        """ Query the records of prefetched fields for all of ``result`` at once """
+        for name in self._prefetch_related:
+            if name in self.model.__one2many__:
+                field = self.model.__one2many__[name]
+                related = self.model.__models__[field.related_model]
+                groups = {rec.pk: [] for rec in result}
+                for batch in _batches(list(groups)):
+                    recset = related.objects.query(**{f'{field.related_field}__in': batch})
+                    for child in recset.order_by('pk'):
+                        groups[child._row[related.__fields__[field.related_field].pos]].append(child)
+                for rec in result:
+                    rec._set_related(name, RecordSet(groups[rec.pk], related))
+            else:
+                pos = self.model.__fields__[name].pos
+                related = self.model.__models__[self.model.__fields__[name].related_model]
+                pks = {rec._row[pos] for rec in result} - {None}
+                found = {}
+                for batch in _batches(list(pks)):
+                    for parent in related.objects.query(pk__in=batch):
+                        found[parent.pk] = parent
+                for rec in result:
+                    rec._set_related(name, found.get(rec._row[pos]))
+
+    def iterate(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        """ Yield the records one at a time, ``chunk_size`` rows fetched at once
+
+        Unlike iterating the set, records are built as they're consumed
+        and not kept, so memory stays flat whatever the number of rows.
+        A connection is held until the iteration ends or is closed.
+
+            >>> for rec in MyModel.objects.query(age__gt=18).iterate(chunk_size=500):
+            ...     writer.writerow([rec.name, rec.age])
+        """
+        sql, params = self._select()
+        pool = None
+        conn = _atomic_conn.get()
+        if conn is None:
+            pool = get_pool()
+            conn = pool.acquire()
+        try:
+            cursor = conn.execute(sql, params)
+            try:
+                while rows := cursor.fetchmany(chunk_size):
+                    yield from self._load(rows)
+            finally:
+                cursor.close()
+        finally:
+            if pool is not None:
+                pool.release(conn)
+
+    def __getitem__(self, key):
+        if self._result is not None and self._pks is not None:
+            return self._result[key]
+        if isinstance(key, int):
+            if key < 0:
+                raise IndexError('Negative indexing is not supported')
+            if self._result is not None:
+                return self._result[key]
+            for rec in self[key:key + 1]:
+                return rec
+            raise IndexError('record set index out of range')
+        if not isinstance(key, slice):
+            raise TypeError(f'record set indices must be integers or slices, not {type(key).__name__}')
+        if key.step is not None:
+            raise ValueError('Slice steps are not supported')
+        start, stop = key.start or 0, key.stop
+        if start < 0 or (stop is not None and stop < 0):
+            raise ValueError('Negative indexing is not supported')
+
+        clone = self._clone()
+        clone._offset = self._offset + start
+        if stop is not None:
+            clone._limit = max(stop - start, 0)
+        if self._limit is not None:
+            remains = max(self._limit - start, 0)
+            clone._limit = remains if clone._limit is None else min(clone._limit, remains)
+        if self._result is not None:
+            clone._result = self._result[key]
+        return clone
+
+    def bulk_create(self, records):
+        """ Insert new records with one statement run for all of them
+
+        The pks are filled in as well. They're read from sqlite_sequence,
+        which the AUTOINCREMENT pk advances by one per row, and no other
+        writer can get in between within the transaction.
+        """
+        records = list(records)
+        if not records:
+            return records
+        for rec in records:
+            if not isinstance(rec, self.model):
+                raise TypeError(f'{rec} is not a {self.model.__name__} record')
+            if rec.pk:
+                raise ValueError(f'{rec} is already saved')
+
+        with atomic() as conn:
+            conn.executemany(self.model.__sql__['insert'], (rec._row[:-1] for rec in records))
+            last = conn.execute(
+                "SELECT seq FROM sqlite_sequence WHERE name=?", (self.model.__table__,)
+            ).fetchone()[0]
+        pk_field = self.model.__fields__['pk']
+        for pk, rec in enumerate(records, start=last - len(records) + 1):
+            pk_field.__set__(rec, pk)
+            _identity_add(rec)
+        return records
+
+    def bulk_update(self, records, fields):
+        """ Write ``fields`` of saved records, with one statement run for all of them """
+        fields = list(fields)
+        for field in fields:
+            if field not in self.model.__fields__ or field == 'pk':
+                raise FieldError(f"No such the field {field}")
+        records = list(records)
+        if not records or not fields:
+            return 0
+        if not all(rec.pk for rec in records):
+            raise ValueError('bulk_update() needs saved records')
+
+        positions = [self.model.__fields__[field].pos for field in fields]
+        sql = f"""
+            UPDATE {self.model.__table__}
+            SET {','.join(f'{field}=?' for field in fields)}
+            WHERE pk=?
+        """
+        with atomic() as conn:
+            cursor = conn.executemany(
+                sql, ([*(rec._row[pos] for pos in positions), rec.pk] for rec in records)
+            )
+        for rec in records:
+            _identity_add(rec)
+        return cursor.rowcount
+
+    def delete(self):
+        """ Delete the records of the set, the whole table for ``Model.objects`` """
+        deleted = 0
+        with atomic() as conn:
+            for where, params in self._where_batches():
+                deleted += conn.execute(
+                    f"DELETE FROM {self.model.__table__}{where}", params
+                ).rowcount
+        for rec in self._result or ():
+            self.model.__fields__['pk'].__set__(rec, NewId())
+        self._result = []
+        _identity_discard(self.model)
+        return deleted
+
+    def update(self, **values):
+        """ Set ``values`` on the records of the set, the whole table for ``Model.objects`` """
+        for key, value in values.items():
+            if key not in self.model.__fields__ or key == 'pk':
+                raise FieldError(f"No such the field {key}")
+            if value is not None and not isinstance(value, self.model.__fields__[key].py_type):
+                raise TypeError(f'{key} type is error')
+        if not values:
+            return 0
+
+        assignments = ','.join(f'{key}=?' for key in values)
+        updated = 0
+        with atomic() as conn:
+            for where, params in self._where_batches():
+                updated += conn.execute(
+                    f"UPDATE {self.model.__table__} SET {assignments}{where}",
+                    (*values.values(), *params)
+                ).rowcount
+        for rec in self._result or ():
+            for key, value in values.items():
+                self.model.__fields__[key].__set__(rec, value)
+        _identity_discard(self.model)
+        return updated
+
+    def _where_batches(self):
+        """ Yield WHERE clauses selecting the records of the set
+
+        Sets of records are split into batches of pks,
+        sliced or ordered sets select their pks with a subquery.
+        """
+        if self._pks is not None and self._where is None:
+            for batch in _batches(self._pks):
+                yield f" WHERE pk IN ({','.join('?' * len(batch))})", batch
+        elif self._sliced:
+            sql, params = self._sql('pk')
+            yield f" WHERE pk IN ({sql})", params
+        else:
+            yield self._where_sql()
+
+    def _from_iterable(self, iterable):
+        # Results of set operations keep the model
+        return self.__class__(iterable, self.model)
 
     def __contains__(self, value):
-        return value in self._set
+        return value in self._fetch()
 
     def __iter__(self):
-        return iter(self._set)
+        return iter(self._fetch())
 
     def __len__(self):
-        return len(self._set)
+        return len(self._fetch())
+
+    def __bool__(self):
+        return self.exists()
 
     def __str__(self):
-        return '<%s RecorcdSet (%s)>' % (self.model.__name__, ','.join(map(lambda x: str(x.pk), self._set)))
+        return '<%s RecorcdSet (%s)>' % (self.model.__name__, ','.join(map(lambda x: str(x.pk), self._fetch())))
 
     __repr__ = __str__
 
 
+class ValuesSet:
+    """ Values of fields of a record set, and aggregates grouped by them
+
+    Lazy like the record set it's built from,
+    its statement is run when it's first iterated.
+    """
+    def __init__(self, recordset, fields, annotations=None, order=()):
+        for field in fields:
+            if field not in recordset.model.__fields__:
+                raise FieldError(f"No such the field {field}")
+        self.recordset = recordset
+        self.fields = tuple(fields)
+        self.annotations = annotations or {}
+        self._order = order
+        self._result = None
+
+    def annotate(self, *args, **kwargs):
+        """ Return the set with aggregates of the records grouped by the values """
+        annotations = {**self.annotations, **_aggregates(args, kwargs)}
+        for alias in annotations:
+            if alias in self.recordset.model.__fields__:
+                raise FieldError(f'The alias {alias} conflicts with a field')
+        return ValuesSet(self.recordset, self.fields, annotations, self._order)
+
+    def order_by(self, *fields):
+        """ Return the set ordered by values or aggregates, descending for '-name' """
+        for field in fields:
+            if field.lstrip('-') not in (*self.fields, *self.annotations):
+                raise FieldError(f"No such the value {field.lstrip('-')}")
+        return ValuesSet(self.recordset, self.fields, self.annotations, fields)
+
+    def _sql(self):
+        model = self.recordset.model
+        table = model.__table__
+        fields = self.fields or (() if self.annotations else tuple(model.__fields__))
+        columns = [f'{table}.{field}' for field in fields]
+        # Quoted, aliases may be SQL keywords such as group or order
+        columns += [f'{agg.sql(model)} AS "{alias}"' for alias, agg in self.annotations.items()]
+        group_by = ''
+        if self.annotations and fields:
+            group_by = ' GROUP BY ' + ','.join(f'{table}.{field}' for field in fields)
+        if self.annotations:
+            sql, params = self.recordset._aggregate_sql(','.join(columns), group_by)
+        else:
+            # Values of each record, in the order of the record set unless reordered
+            sql, params = self.recordset._sql(','.join(columns))
+            if self._order:
+                sql = f"SELECT * FROM ({sql})"
+        if self._order:
+            sql += ' ORDER BY ' + ','.join(
+                f'"{field[1:]}" DESC' if field.startswith('-') else f'"{field}"' for field in self._order
+            )
+        return sql, params, (*fields, *self.annotations)
+
+    def _fetch(self):
+        if self._result is None:
+            sql, params, names = self._sql()
+            with DBConnect() as conn:
+                rows = conn.execute(sql, params).fetchall()
+            self._result = [dict(zip(names, row)) for row in rows]
+        return self._result
+
+    def __iter__(self):
+        return iter(self._fetch())
+
+    def __len__(self):
+        return len(self._fetch())
+
+    def __getitem__(self, key):
+        return self._fetch()[key]
+
+    def __repr__(self):
+        return f'<{self.recordset.model.__name__} ValuesSet {self._fetch()!r}>'
+
+
 class Model(metaclass=ModelMetaclass):
     """ Base class of all models mapping tables
     Define all abstract methods interact with DB
@@ -172,9 +1131,13 @@ class Model(metaclass=ModelMetaclass):
         __abstract   : don't create table in DB if True
         __table__    : the name of relative table (which is lowercase of class name)
         __fields__   : dict that stores all models' field name-object paris
+        __indexes__  : dict of the table's indexes, name to (unique, columns)
         __models__   : dict to store all name-class pairs of subclass of Model
     """
     __abstract = True
+    # Values of the fields, in ``__fields__`` order, as a tuple while they're
+    # the row read from the database, and related records loaded with them
+    __slots__ = ('_row', '_related')
 
     objects = RecordSet()
 
@@ -190,93 +1153,122 @@ class Model(metaclass=ModelMetaclass):
         if 'pk' not in kwargs:
             pk = NewId()
             kwargs['pk'] = pk
-        for k in self.__fields__:
-            self.__fields__[k].__set__(self, kwargs.get(k))
+        _set_row_slot(self, [kwargs.get(k) for k in self.__fields__])
+        _set_related_slot(self, None)
+
+    @classmethod
+    def _from_row(cls, row):
+        """ Build a record from a row of the database, in ``__fields__`` order
+
+        Values read from the table are trusted, so unlike ``__init__``
+        nothing is checked or converted.
+        """
+        rec = _new(cls)
+        _set_row_slot(rec, row)
+        _set_related_slot(rec, None)
+        return rec
 
     @classmethod
     def create_table(cls):
         """ Create a table in database
-        It will create all tables through all base class's subclass
+        It will create all tables through all base class's subclass,
+        along with their indexes. Tables already created are left as they are,
+        ``migrate`` brings them up to date.
         """
         with DBConnect() as conn:
-            get_tables = f"""
-                SELECT NAME
-                FROM sqlite_master
-                WHERE type='table'
-            """
-            tables = set(
-                map(lambda x: x[0], conn.execute(get_tables).fetchall())
-            )
+            tables = _tables(conn)
+            for model in cls._table_models():
+                if model.__table__ in tables:
+                    continue
+                for sql in model._create_table_sql():
+                    conn.execute(sql)
+                logger.info(f'Table {model.__table__} created')
 
-            if hasattr(cls, f'_{cls.__name__}__abstract'):
-                models = cls.__subclasses__()
-            else:
-                models = [cls]
+    @classmethod
+    def migrate(cls, dry_run=False):
+        """ Alter the tables to match the models, and return the statements run
 
-            for model in models:
-                if model.__name__.lower() in tables:
+        Missing tables are created, missing columns added, and the indexes
+        of the models created, the ones they no longer declare dropped.
+        Columns of removed fields are kept, with a warning, as their data is.
+        All statements run in one transaction, none when ``dry_run``.
+
+            >>> for sql in Model.migrate(dry_run=True):
+            ...     print(sql)
+        """
+        statements = []
+        with atomic() as conn:
+            tables = _tables(conn)
+            for model in cls._table_models():
+                table = model.__table__
+                if table not in tables:
+                    statements += model._create_table_sql()
                     continue
-                cols = ','.join([f'{field.col_name} {field.col_type}'
-                                 for field in model.__fields__.values()])
-                conn.execute(f"CREATE TABLE {model.__table__} ({cols})")
-                logger.info(f'Table {model.__table__} created')
+
+                columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+                for name, field in model.__fields__.items():
+                    if name not in columns:
+                        statements.append(f"ALTER TABLE {table} ADD COLUMN {name} {field.col_type}")
+                for name in columns - set(model.__fields__):
+                    logger.warning(f'Column {table}.{name} is no longer a field, it is kept')
+
+                # Only the indexes named as ours, not the ones made by hand
+                indexes = {
+                    row[1] for row in conn.execute(f"PRAGMA index_list({table})")
+                    if row[1].startswith((f'ix_{table}_', f'ux_{table}_'))
+                }
+                for name in sorted(indexes - set(model.__indexes__)):
+                    statements.append(f"DROP INDEX {name}")
+                for name, (unique, cols) in model.__indexes__.items():
+                    if name not in indexes:
+                        statements.append(_create_index_sql(table, name, unique, cols))
+
+            if not dry_run:
+                for sql in statements:
+                    conn.execute(sql)
+                    logger.info(sql)
+        return statements
+
+    @classmethod
+    def _table_models(cls):
+        if hasattr(cls, f'_{cls.__name__}__abstract'):
+            return cls.__subclasses__()
+        return [cls]
+
+    @classmethod
+    def _create_table_sql(cls):
+        cols = ','.join([f'{field.col_name} {field.col_type}'
+                         for field in cls.__fields__.values()])
+        return [f"CREATE TABLE {cls.__table__} ({cols})"] + [
+            _create_index_sql(cls.__table__, name, unique, cols)
+            for name, (unique, cols) in cls.__indexes__.items()
+        ]
 
     def _create(self):
         """ Create record by instance of class """
-        cols = []
-        args = []
-        params = []
-        for k, v in self.__fields__.items():
-            cols.append(v.col_name)
-            args.append(self.col_value[k])
-            params.append('?')
-        cols_str = ','.join(cols)
-        params_str = ','.join(params)
-        sql = f"""
-            INSERT INTO { self.__table__ } ({ cols_str })
-            VALUES ({ params_str })
-        """
-        with DBConnect() as conn:
-            conn.execute(sql, tuple(args))
-            pk = conn.execute(f"""
-                select pk from {self.__table__} order by pk desc
-            """).fetchone()
-            self.__fields__['pk'].__set__(self, pk[0])
+        with DBConnect(immediate=True) as conn:
+            cursor = conn.execute(self.__sql__['insert'], self._row[:-1])
+            self.__fields__['pk'].__set__(self, cursor.lastrowid)
 
     def delete(self):
-        with lock:
-            sql = f"""
-                DELETE FROM { self.__table__ }
-                WHERE pk={self.pk}
-            """
-            with DBConnect() as conn:
-                conn.execute(sql)
-            self.__fields__['pk'].__set__(self, NewId())
+        with DBConnect(immediate=True) as conn:
+            conn.execute(self.__sql__['delete'], (self.pk,))
+        _identity_discard(type(self), self.pk)
+        self.__fields__['pk'].__set__(self, NewId())
 
     def save(self):
-        with lock:
-            pk_value = self.pk
-            if pk_value:
-                self._update()
-            else:
-                self._create()
+        pk_value = self.pk
+        if pk_value:
+            self._update()
+        else:
+            self._create()
+        if self.pk:
+            _identity_add(self)
 
     def _update(self):
-        cols = []
-        args = []
-        params = []
-        for k, v in self.__fields__.items():
-            cols.append(v.col_name)
-            args.append(self.col_value[k])
-            params.append('?')
-        cols_str = ','.join([col+'=?' for col in cols])
-        sql = f"""
-            update { self.__table__ } 
-            set { cols_str }
-            where pk={self.pk}
-        """
-        with DBConnect() as conn:
-            conn.execute(sql, tuple(args))
+        with DBConnect(immediate=True) as conn:
+            # Values of the columns then pk, as the statement takes them
+            conn.execute(self.__sql__['update'], self._row)
 
     @property
     def pk(self):
@@ -284,7 +1276,8 @@ class Model(metaclass=ModelMetaclass):
 
     @property
     def col_value(self):
-        return self.__dict__
+        """ The values of the fields, by name """
+        return dict(zip(self.__fields__, self._row))
 
     def __getattr__(self, key):
         if key not in self.__fields__:
@@ -295,8 +1288,23 @@ class Model(metaclass=ModelMetaclass):
             raise FieldError(f"No such the field {key}")
         super().__setattr__(key, value)
 
+    def _set_related(self, name, value):
+        """ Keep the related records of field ``name`` loaded along with the record """
+        if self._related is None:
+            _set_related_slot(self, {})
+        self._related[name] = value
+
+    def _get_related(self, name, default=None):
+        if self._related is None:
+            return default
+        return self._related.get(name, default)
+
+    def __reduce__(self):
+        # Copied and pickled by value, the slots being restored through their setters
+        return _restore, (self.__class__, tuple(self._row), self._related and dict(self._related))
+
     def __eq__(self, other):
-        return hash(self) == hash(other) and self.__dict__ == other.__dict__
+        return hash(self) == hash(other) and tuple(self._row) == tuple(other._row)
 
     def __hash__(self):
         return self.pk
@@ -307,11 +1315,40 @@ class Model(metaclass=ModelMetaclass):
     __repr__ = __str__
 
 
+def _tables(conn):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+
+
+def _create_index_sql(table, name, unique, cols):
+    return f"CREATE {'UNIQUE ' if unique else ''}INDEX {name} ON {table} ({','.join(cols)})"
+
+
+# Slot setters, bypassing Model.__setattr__ which only takes fields
+_new = object.__new__
+_set_row_slot = Model._row.__set__
+_set_related_slot = Model._related.__set__
+
+
+def _restore(model, row, related):
+    """ The record of a copy or an unpickling, see ``Model.__reduce__`` """
+    rec = model._from_row(row)
+    if related:
+        _set_related_slot(rec, related)
+    return rec
+
+
 class Field:
-    """ Base class of Field class """
-    def __init__(self, col_type, col_name=None):
+    """ Base class of Field class
+
+    ``index`` creates an index of the column, ``unique`` a unique one.
+    """
+    def __init__(self, col_type, col_name=None, index=False, unique=False):
         self.col_type = col_type
         self.col_name = col_name
+        self.index = index
+        self.unique = unique
+        # Position of the value in records' rows, set by ModelMetaclass
+        self.pos = None
         self.py_type = {
             'text': str,
             'int': int,
@@ -321,10 +1358,15 @@ class Field:
     def __get__(self, inst, class_):
         if inst is None:
             return self
-        return inst.col_value[self.col_name]
+        return inst._row[self.pos]
 
     def __set__(self, inst, value):
-        inst.col_value[self.col_name] = value
+        row = inst._row
+        if type(row) is tuple:
+            # Rows read from the database are kept as they are until written
+            row = list(row)
+            _set_row_slot(inst, row)
+        row[self.pos] = value
 
 
 class IntegerField(Field):
@@ -338,20 +1380,24 @@ class TextField(Field):
 
 
 class Many2one(Field):
-    def __init__(self, related_model, **kwargs):
+    def __init__(self, related_model, index=True, **kwargs):
+        # Indexed by default, records being looked up by their related record
         self.related_model = related_model
-        super().__init__('many2one', **kwargs)
+        super().__init__('many2one', index=index, **kwargs)
 
     def __get__(self, inst, class_):
-        """
-        issues:
-            TODO: How to address problem get identical values repeatedly
-                AND How to caching values
+        """ Return the related record
+
+        Within an ``identity_map`` block, as requests are,
+        a record is queried once and the same instance returned afterwards.
         """
         if inst is None:
             return self
+        value = inst._row[self.pos]
+        related = inst._get_related(self.col_name)
+        if related is not None and related.pk == value:
+            return related
         related_class = inst.__models__[self.related_model]
-        value = inst.col_value[self.col_name]
         return related_class.objects.get(pk=value)
 
 
@@ -364,6 +1410,9 @@ class One2many(Field):
     def __get__(self, inst, class_):
         if inst is None:
             return self
+        related = inst._get_related(self.col_name)
+        if related is not None:
+            return related
         related_class = inst.__models__[self.related_model]
         return related_class.objects.query(**{self.related_field: inst.pk})
 
@@ -0,0 +1,164 @@
+import re
+
+from webgo.exceptions import NotFound, MethodNotAllowed
+
+PARAM = re.compile(r'^<(?:(\w+):)?(\w+)>$')
+
+
+def _to_str(segment):
+    if not segment:
+        raise ValueError('empty segment')
+    return segment
+
+
+def _to_int(segment):
+    if not segment.isdigit():
+        raise ValueError(f'{segment} is not an integer')
+    return int(segment)
+
+
+# Converters of typed parameters, tried in this order on the same segment
+CONVERTERS = {
+    'int': _to_int,
+    'float': float,
+    'str': _to_str,
+}
+
+
+class _Node:
+    """ One path segment of the tree """
+    __slots__ = ('static', 'params', 'wildcard', 'handlers')
+
+    def __init__(self):
+        self.static = {}
+        # [(converter name, param name, node)], kept in ``CONVERTERS`` order
+        self.params = []
+        # (param name, node) of a trailing <path:name>
+        self.wildcard = None
+        self.handlers = {}
+
+
+class Router:
+    """ Route table compiled into a segment tree
+
+    Path templates may hold typed parameters and a trailing wildcard:
+
+        /user/<id>               any non-empty segment, as str
+        /user/<int:id>           digits only, converted with int
+        /price/<float:amount>
+        /files/<path:rest>       everything left, slashes included
+
+    Lookup walks the tree a segment at a time, static segments being a dict hit,
+    so its cost depends on the length of the path, not on the number of routes.
+    Static segments take precedence over parameters, and parameters over wildcards.
+    Routes without parameters are kept in a flat table as well, looked up first.
+
+        >>> router = Router()
+        >>> router.add('GET', '/user/<int:id>', handler)
+        >>> router.match('GET', '/user/42')
+        (handler, {'id': 42})
+    """
+    def __init__(self):
+        self.root = _Node()
+        self._static = {}
+
+    def add(self, method, path, handler):
+        node = self.root
+        segments = _split(path)
+        for i, segment in enumerate(segments):
+            param = PARAM.match(segment)
+            if param is None:
+                node = node.static.setdefault(segment, _Node())
+                continue
+
+            converter, name = param.group(1) or 'str', param.group(2)
+            if converter == 'path':
+                if i != len(segments) - 1:
+                    raise ValueError(f'<path:{name}> must end the route {path}')
+                if node.wildcard is None:
+                    node.wildcard = (name, _Node())
+                node = node.wildcard[1]
+                break
+            if converter not in CONVERTERS:
+                raise ValueError(f'Unknown converter {converter} in {path}')
+
+            for conv, param_name, child in node.params:
+                if conv == converter and param_name == name:
+                    node = child
+                    break
+            else:
+                child = _Node()
+                node.params.append((converter, name, child))
+                node.params.sort(key=lambda edge: list(CONVERTERS).index(edge[0]))
+                node = child
+
+        node.handlers[method] = handler
+        if '<' not in path:
+            self._static.setdefault(path, node.handlers)
+
+    def match(self, method, path):
+        """ Return the handler and the path parameters
+
+        Raise NotFound if no route matches the path,
+        or MethodNotAllowed if it's routed for other methods only.
+        """
+        handlers = self._static.get(path)
+        params = {}
+        if handlers is None:
+            node = _match(self.root, _split(path), 0, params)
+            if node is None:
+                raise NotFound(path)
+            handlers = node.handlers
+        if method not in handlers:
+            raise MethodNotAllowed(sorted(handlers))
+        return handlers[method], params
+
+    def routes(self):
+        """ Yield (method, path template, handler) of every route """
+        def walk(node, prefix):
+            for method, handler in node.handlers.items():
+                yield method, prefix or '/', handler
+            for segment, child in node.static.items():
+                yield from walk(child, f'{prefix}/{segment}')
+            for converter, name, child in node.params:
+                yield from walk(child, f'{prefix}/<{converter}:{name}>')
+            if node.wildcard:
+                name, child = node.wildcard
+                yield from walk(child, f'{prefix}/<path:{name}>')
+        yield from walk(self.root, '')
+
+    def __len__(self):
+        return sum(1 for _ in self.routes())
+
+
+def _split(path):
+    return path[1:].split('/') if path.startswith('/') else path.split('/')
+
+
+def _match(node, segments, i, params):
+    if i == len(segments):
+        return node if node.handlers else None
+    segment = segments[i]
+
+    child = node.static.get(segment)
+    if child is not None:
+        found = _match(child, segments, i + 1, params)
+        if found is not None:
+            return found
+
+    for converter, name, child in node.params:
+        try:
+            params[name] = CONVERTERS[converter](segment)
+        except ValueError:
+            continue
+        found = _match(child, segments, i + 1, params)
+        if found is not None:
+            return found
+        del params[name]
+
+    if node.wildcard is not None:
+        name, child = node.wildcard
+        if child.handlers:
+            params[name] = '/'.join(segments[i:])
+            return child
+    return None
@@ -1 +1,4 @@
 from .server import Server
+from .selector import SelectorServer
+from .prefork import Arbiter
+from .aioserver import AsyncServer
@@ -0,0 +1,226 @@
+import asyncio
+import logging
+import itertools
+from http import HTTPStatus
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from .server import Server, RequestError, ENCODING, RECV_SIZE, MAX_HEADER_SIZE, BODILESS_STATUS
+
+_logger = logging.getLogger(__name__)
+
+
+class RequestBody:
+    """ The body of a request, received piece by piece as the application asks for it """
+    def __init__(self, reader, length, timeout):
+        self.reader = reader
+        self.remains = length
+        self.timeout = timeout
+
+    async def read(self):
+        """ The next piece, of at most RECV_SIZE bytes, b'' once all is read """
+        if self.remains <= 0:
+            return b''
+        data = await asyncio.wait_for(self.reader.read(min(self.remains, RECV_SIZE)), self.timeout)
+        if not data:
+            raise ConnectionError('Peer closed before sending the whole body')
+        self.remains -= len(data)
+        return data
+
+    async def drain(self):
+        """ Skip what the application left unread, so the next request can be parsed """
+        while await self.read():
+            pass
+
+
+class AsyncServer(Server):
+    """ Serve an ASGI application on one asyncio event loop
+
+    Connections are coroutines, so waiting on slow clients or awaiting
+    ``async def`` handlers costs no thread. The loop's default executor,
+    sized by ``threads``, is where synchronous handlers are offloaded.
+    """
+    def serve_forever(self):
+        asyncio.run(self._serve())
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop.set_default_executor(
+            ThreadPoolExecutor(self.pool.size, thread_name_prefix='webgo-worker')
+        )
+        self._stopped = asyncio.Event()
+        # Connection tasks waiting for their next request, cancelled on shutdown
+        self._idle = set()
+        self._serving = True
+
+        server = await asyncio.start_server(
+            self._serve_connection, sock=self.sock, backlog=self.backlog
+        )
+        _logger.info(f"server listening on {self.address}")
+        async with server:
+            await self._stopped.wait()
+        for task in self._idle:
+            task.cancel()
+        # Stopped on purpose, let the requests in progress finish
+        tasks = asyncio.all_tasks() - {asyncio.current_task()}
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def shutdown(self):
+        self._serving = False
+        self._loop.call_soon_threadsafe(self._stopped.set)
+
+    async def _serve_connection(self, reader, writer):
+        task = asyncio.current_task()
+        try:
+            for served in itertools.count(1):
+                self._idle.add(task)
+                try:
+                    head = await asyncio.wait_for(self._read_head(reader), self.keepalive_timeout)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, ConnectionError):
+                    break
+                finally:
+                    self._idle.discard(task)
+                if not head:
+                    break
+
+                try:
+                    environ = self.request_environ(head)
+                except Exception as e:
+                    status = e.status if isinstance(e, RequestError) else '400 Bad Request'
+                    writer.write(
+                        f"HTTP/1.1 {status}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".encode(ENCODING)
+                    )
+                    break
+
+                keep_alive = (
+                    self._serving
+                    and served < self.max_requests
+                    and self.should_keep_alive(environ)
+                )
+                body = RequestBody(reader, environ.get('CONTENT_LENGTH', 0), self.keepalive_timeout)
+                if not await self.handle_async(environ, body, writer, keep_alive):
+                    break
+                try:
+                    await body.drain()
+                except asyncio.TimeoutError:
+                    break
+        except asyncio.CancelledError:
+            pass
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_head(reader):
+        lines = []
+        size = 0
+        while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+            lines.append(line)
+            size += len(line)
+            if size > MAX_HEADER_SIZE:
+                raise ValueError('Request header fields too large')
+        return b''.join(lines)
+
+    @staticmethod
+    def _head(response, environ, keep_alive):
+        """ Return the status line and headers of ``response``
+
+        Whether its body is chunked and the connection kept are set on it.
+        """
+        status = HTTPStatus(response['status'])
+        header_names = {k.lower(): v for k, v in response['headers']}
+        head = [f"HTTP/1.1 {status.value} {status.phrase}\r\n".encode(ENCODING)]
+        response['chunked'] = False
+        if b'content-length' in header_names or str(status.value) in BODILESS_STATUS or status.value < 200:
+            pass
+        elif environ['SERVER_PROTOCOL'] == 'HTTP/1.1' and b'transfer-encoding' not in header_names:
+            response['chunked'] = True
+            head.append(b"Transfer-Encoding: chunked\r\n")
+        else:
+            keep_alive = False
+        if header_names.get(b'connection', b'').lower() == b'close':
+            keep_alive = False
+        response['keep_alive'] = keep_alive
+
+        head.extend(
+            k + b': ' + v + b'\r\n'
+            for k, v in response['headers'] if k.lower() != b'connection'
+        )
+        head.append(f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n".encode(ENCODING))
+        head.append(b"Server: WebgoServer\r\n")
+        head.append(f"Date: {datetime.now().strftime('%a, %d %b %Y %H:%M:%S GMT')}\r\n\r\n".encode(ENCODING))
+        _logger.info(f"{status.value} {status.phrase}")
+        return b''.join(head)
+
+    async def handle_async(self, environ, body, writer, keep_alive=False):
+        """ Run the application for one request and send its response
+
+        The ``RequestBody`` is handed over in 'http.request' messages
+        as the application receives them, never buffered whole.
+        Return whether the connection can carry another request.
+        """
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': environ['SERVER_PROTOCOL'].partition('/')[2],
+            'method': environ['REQUEST_METHOD'],
+            'scheme': 'http',
+            'path': environ['PATH_INFO'],
+            'raw_path': environ['PATH_INFO'].encode(ENCODING),
+            'query_string': environ.get('QUERY_STRING', '').encode(ENCODING),
+            'root_path': '',
+            'headers': [
+                (key[5:].lower().replace('_', '-').encode(ENCODING), value.encode(ENCODING))
+                for key, value in environ.items() if key.startswith('HTTP_')
+            ],
+            'server': self.address,
+            'client': writer.get_extra_info('peername'),
+        }
+        received = []
+        response = {}
+
+        async def receive():
+            if not received or body.remains:
+                received.append(True)
+                data = await body.read()
+                return {'type': 'http.request', 'body': data, 'more_body': body.remains > 0}
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+                response['headers'] = message.get('headers', [])
+                return
+
+            data = message.get('body', b'')
+            more_body = message.get('more_body', False)
+            head = None
+            if 'sent' not in response:
+                response['sent'] = True
+                head = self._head(response, environ, keep_alive)
+            if environ['REQUEST_METHOD'] == 'HEAD':
+                # The headers tell the length of the body, which isn't sent
+                data = b''
+            elif response['chunked']:
+                # The body is streamed, framed as its pieces come
+                if data:
+                    data = b'%x\r\n%s\r\n' % (len(data), data)
+                if not more_body:
+                    data += b'0\r\n\r\n'
+            if head is not None:
+                data = head + data
+            response['complete'] = not more_body
+            writer.write(data)
+            await writer.drain()
+
+        try:
+            await self.app(scope, receive, send)
+        except Exception:
+            _logger.exception(f"Error handling {environ['PATH_INFO']}")
+            if 'sent' not in response:
+                writer.write(
+                    b"HTTP/1.1 500 Internal Server Error\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+                )
+            return False
+        return response.get('complete', False) and response['keep_alive']
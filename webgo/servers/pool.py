@@ -0,0 +1,90 @@
+import time
+import queue
+import logging
+import threading
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_THREADS = 32
+DEFAULT_QUEUE_SIZE = 128
+
+
+class WorkerPool:
+    """ A fixed number of threads consuming a bounded queue of tasks
+
+    When the queue is full, ``submit`` either waits for a free slot
+    (``block=True``), pushing back on the accept loop and so the listen backlog,
+    or refuses the task and lets the caller answer 503.
+
+    Queue depth and time spent waiting in the queue are kept in ``stats``,
+    which is what the pool size should be tuned against.
+    """
+    def __init__(self, size=DEFAULT_THREADS, queue_size=DEFAULT_QUEUE_SIZE, block=False):
+        self.size = size
+        self.block = block
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        self._stats_lock = threading.Lock()
+        self._started = 0
+        self._completed = 0
+        self._rejected = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def start(self):
+        """ Spawn the threads, deferred so that the pool survives a fork """
+        for i in range(self.size - len(self._threads)):
+            t = threading.Thread(target=self._work, name=f'webgo-worker-{i}', daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, func, *args):
+        """ Queue ``func(*args)``, return False if it's refused """
+        try:
+            self._queue.put((time.monotonic(), func, args), block=self.block)
+        except queue.Full:
+            with self._stats_lock:
+                self._rejected += 1
+            return False
+        return True
+
+    def shutdown(self, wait=True):
+        """ Let the threads finish queued tasks, then stop """
+        for _ in self._threads:
+            self._queue.put(None)
+        if wait:
+            for t in self._threads:
+                t.join()
+        self._threads = []
+
+    def _work(self):
+        while (task := self._queue.get()) is not None:
+            enqueued, func, args = task
+            waited = time.monotonic() - enqueued
+            with self._stats_lock:
+                self._started += 1
+                self._total_wait += waited
+                self._max_wait = max(self._max_wait, waited)
+            try:
+                func(*args)
+            except Exception:
+                _logger.exception(f'Worker failed running {func}')
+            with self._stats_lock:
+                self._completed += 1
+
+    @property
+    def depth(self):
+        """ The number of tasks waiting for a thread """
+        return self._queue.qsize()
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'threads': self.size,
+                'depth': self.depth,
+                'queue_size': self._queue.maxsize,
+                'completed': self._completed,
+                'rejected': self._rejected,
+                'avg_wait': self._total_wait / self._started if self._started else 0.0,
+                'max_wait': self._max_wait,
+            }
@@ -0,0 +1,120 @@
+import os
+import time
+import signal
+import logging
+import threading
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_GRACEFUL_TIMEOUT = 30
+CHECK_INTERVAL = 0.5
+
+
+class Arbiter:
+    """ Fork worker processes serving one address, and keep them running
+
+    ``make_server`` builds a bound server. It is called once in the parent,
+    whose listening socket is inherited by all workers,
+    or, with ``reuse_port``, once in every worker,
+    each binding its own socket with SO_REUSEPORT.
+
+    Workers that die are replaced. On SIGTERM or SIGINT the workers are
+    told to stop, finish the requests in progress and exit,
+    and are killed if they're not done within ``graceful_timeout`` seconds.
+    """
+    def __init__(
+            self,
+            make_server,
+            workers,
+            reuse_port=False,
+            graceful_timeout=DEFAULT_GRACEFUL_TIMEOUT,
+    ):
+        self.make_server = make_server
+        self.workers = workers
+        self.reuse_port = reuse_port
+        self.graceful_timeout = graceful_timeout
+        self.server = None
+        self.pids = set()
+        self._running = False
+
+    def run(self):
+        if not self.reuse_port:
+            self.server = self.make_server()
+            _logger.info(f"server listening on {self.server.address}")
+
+        self._running = True
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        try:
+            while self._running:
+                self._reap()
+                while self._running and len(self.pids) < self.workers:
+                    self._spawn()
+                time.sleep(CHECK_INTERVAL)
+        finally:
+            self._stop_workers()
+            if self.server is not None:
+                self.server.sock.close()
+
+    def _stop(self, signum, frame):
+        _logger.info(f'Received signal {signum}, shutting down')
+        self._running = False
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid:
+            self.pids.add(pid)
+            _logger.info(f'Worker {pid} started')
+            return
+
+        # Worker process
+        status = 0
+        try:
+            server = self.server or self.make_server()
+            server.multiprocess = True
+            signal.signal(signal.SIGTERM, lambda signum, frame: server.shutdown())
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            threading.Thread(target=_watch_parent, args=(os.getppid(),), daemon=True).start()
+            server.serve_forever()
+        except BaseException:
+            _logger.exception(f'Worker {os.getpid()} failed')
+            status = 1
+        finally:
+            os._exit(status)
+
+    def _reap(self):
+        """ Collect exited workers, return whether any was left running """
+        while self.pids:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.pids.clear()
+                break
+            if not pid:
+                break
+            self.pids.discard(pid)
+            if self._running:
+                _logger.warning(
+                    f'Worker {pid} exited with status {status}, restarting'
+                )
+        return bool(self.pids)
+
+    def _stop_workers(self):
+        for pid in self.pids:
+            os.kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.graceful_timeout
+        while self._reap() and time.monotonic() < deadline:
+            time.sleep(0.1)
+        for pid in self.pids:
+            _logger.warning(f'Worker {pid} did not stop in time, killing it')
+            os.kill(pid, signal.SIGKILL)
+        while self.pids:
+            pid, _ = os.waitpid(-1, 0)
+            self.pids.discard(pid)
+
+
+def _watch_parent(ppid):
+    """ Stop the worker if the arbiter died without stopping it """
+    while os.getppid() == ppid:
+        time.sleep(1)
+    os.kill(os.getpid(), signal.SIGTERM)
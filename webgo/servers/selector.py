@@ -0,0 +1,227 @@
+import time
+import socket
+import logging
+import selectors
+import collections
+
+from .server import Server, ErrorStream, InputStream, HTTPSocketIO, RequestError, RECV_SIZE, MAX_HEADER_SIZE
+
+_logger = logging.getLogger(__name__)
+
+# Larger bodies are received by the worker as the application reads them
+MAX_BUFFERED_BODY = 1024 * 1024
+
+
+class _PendingRequest:
+    """ A connection's buffer, and its request once the header block is in """
+    def __init__(self, connection, addr, recv_buf, max_buffered_body=MAX_BUFFERED_BODY):
+        self.addr = addr
+        self.max_buffered_body = max_buffered_body
+        self.http_io = HTTPSocketIO(connection, recv_buf)
+        self.environ = None
+        self.head_size = 0
+        self.served = 0
+
+    def parse_head(self, build_environ):
+        """ Parse the buffered header block, return False if it isn't complete yet """
+        if (head_size := self.http_io.head_end()) < 0:
+            return False
+        self.environ = build_environ(self.http_io.peek(head_size))
+        self.head_size = head_size
+        return True
+
+    @property
+    def buffers_body(self):
+        """ Whether the body is received by the loop before the request is served """
+        return self.environ.get('CONTENT_LENGTH', 0) <= self.max_buffered_body
+
+    @property
+    def complete(self):
+        """ Whether the request can be served, its body being buffered or left to the worker """
+        if not self.buffers_body:
+            return True
+        return self.http_io.buffered >= self.head_size + self.environ.get('CONTENT_LENGTH', 0)
+
+
+class SelectorServer(Server):
+    """ Multiplex all connections on one selector (epoll/kqueue) loop
+
+    Idle and half-received connections cost a buffer only,
+    no thread is involved until a request is complete.
+    Bodies over ``max_buffered_body`` bytes aren't buffered though,
+    the worker receives them as the application reads, as ``Server`` does.
+    Between requests of a persistent connection the worker hands it back
+    to the loop, so idle keep-alive connections don't hold threads either.
+    """
+    # Requests are read whole before being answered, don't block the loop lingering
+    linger = 0
+    max_buffered_body = MAX_BUFFERED_BODY
+
+    def serve_forever(self):
+        self.pool.start()
+        self.sock.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.sock, selectors.EVENT_READ)
+        # Only the loop receives, so all connections share one receive buffer
+        self._recv_buf = bytearray(RECV_SIZE)
+        # Connections ordered by last activity, to drop the idle ones
+        self._idle = collections.OrderedDict()
+        # Connections handed back by workers, the loop is woken to register them
+        self._resumed = collections.deque()
+        self._waker, self._wakeup = socket.socketpair()
+        self._waker.setblocking(False)
+        self.selector.register(self._waker, selectors.EVENT_READ)
+        self._serving = True
+        try:
+            _logger.info(f"server listening on {self.address}")
+            while self._serving:
+                for key, _ in self.selector.select(self._next_timeout()):
+                    if key.fileobj is self.sock:
+                        self._accept()
+                    elif key.fileobj is self._waker:
+                        self._resume()
+                    else:
+                        self._read(key.fileobj, key.data)
+                self._expire()
+        finally:
+            for connection in list(self._idle):
+                self._close(connection)
+            self.selector.close()
+            self.sock.close()
+        # Stopped on purpose, let the requests in progress finish
+        self.pool.shutdown()
+        self._waker.close()
+        self._wakeup.close()
+
+    def shutdown(self):
+        self._serving = False
+        self._wakeup.send(b'\0')
+
+    def _accept(self):
+        while True:
+            try:
+                connection, address = self.sock.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            connection.setblocking(False)
+            self._watch(connection, _PendingRequest(connection, address, self._recv_buf, self.max_buffered_body))
+
+    def _watch(self, connection, pending):
+        self.selector.register(connection, selectors.EVENT_READ, pending)
+        self._idle[connection] = time.monotonic()
+
+    def _read(self, connection, pending):
+        http_io = pending.http_io
+        try:
+            received = http_io.fill()
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            received = 0
+        if not received:
+            self._close(connection)
+            return
+        self._idle[connection] = time.monotonic()
+        self._idle.move_to_end(connection)
+
+        if pending.environ is None:
+            try:
+                if not pending.parse_head(self.request_environ):
+                    if http_io.buffered > MAX_HEADER_SIZE:
+                        self._reject(connection, '431 Request Header Fields Too Large')
+                    return
+            except RequestError as e:
+                self._reject(connection, e.status)
+                return
+            except Exception:
+                self._reject(connection, '400 Bad Request')
+                return
+
+        if pending.complete:
+            self.selector.unregister(connection)
+            del self._idle[connection]
+            connection.settimeout(self.keepalive_timeout)
+            self.submit(connection, self._serve, connection, pending)
+
+    def _serve(self, connection, pending):
+        """ Serve the buffered requests in order, on a worker thread
+
+        Pipelined requests that are already complete are served right away,
+        the connection goes back to the loop once it waits for more bytes.
+        """
+        http_io = pending.http_io
+        try:
+            while True:
+                environ = pending.environ
+                http_io.read_head()
+                if not pending.buffers_body:
+                    # Received here, not into the buffer the loop shares
+                    http_io.use_buffer(bytearray(RECV_SIZE))
+                environ['wsgi.input'] = InputStream(http_io, environ.get('CONTENT_LENGTH', 0))
+                environ['wsgi.errors'] = ErrorStream(connection)
+                pending.served += 1
+                keep_alive = (
+                    self._serving
+                    and pending.served < self.max_requests
+                    and self.should_keep_alive(environ)
+                )
+                if not self.handle(environ, connection, keep_alive):
+                    connection.close()
+                    return
+                environ['wsgi.input'].drain()
+
+                pending.environ = None
+                try:
+                    if not pending.parse_head(self.request_environ) or not pending.complete:
+                        break
+                except RequestError as e:
+                    self.reject(connection, e.status)
+                    return
+                except Exception:
+                    self.reject(connection, '400 Bad Request')
+                    return
+        except Exception:
+            connection.close()
+            raise
+
+        if not self._serving:
+            connection.close()
+            return
+        http_io.use_buffer(self._recv_buf)
+        connection.setblocking(False)
+        self._resumed.append((connection, pending))
+        self._wakeup.send(b'\0')
+
+    def _resume(self):
+        try:
+            while self._waker.recv(RECV_SIZE):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        while self._resumed:
+            self._watch(*self._resumed.popleft())
+
+    def _next_timeout(self):
+        if not self._idle:
+            return None
+        oldest = next(iter(self._idle.values()))
+        return max(oldest + self.keepalive_timeout - time.monotonic(), 0)
+
+    def _expire(self):
+        deadline = time.monotonic() - self.keepalive_timeout
+        while self._idle:
+            connection, last_active = next(iter(self._idle.items()))
+            if last_active > deadline:
+                break
+            self._close(connection)
+
+    def _reject(self, connection, status):
+        self.selector.unregister(connection)
+        self._idle.pop(connection, None)
+        connection.settimeout(self.keepalive_timeout)
+        self.reject(connection, status)
+
+    def _close(self, connection):
+        self.selector.unregister(connection)
+        self._idle.pop(connection, None)
+        connection.close()
@@ -1,8 +1,15 @@
+import re
+import time
 import logging
 import socket
+import itertools
+import selectors
 import threading
+import collections
 from datetime import datetime
 
+from .pool import WorkerPool, DEFAULT_THREADS, DEFAULT_QUEUE_SIZE
+
 logging.basicConfig(
     level=logging.DEBUG,
     format='%(asctime)s - %(levelname)s - %(message)s',
@@ -12,10 +19,40 @@ _logger = logging.getLogger(__name__)
 
 ENCODING = 'iso-8859-1'
 
+DEFAULT_BACKLOG = socket.SOMAXCONN
+
+RECV_SIZE = 64 * 1024
+MAX_HEADER_SIZE = 64 * 1024
+
+DEFAULT_KEEPALIVE_TIMEOUT = 5
+DEFAULT_MAX_REQUESTS = 100
+# Larger request bodies are answered 413
+DEFAULT_MAX_BODY_SIZE = 64 * 1024 * 1024
+LINGER_TIMEOUT = 0.5
+
+# Buffers gathered by one sendmsg, below any system's IOV_MAX
+MAX_IOVECS = 64
+
+# Responses that never have a body, refer to RFC 7230 section 3.3.3
+BODILESS_STATUS = ('204', '304')
+
+# Lines of the head end with CRLF, or a bare LF, nothing else
+LINE_END = re.compile(rb'\r?\n')
+# Allowed nowhere in the head but HTAB, refer to RFC 7230 section 3.2
+CONTROL_CHARS = re.compile(rb'[\x00-\x08\x0a-\x1f\x7f]')
+
+
+class RequestError(Exception):
+    """ A request the server answers itself, with ``status``, before closing """
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
 
 class InputStream:
-    def __init__(self, conn, remains=0):
-        self._conn = conn
+    """ 'wsgi.input', served from the connection's buffer """
+    def __init__(self, http_io, remains=0):
+        self._http_io = http_io
         self._remains = remains
 
     def read(self, size=-1):
@@ -26,34 +63,33 @@ class InputStream:
             sz = self._remains
         else:
             sz = min(size, self._remains)
-        data = self._conn.recv(sz)
+        data = self._http_io.read(sz)
         self._remains -= len(data)
         return data
 
     def readline(self, size=-1):
+        if self._remains <= 0:
+            return b''
+
         if size < 0:
             sz = self._remains
         else:
             sz = min(size, self._remains)
-
-        line = []
-        while (
-                sz > len(line)
-                and (not line or line[-1] != '\n')
-        ):
-            c = self._conn.recv(1)
-            if not c:
-                break
-            line.append(c)
+        line = self._http_io.readline(sz)
         self._remains -= len(line)
-        return b''.join(line)
+        return line
+
+    def readlines(self, hint=-1):
+        return list(self)
 
-    def readlines(self):
-        return [line for line in self.readline()]
+    def drain(self):
+        """ Skip what the application left unread, so the next request can be parsed """
+        while self.read(RECV_SIZE):
+            pass
 
     def __iter__(self):
-        while self._remains > 0:
-            yield self.read(1)
+        while line := self.readline():
+            yield line
 
 
 class ErrorStream:
@@ -71,39 +107,270 @@ class ErrorStream:
             self._conn.sendall(line)
 
 
+class FileWrapper:
+    """ 'wsgi.file_wrapper', the server sends such files with sendfile """
+    def __init__(self, filelike, blksize=RECV_SIZE):
+        self.filelike = filelike
+        self.blksize = blksize
+
+    def __iter__(self):
+        while data := self.filelike.read(self.blksize):
+            yield data
+
+    def close(self):
+        if hasattr(self.filelike, 'close'):
+            self.filelike.close()
+
+
+class KeepAlivePoller:
+    """ Watch idle persistent connections on a thread of its own
+
+    Workers park connections here between requests instead of waiting on them,
+    so idle clients hold no worker. Once the next request's bytes arrive,
+    the connection is handed to ``resume(connection, data)``.
+    Connections silent for ``timeout`` seconds are closed.
+    """
+    def __init__(self, resume, timeout):
+        self.resume = resume
+        self.timeout = timeout
+        self._selector = selectors.DefaultSelector()
+        # Parked by workers, registered by the poller thread which owns the selector
+        self._parked = collections.deque()
+        # Connections ordered by the time they were parked, to drop the idle ones
+        self._idle = collections.OrderedDict()
+        self._waker, self._wakeup = socket.socketpair()
+        self._waker.setblocking(False)
+        self._selector.register(self._waker, selectors.EVENT_READ)
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='webgo-keepalive', daemon=True)
+        self._thread.start()
+
+    def park(self, connection, data):
+        self._parked.append((connection, data))
+        self._wakeup.send(b'\0')
+
+    def stop(self):
+        """ Stop watching, closing the idle connections """
+        self._running = False
+        self._wakeup.send(b'\0')
+        self._thread.join()
+        for connection in [*self._idle, *(connection for connection, _ in self._parked)]:
+            connection.close()
+        self._selector.close()
+        self._waker.close()
+        self._wakeup.close()
+
+    def _run(self):
+        while self._running:
+            timeout = None
+            if self._idle:
+                oldest = next(iter(self._idle.values()))
+                timeout = max(oldest + self.timeout - time.monotonic(), 0)
+            for key, _ in self._selector.select(timeout):
+                if key.fileobj is self._waker:
+                    self._register()
+                else:
+                    self._selector.unregister(key.fileobj)
+                    del self._idle[key.fileobj]
+                    self.resume(key.fileobj, key.data)
+            self._expire()
+
+    def _register(self):
+        try:
+            while self._waker.recv(RECV_SIZE):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        while self._parked:
+            connection, data = self._parked.popleft()
+            self._selector.register(connection, selectors.EVENT_READ, data)
+            self._idle[connection] = time.monotonic()
+
+    def _expire(self):
+        deadline = time.monotonic() - self.timeout
+        while self._idle:
+            connection, parked = next(iter(self._idle.items()))
+            if parked > deadline:
+                break
+            self._selector.unregister(connection)
+            del self._idle[connection]
+            connection.close()
+
+
 class Server:
-    def __init__(self, address):
+    # Seconds to wait for the client to close after being rejected
+    linger = LINGER_TIMEOUT
+    # Set in processes forked by ``Arbiter``
+    multiprocess = False
+    _serving = False
+
+    def __init__(
+            self,
+            address,
+            backlog=DEFAULT_BACKLOG,
+            threads=DEFAULT_THREADS,
+            queue_size=DEFAULT_QUEUE_SIZE,
+            block_when_full=False,
+            keepalive_timeout=DEFAULT_KEEPALIVE_TIMEOUT,
+            max_requests=DEFAULT_MAX_REQUESTS,
+            reuse_port=False,
+            max_body_size=DEFAULT_MAX_BODY_SIZE,
+    ):
         self.address = address
+        self.backlog = backlog
+        self.keepalive_timeout = keepalive_timeout
+        self.max_requests = max_requests
+        self.max_body_size = max_body_size
+        self.pool = WorkerPool(threads, queue_size, block=block_when_full)
         self.sock = sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            # Let every worker process bind its own socket, the kernel balances between them
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         # import struct; sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+        self.server_bind()
 
-    def serve_forever(self):
+    def server_bind(self):
+        """ Bind and listen, so an ephemeral port is known before serving """
         self.sock.bind(self.address)
+        self.sock.listen(self.backlog)
+        self.address = self.sock.getsockname()
+
+    def serve_forever(self):
+        self.pool.start()
+        self.poller = KeepAlivePoller(self._resume, self.keepalive_timeout)
+        self.poller.start()
+        self._serving = True
         try:
-            self.sock.listen(1)
             _logger.info(f"server listening on {self.address}")
-            while True:
-                connection, address = self.sock.accept()
+            while self._serving:
+                try:
+                    connection, address = self.sock.accept()
+                except OSError:
+                    if not self._serving:
+                        break
+                    raise
                 self.process(connection, address)
 
         finally:
             self.sock.close()
+        # Stopped on purpose, let the requests in progress finish
+        self.pool.shutdown()
+        self.poller.stop()
+
+    def shutdown(self):
+        """ Stop accepting connections, safe to call from a signal handler
+
+        ``serve_forever`` returns once the requests in progress are answered.
+        """
+        self._serving = False
+        self.sock.close()
 
     def process(self, connection, addr):
-        environ = self.parse_http(connection, addr)
-        self.handle(environ, connection)
+        self.submit(connection, self.serve_connection, connection, addr)
+
+    def submit(self, connection, func, *args):
+        """ Run ``func(*args)`` on the pool, or answer 503 on ``connection`` """
+        if not self.pool.submit(func, *args):
+            _logger.warning(f"worker queue is full, rejecting: {self.pool.stats()}")
+            self.reject(connection, '503 Service Unavailable')
+
+    def _resume(self, connection, data):
+        self.submit(connection, self.serve_connection, connection, *data)
+
+    def serve_connection(self, connection, addr, http_io=None, served=0):
+        """ Serve requests from one connection in order until it's closed
 
-    def parse_http(self, conn, addr):
+        The connection is dropped after ``keepalive_timeout`` seconds of silence,
+        after ``max_requests`` requests, or when either side asks to close it.
+        Pipelined requests simply wait in the buffer for their turn.
+        Between requests, the connection is parked on the ``KeepAlivePoller``
+        and this worker is free to serve others.
         """
+        if http_io is None:
+            connection.settimeout(self.keepalive_timeout)
+            http_io = HTTPSocketIO(connection)
+        try:
+            for served in itertools.count(served + 1):
+                try:
+                    environ = self.parse_http(connection, addr, http_io)
+                except (socket.timeout, ConnectionError):
+                    break
+                except RequestError as e:
+                    self.reject(connection, e.status)
+                    break
+                except Exception:
+                    self.reject(connection, '400 Bad Request')
+                    break
+                if environ is None:
+                    break
+                keep_alive = (
+                    self._serving
+                    and served < self.max_requests
+                    and self.should_keep_alive(environ)
+                )
+                if not self.handle(environ, connection, keep_alive):
+                    break
+                environ['wsgi.input'].drain()
+                if not http_io.buffered:
+                    self.poller.park(connection, (addr, http_io, served))
+                    return
+        except OSError:
+            pass
+        except Exception:
+            connection.close()
+            raise
+        connection.close()
+
+    def parse_http(self, conn, addr, http_io=None):
+        """ Parse the next request, return None if the peer closed instead """
+        http_io = http_io or HTTPSocketIO(conn)
+        head = http_io.read_head()
+        if not head:
+            return None
+        environ = self.request_environ(head)
+        environ['wsgi.input'] = InputStream(http_io, environ.get('CONTENT_LENGTH', 0))
+        environ['wsgi.errors'] = ErrorStream(conn)
+        return environ
+
+    def request_environ(self, head):
+        """ ``build_environ``, refusing bodies larger than ``max_body_size`` """
+        environ = self.build_environ(head)
+        if environ.get('CONTENT_LENGTH', 0) > self.max_body_size:
+            raise RequestError('413 Payload Too Large')
+        return environ
+
+    @staticmethod
+    def should_keep_alive(environ):
+        """ Persistence as requested by the client, refer to RFC 7230 section 6.3 """
+        tokens = {
+            token.strip().lower()
+            for token in environ.get('HTTP_CONNECTION', '').split(',')
+        }
+        if environ['SERVER_PROTOCOL'] == 'HTTP/1.1':
+            return 'close' not in tokens
+        return 'keep-alive' in tokens
+
+    @staticmethod
+    def build_environ(head):
+        """ Build environ from the request line and headers in ``head``
+
         Since PEP3333 states: "..., the environ dictionary MAY also contain arbitrary operating-system “environment variables”, ..."
         so skip over it.
+
+        'wsgi.input' and 'wsgi.errors' are left to the caller,
+        which knows where the body is buffered.
         """
         environ = {}
 
-        http_io = HTTPSocketIO(conn)
-
-        startline = http_io.readline().decode(ENCODING)
+        lines = LINE_END.split(head.rstrip(b'\r\n'))
+        if any(CONTROL_CHARS.search(line) for line in lines):
+            raise RequestError('400 Bad Request')
+        startline, *request_headers = [line.decode(ENCODING) for line in lines]
         startline_items = startline.split()
 
         environ['REQUEST_METHOD'] = startline_items[0]
@@ -114,29 +381,40 @@ class Server:
             environ['QUERY_STRING'] = query_string
         environ['PATH_INFO'] = path
 
-        while (request_header := http_io.readline().decode(ENCODING)) not in ('\r\n', '\n', ''):
+        for request_header in request_headers:
             key, value = [v.strip() for v in request_header.split(':', maxsplit=1)]
-            if key == 'Content-Type':
+            # Header names are case-insensitive, refer to RFC 7230 section 3.2
+            name = key.lower()
+            if name == 'content-type':
                 environ['CONTENT_TYPE'] = value
-            elif key == 'Content-Length':
-                environ['CONTENT_LENGTH'] = int(value)
-            elif key == 'Host':
+            elif name == 'content-length':
+                if not value.isdigit():
+                    raise RequestError('400 Bad Request')
+                length = int(value)
+                if environ.get('CONTENT_LENGTH', length) != length:
+                    raise RequestError('400 Bad Request')
+                environ['CONTENT_LENGTH'] = length
+            elif name == 'host':
                 host, _, port = value.partition(':')
                 environ['SERVER_NAME'] = host
                 environ['SERVER_PORT'] = port or 80     # for http only
             environ[f"HTTP_{key.upper().replace('-', '_')}"] = value
 
-        else:
-            if environ.get('SERVER_NAME', '') == '':
-                raise Exception
+        if environ.get('SERVER_NAME', '') == '':
+            raise Exception
+
+        # The end of the body must be known to find the next request on the connection,
+        # chunked bodies aren't decoded, refer to RFC 7230 section 3.3.3
+        if 'HTTP_TRANSFER_ENCODING' in environ:
+            if 'CONTENT_LENGTH' in environ:
+                raise RequestError('400 Bad Request')
+            raise RequestError('501 Not Implemented')
 
         # WSGI variables
         environ['wsgi.version'] = (1, 0)
         environ['wsgi.url_scheme'] = 'http'
 
-        environ['wsgi.input'] = InputStream(conn, environ.get('CONTENT_LENGTH', 0))
-
-        environ['wsgi.errors'] = ErrorStream(conn)
+        environ['wsgi.file_wrapper'] = FileWrapper
 
         environ['wsgi.multithread'] = True
         environ['wsgi.multiprocess'] = False
@@ -144,24 +422,50 @@ class Server:
 
         return environ
 
-    def handle(self, environ, connection):
-        t = threading.Thread(target=self._handle, args=(environ, connection))
-        t.start()
+    def reject(self, connection, status):
+        """ Answer without involving the application, then close
 
-    def _handle(self, environ, connection):
+        The request may be unread, and closing with unread input resets the connection,
+        which can discard the answer before the client reads it.
+        So stop sending first and give the client a moment to close its side.
+        """
+        try:
+            connection.sendall(
+                f"HTTP/1.1 {status}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".encode(ENCODING)
+            )
+            if self.linger:
+                connection.shutdown(socket.SHUT_WR)
+                connection.settimeout(self.linger)
+                while connection.recv(RECV_SIZE):
+                    pass
+        except OSError:
+            pass
+        connection.close()
+
+    def handle(self, environ, connection, keep_alive=False):
+        """ Run the application for one request and send its response
+
+        Return whether the connection can carry another request,
+        which needs the response length to be known up front,
+        or the body to be sent chunked to an HTTP/1.1 client.
+        """
+        environ['wsgi.multiprocess'] = self.multiprocess
         headers = []
         headers_sent = []
 
-        def write(data):
+        def send(*buffers):
             if not headers_sent:
                 status, response_headers = headers_sent[:] = headers
 
-                connection.sendall(f"HTTP/1.1 {status}\r\n".encode(ENCODING))
-                for k, v in response_headers:
-                    connection.sendall(f"{k}: {v}\r\n".encode(ENCODING))
-                connection.sendall(b"\r\n")
+                head = [f"HTTP/1.1 {status}\r\n"]
+                head.extend(f"{k}: {v}\r\n" for k, v in response_headers)
+                head.append("\r\n")
+                buffers = (''.join(head).encode(ENCODING), *buffers)
 
-            connection.sendall(data)
+            send_buffers(connection, buffers)
+
+        def write(data):
+            send(data)
 
         def start_response(status, response_headers, exc_info=None):
             if exc_info:
@@ -171,50 +475,203 @@ class Server:
                     raise exc_info[1].with_traceback(exc_info[2])
             elif headers:
                 raise AssertionError('Headers already set')
-            headers[:] = [status, [(k, v) for k, v in response_headers if k != 'Content-Length']]
+            headers[:] = [status, list(response_headers)]
             return write
 
-        result = self.app(environ, start_response)
+        try:
+            result = self.app(environ, start_response)
+        except Exception:
+            _logger.exception(f"Error handling {environ['PATH_INFO']}")
+            self.reject(connection, '500 Internal Server Error')
+            return False
         _logger.info(f"{headers[0]}")
 
-        if not headers_sent:
-            headers[1].append(('Content-Length', result.content_length))
-            headers[1].append(('Server', 'WebgoServer'))
-            headers[1].append(('Date', datetime.now().strftime('%a, %d %b %Y %H:%M:%S GMT')))
+        content_length = None
+        chunked = False
+        if headers_sent:
+            # The application wrote through ``write``, its length is unknown
+            keep_alive = False
+        else:
+            status, response_headers = headers
+            header_names = {k.lower(): v for k, v in response_headers}
+            if 'content-length' in header_names:
+                content_length = int(header_names['content-length'])
+            elif status[:3] in BODILESS_STATUS or status.startswith('1'):
+                pass
+            else:
+                content_length = getattr(result, 'content_length', None)
+                if content_length is not None:
+                    response_headers.append(('Content-Length', content_length))
+                elif environ['SERVER_PROTOCOL'] == 'HTTP/1.1' and 'transfer-encoding' not in header_names:
+                    # Pieces are framed as they come, the end of the body is marked
+                    chunked = True
+                    response_headers.append(('Transfer-Encoding', 'chunked'))
+                else:
+                    keep_alive = False
+            if header_names.get('connection', '').lower() == 'close':
+                keep_alive = False
+            response_headers[:] = [(k, v) for k, v in response_headers if k.lower() != 'connection']
+            response_headers.append(('Connection', 'keep-alive' if keep_alive else 'close'))
+            response_headers.append(('Server', 'WebgoServer'))
+            response_headers.append(('Date', datetime.now().strftime('%a, %d %b %Y %H:%M:%S GMT')))
 
         try:
-            for data in result:
-                if data:
-                    write(data)
+            if environ['REQUEST_METHOD'] == 'HEAD':
+                # The headers tell the length of the body, which isn't sent
+                if not headers_sent:
+                    send()
+            elif isinstance(result, FileWrapper) and content_length is not None:
+                send()
+                # Straight from the page cache to the socket
+                connection.sendfile(result.filelike, result.filelike.tell(), content_length)
+            else:
+                for data in result:
+                    if data:
+                        if chunked:
+                            send(b'%x\r\n' % memoryview(data).nbytes, data, b'\r\n')
+                        else:
+                            send(data)
+                if chunked:
+                    send(b'0\r\n\r\n')
+                elif not headers_sent:
+                    send()
+        except OSError:
+            raise
+        except Exception:
+            # Raised by a streamed body, the response can't be completed
+            _logger.exception(f"Error sending {environ['PATH_INFO']}")
+            if not headers_sent:
+                self.reject(connection, '500 Internal Server Error')
+            return False
         finally:
             if hasattr(result, 'close'):
                 result.close()
 
-        connection.close()
+        return keep_alive
 
     def set_app(self, app):
         self.app = app
 
 
+def send_buffers(connection, buffers):
+    """ Send ``buffers`` in order, as one gathered write where possible
+
+    Bodies are handed over as they are, never joined to the head or copied.
+    """
+    views = [memoryview(buffer).cast('B') for buffer in buffers]
+    views = [view for view in views if view.nbytes]
+    if not hasattr(connection, 'sendmsg'):
+        for view in views:
+            connection.sendall(view)
+        return
+    while views:
+        sent = connection.sendmsg(views[:MAX_IOVECS])
+        while sent:
+            if sent >= views[0].nbytes:
+                sent -= views.pop(0).nbytes
+            else:
+                views[0] = views[0][sent:]
+                sent = 0
+
+
+def find_head_end(buffer, start=0):
+    """ Return the offset just past the blank line ending the header block, or -1
+
+    A single LF is recognized as a line terminator as well,
+    refer to: https://www.rfc-editor.org/rfc/rfc2616#section-19.3
+    """
+    crlf = buffer.find(b'\r\n\r\n', start)
+    lf = buffer.find(b'\n\n', start)
+    if lf < 0 or 0 <= crlf < lf:
+        return crlf + 4 if crlf >= 0 else -1
+    return lf + 2
+
+
 class HTTPSocketIO:
-    def __init__(self, connection):
+    """ Buffered reader over a connection
+
+    Bytes arrive through large ``recv_into`` calls on a reusable buffer,
+    then the header block is split off with one scan,
+    and the body is sliced from whatever was received along with it.
+
+    The receive buffer may be shared by readers that are never filled concurrently,
+    e.g. all connections of one selector loop.
+    """
+    def __init__(self, connection, recv_buf=None):
         self._connection = connection
+        self._recv_buf = recv_buf if recv_buf is not None else bytearray(RECV_SIZE)
+        self._recv_view = memoryview(self._recv_buf)
+        self._data = bytearray()
+        self._scanned = 0
+
+    @property
+    def buffered(self):
+        return len(self._data)
+
+    def use_buffer(self, recv_buf):
+        """ Receive into ``recv_buf`` from now on """
+        self._recv_buf = recv_buf
+        self._recv_view = memoryview(recv_buf)
+
+    def fill(self):
+        """ Receive once into the buffer, return the number of bytes, 0 on EOF """
+        n = self._connection.recv_into(self._recv_buf)
+        self._data += self._recv_view[:n]
+        return n
+
+    def head_end(self):
+        """ Return the length of the buffered header block, or -1 if incomplete
+
+        Scanning resumes where the last call stopped,
+        so a slowly arriving header isn't searched from the start each time.
+        """
+        end = find_head_end(self._data, max(self._scanned - 3, 0))
+        self._scanned = len(self._data) if end < 0 else 0
+        return end
+
+    def peek(self, size):
+        return bytes(self._data[:size])
+
+    def read_head(self, max_size=MAX_HEADER_SIZE):
+        """ Return the whole header block, b'' if the peer closed before sending one """
+        while (end := self.head_end()) < 0:
+            if len(self._data) > max_size:
+                raise ValueError('Request header fields too large')
+            if not self.fill():
+                return b''
+        return self._take(end)
 
-    def readline(self):
-        line = []
-        # XXX: recognize a single LF as a line terminator and ignore the leading CR.
-        # refer to: https://www.rfc-editor.org/rfc/rfc2616#section-19.3
-        while not line\
-                or (line[-1] != b'\n' and line[-1] != b''):
-            byte_char = self._connection.recv(1)
-            line.append(byte_char)
-        return b''.join(line)
+    def readline(self, size=-1):
+        start = 0
+        while (end := self._data.find(b'\n', start)) < 0:
+            if 0 <= size <= len(self._data):
+                return self._take(size)
+            start = len(self._data)
+            if not self.fill():
+                return self._take(len(self._data))
+        end += 1
+        if 0 <= size < end:
+            end = size
+        return self._take(end)
 
     def read(self, size):
-        content = []
-        total = 0
-        while total >= size:
-            data = self._connection.recv(size)
-            content.append(data)
-            total += len(data)
-        return b''.join(content)
+        """ Read ``size`` bytes, fewer only if the peer closed
+
+        The result grows as bytes arrive, never ahead of them,
+        as ``size`` comes from a length the client declares.
+        """
+        if size <= len(self._data):
+            return self._take(size)
+        content = self._data
+        self._data = bytearray()
+        while len(content) < size:
+            n = self._connection.recv_into(self._recv_buf, min(size - len(content), len(self._recv_buf)))
+            if not n:
+                break
+            content += self._recv_view[:n]
+        return bytes(content)
+
+    def _take(self, size):
+        data = bytes(self._data[:size])
+        del self._data[:size]
+        return data
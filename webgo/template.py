@@ -1,31 +1,111 @@
 import os
+import gzip
+import logging
+import functools
+import threading
 import mimetypes
+from collections import OrderedDict
+from email.utils import formatdate
 
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
 
 from webgo import config
+from webgo.wsgirequest import Response, FileResponse, is_not_modified
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
+logger = logging.getLogger(__name__)
+
+# The Jinja environment templates are rendered with, built on first render
+# unless ``setup_templates`` is called before
 env = None
 
+# The ``AssetCache`` static files are served from, None to read them from disk
+asset_cache = None
 
-def render(request, fname: str, context) -> str:
+DEFAULT_ASSET_CACHE_SIZE = 32 * 1024 * 1024
+DEFAULT_MAX_ASSET_SIZE = 1024 * 1024
+# Smaller files don't win enough from compression to pay for the header
+MIN_COMPRESS_SIZE = 256
+COMPRESSIBLE_TYPES = {
+    'application/javascript',
+    'application/json',
+    'application/xml',
+    'image/svg+xml',
+}
+
+
+def setup_templates(path=None, auto_reload=True, bytecode_cache=None, precompile=False):
+    """ Build the environment templates are rendered with
+
+    Templates are checked for changes at each render when ``auto_reload``.
+    Without it, as in production, each one is compiled once and kept.
+    ``bytecode_cache`` is a directory the compiled templates are written to,
+    for restarted or other processes to load them rather than compile them,
+    and ``precompile`` compiles all of them now instead of at their first render.
+    """
     global env
 
+    if path is None:
+        path = os.path.join(config.project.path, 'templates')
+    if bytecode_cache is not None:
+        os.makedirs(bytecode_cache, exist_ok=True)
+        bytecode_cache = FileSystemBytecodeCache(bytecode_cache)
+    env = Environment(
+        loader=FileSystemLoader(path),
+        auto_reload=auto_reload,
+        bytecode_cache=bytecode_cache,
+        # Templates that aren't reloaded are all kept once compiled
+        cache_size=400 if auto_reload else -1,
+    )
+    if precompile:
+        precompile_templates()
+    return env
+
+
+def precompile_templates():
+    """ Compile all templates, returning their names
+
+    Done before workers are forked, they share the compiled templates.
+    """
+    names = env.list_templates()
+    for name in names:
+        env.get_template(name)
+    logger.info(f'{len(names)} templates compiled')
+    return names
+
+
+def render(request, fname: str, context) -> str:
     if not env:
-        template_path = os.path.join(config.project.path, 'templates')
-        file_loader = FileSystemLoader(template_path)
-        env = Environment(loader=file_loader)
+        setup_templates()
 
     template = env.get_template(fname)
     output = template.render(context)
     return output
 
 
+def stream(request, fname: str, context, buffer_size=5):
+    """ Render a template piece by piece, as the response sends them
+
+    The first bytes leave before the rest of the page is rendered.
+    ``buffer_size`` pieces are put together before being sent.
+    """
+    if not env:
+        setup_templates()
+
+    output = env.get_template(fname).stream(context)
+    if buffer_size > 1:
+        output.enable_buffering(buffer_size)
+    return output
+
+
 def _get_static_content(fpath):
-    with open(fpath) as fp:
-        text = fp.read()
-    return text
+    with open(fpath, 'rb') as fp:
+        content = fp.read()
+    return content
 
 # def staticfile(path):
 #     return lambda func: StaticFile(func, path)
@@ -38,7 +118,179 @@ class StaticFile:
         self.mimetype, self.encoding = mimetypes.guess_type(self.fpath)
 
     def response_attached(self, request):
-        return _get_static_content(self.fpath)
+        # Ranges are cut from the file, the cache only holds whole bodies
+        if asset_cache is not None and request.get_header('Range') is None:
+            asset = asset_cache.get(self.fpath)
+            if asset is not None:
+                return AssetResponse(asset, request)
+        return FileResponse(self.fpath, request, content_type=self.mimetype)
+
+
+class Asset:
+    """ A static file held in memory, with its compressed variants """
+    __slots__ = ('path', 'mtime_ns', 'length', 'mtime', 'content_type', 'variants')
+
+    def __init__(self, path, content, st):
+        self.path = path
+        self.mtime_ns = st.st_mtime_ns
+        self.length = st.st_size
+        self.mtime = int(st.st_mtime)
+        self.content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.variants = {'identity': content}
+
+    def compress(self, use_brotli=True):
+        """ Keep the gzip, and brotli if available, variants smaller than the file """
+        content = self.variants['identity']
+        if len(content) < MIN_COMPRESS_SIZE or not _compressible(self.content_type):
+            return
+        # mtime=0 so the gzip bytes only depend on the content
+        compressed = {'gzip': gzip.compress(content, compresslevel=9, mtime=0)}
+        if use_brotli and brotli is not None:
+            compressed['br'] = brotli.compress(content)
+        for encoding, data in compressed.items():
+            if len(data) < len(content):
+                self.variants[encoding] = data
+
+    @property
+    def size(self):
+        return sum(len(data) for data in self.variants.values())
+
+    def etag(self, encoding='identity'):
+        # Same as FileResponse for the identity, so both validate each other
+        tag = f'{self.mtime_ns:x}-{self.length:x}'
+        return f'"{tag}"' if encoding == 'identity' else f'"{tag}-{encoding}"'
+
+    def negotiate(self, accept_encoding):
+        """ The variant to send for an Accept-Encoding header """
+        if accept_encoding and len(self.variants) > 1:
+            accepted = _parse_accept_encoding(accept_encoding)
+            for encoding in ('br', 'gzip'):
+                if encoding in self.variants and accepted.get(encoding, accepted.get('*', 0)) > 0:
+                    return encoding
+        return 'identity'
+
+
+@functools.lru_cache(maxsize=64)
+def _parse_accept_encoding(header):
+    accepted = {}
+    for item in header.split(','):
+        coding, _, params = item.partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    return accepted
+
+
+def _compressible(content_type):
+    return content_type.startswith('text/') or content_type in COMPRESSIBLE_TYPES
+
+
+class AssetResponse(Response):
+    """ Response of a cached ``Asset``, in the encoding the client accepts """
+    def __init__(self, asset, request):
+        encoding = asset.negotiate(request.get_header('Accept-Encoding'))
+        self.etag = asset.etag(encoding)
+        headers = [
+            ('ETag', self.etag),
+            ('Last-Modified', formatdate(asset.mtime, usegmt=True)),
+            ('Accept-Ranges', 'bytes'),
+        ]
+        if len(asset.variants) > 1:
+            headers.append(('Vary', 'Accept-Encoding'))
+        if encoding != 'identity':
+            headers.append(('Content-Encoding', encoding))
+
+        if is_not_modified(request, self.etag, asset.mtime):
+            status, body = '304 Not Modified', b''
+        else:
+            status, body = '200 OK', asset.variants[encoding]
+            headers.append(('Content-Length', len(body)))
+        super().__init__(body=body, content_type=asset.content_type, status=status, headers=headers)
+
+
+class AssetCache:
+    """ Static files kept in memory, least recently used evicted first
+
+    Files up to ``max_file_size`` are read once, along with gzip (and brotli,
+    if the package is installed) variants, so serving them costs neither
+    disk reads nor compression. ``max_size`` bounds the bytes held,
+    variants included.
+
+    A file is looked up by path and checked against its mtime and size
+    on every hit, a file changed on disk is loaded again.
+    """
+    def __init__(self, max_size=DEFAULT_ASSET_CACHE_SIZE, max_file_size=DEFAULT_MAX_ASSET_SIZE, use_brotli=True):
+        self.max_size = max_size
+        self.max_file_size = max_file_size
+        self.use_brotli = use_brotli
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._assets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """ Return the ``Asset`` of ``path``, None if it's too large to be cached """
+        st = os.stat(path)
+        with self._lock:
+            asset = self._assets.get(path)
+            if asset is not None and asset.mtime_ns == st.st_mtime_ns and asset.length == st.st_size:
+                self._assets.move_to_end(path)
+                self.hits += 1
+                return asset
+            self.misses += 1
+        if st.st_size > self.max_file_size:
+            return None
+
+        # Read and compressed out of the lock, a concurrent load only costs twice
+        asset = Asset(path, _get_static_content(path), st)
+        asset.compress(self.use_brotli)
+        with self._lock:
+            self._discard(path)
+            if asset.size <= self.max_size:
+                self._assets[path] = asset
+                self.size += asset.size
+                while self.size > self.max_size:
+                    self._discard(next(iter(self._assets)))
+        return asset
+
+    def preload(self, paths):
+        """ Load ``paths`` until the cache is full, the rest stays on disk """
+        for path in paths:
+            if self.size >= self.max_size:
+                break
+            try:
+                self.get(path)
+            except OSError:
+                continue
+
+    def _discard(self, path):
+        asset = self._assets.pop(path, None)
+        if asset is not None:
+            self.size -= asset.size
+
+    def clear(self):
+        with self._lock:
+            self._assets.clear()
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'files': len(self._assets),
+                'size': self.size,
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+    def __contains__(self, path):
+        return path in self._assets
 
 
 def get_abs_path(path):
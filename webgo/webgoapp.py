@@ -1,11 +1,18 @@
+import io
 import os
+import asyncio
+import functools
+import contextvars
 import importlib
 import inspect
 import logging
 
+from webgo import template
 from webgo.template import StaticFile
 from webgo import orm
-from webgo.wsgirequest import Request, Response
+from webgo.exceptions import NotFound, MethodNotAllowed
+from webgo.routing import Router
+from webgo.wsgirequest import Request, Response, FileResponse, BLOCK_SIZE
 
 logger = logging.getLogger(__name__)
 
@@ -15,16 +22,45 @@ class Application:
     def __init__(self, package: str):
         self.handlers = route_mapping(package)
 
+    def find_handler(self, request):
+        """ Return the handler and the parameters parsed from the path """
+        return self.handlers.match(request.method, request.path)
+
     def build_response(self, request):
-        path = request.path
-        handlers = self.handlers[request.method]
-        if path not in handlers:
-            return Response(body='Not Found')
-        handler = handlers[path]
-        if hasattr(handler.__self__, 'mimetype'):
+        try:
+            handler, params = self.find_handler(request)
+        except (NotFound, MethodNotAllowed) as e:
+            return self.error_response(e)
+        with orm.identity_map():
+            body = handler(request, **params)
+            if inspect.isawaitable(body):
+                # An ``async def`` handler served by a WSGI server
+                body = asyncio.run(body)
+        return self.attach_response(handler, body)
+
+    @staticmethod
+    def error_response(exc):
+        if isinstance(exc, MethodNotAllowed):
+            return Response(
+                body='Method Not Allowed',
+                status='405 Method Not Allowed',
+                headers=[('Allow', ', '.join(exc.allowed))],
+            )
+        return Response(body='Not Found', status='404 Not Found')
+
+    @staticmethod
+    def attach_response(handler, body):
+        if isinstance(body, Response):
+            rep = body
+        elif hasattr(handler.__self__, 'mimetype'):
             mime_type = handler.__self__.mimetype
-            return Response(body=handler(request), content_type=mime_type)
-        return Response(body=handler(request))
+            rep = Response(body=body, content_type=mime_type)
+        else:
+            rep = Response(body=body)
+        cache = getattr(handler.__self__, 'cache', None)
+        if cache is not None and not any(k.lower() == 'cache-control' for k, _ in rep.headers):
+            rep.add_header('Cache-Control', f'max-age={cache}' if cache else 'no-cache')
+        return rep
 
     def response(self, request):
         return self.build_response(request)
@@ -35,17 +71,111 @@ class Application:
     def __call__(self, environ, start_response):
         rep = self.response(Request(environ))
         start_response(rep.status, rep.headers)
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if file_wrapper is not None and isinstance(rep, FileResponse) and rep.length:
+            return file_wrapper(rep.open(), BLOCK_SIZE)
         return rep
 
 
-def route_mapping(upackage: str) -> dict:
+class AsgiApplication(Application):
+    """ Create an ASGI application
+
+    ``async def`` handlers are awaited on the event loop,
+    the others are run by the loop's executor so they don't block it.
+    """
+    def __init__(self, package: str, executor=None):
+        super().__init__(package)
+        self.executor = executor
+
+    async def build_response_async(self, request):
+        try:
+            handler, params = self.find_handler(request)
+        except (NotFound, MethodNotAllowed) as e:
+            return self.error_response(e)
+        with orm.identity_map():
+            if getattr(handler.__self__, 'is_async', False):
+                body = await handler(request, **params)
+            else:
+                # The executor's threads don't inherit the context, hence the identity map
+                loop = asyncio.get_running_loop()
+                body = await loop.run_in_executor(
+                    self.executor,
+                    contextvars.copy_context().run,
+                    functools.partial(handler, request, **params),
+                )
+        return self.attach_response(handler, body)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            while (message := await receive())['type'] != 'lifespan.shutdown':
+                await send({'type': 'lifespan.startup.complete'})
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            chunks.append(message.get('body', b''))
+            more_body = message.get('more_body', False)
+
+        rep = await self.build_response_async(Request(_scope_to_environ(scope, b''.join(chunks))))
+        headers = [
+            (k.encode('iso-8859-1'), str(v).encode('iso-8859-1'))
+            for k, v in rep.headers if k.lower() != 'content-length'
+        ]
+        start = {
+            'type': 'http.response.start',
+            'status': int(rep.status.split()[0]),
+            'headers': headers,
+        }
+        if rep.content_length is not None:
+            headers.append((b'content-length', str(rep.content_length).encode('iso-8859-1')))
+            if not isinstance(rep, FileResponse):
+                # In memory already
+                await send(start)
+                await send({'type': 'http.response.body', 'body': b''.join(rep)})
+                return
+
+        # Streamed, or read from disk, each piece is produced by the executor
+        # as bodies may query the database and reads would block the loop
+        await send(start)
+        loop = asyncio.get_running_loop()
+        pieces = iter(rep)
+        try:
+            while (data := await loop.run_in_executor(self.executor, next, pieces, None)) is not None:
+                await send({'type': 'http.response.body', 'body': data, 'more_body': True})
+        finally:
+            rep.close()
+        await send({'type': 'http.response.body', 'body': b''})
+
+
+def _scope_to_environ(scope, body):
+    """ The part of a WSGI environ that ``Request`` reads, from an ASGI scope """
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope.get('query_string', b'').decode('iso-8859-1'),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'CONTENT_LENGTH': len(body),
+        'wsgi.input': io.BytesIO(body),
+    }
+    for name, value in scope.get('headers', []):
+        key = name.decode('iso-8859-1').upper().replace('-', '_')
+        value = value.decode('iso-8859-1')
+        if key == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        environ[f'HTTP_{key}'] = value
+    return environ
+
+
+def route_mapping(upackage: str) -> Router:
 
     logger.debug('mapping route to object')
 
-    handlers = {
-        'GET': {},
-        'POST': {},
-        }
+    router = Router()
     package = _import(upackage)
 
     # Generate all tables mapped by models
@@ -56,12 +186,13 @@ def route_mapping(upackage: str) -> dict:
             continue
         for obj in module.__dict__.values():
             if hasattr(obj, 'response_attached'):
-                handlers[obj.method][obj.path] = obj.response_attached
+                router.add(obj.method, obj.path, obj.response_attached)
 
     # root_path = os.path.dirname(package.__file__)
     root_path = package.__path__[0]
-    handlers['GET'].update(staticfile_route_mapping(root_path))
-    return handlers
+    for path, handler in staticfile_route_mapping(root_path).items():
+        router.add('GET', path, handler)
+    return router
 
 
 def staticfile_route_mapping(root_path):
@@ -103,6 +234,9 @@ def staticfile_route_mapping(root_path):
     static_files_path = res = []
     _get_static(res)
 
+    if template.asset_cache is not None:
+        template.asset_cache.preload(static_files_path)
+
     handlers = {}
     for path in static_files_path:
         handlers[path[len(root_path):]] = StaticFile(path).response_attached
@@ -112,6 +246,3 @@ def staticfile_route_mapping(root_path):
 def _import(module_name):
     return importlib.import_module(module_name)
 
-
-class NotFound(Exception):
-    """ not yet implemented"""
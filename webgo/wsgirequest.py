@@ -1,4 +1,16 @@
+import os
 import json
+from http import HTTPStatus
+from email.utils import formatdate, parsedate_to_datetime
+
+BLOCK_SIZE = 64 * 1024
+
+DEFAULT_CHARSET = 'utf-8'
+BYTES_TYPES = (bytes, bytearray, memoryview)
+# Declared with a charset, besides text/*
+TEXT_TYPES = {'application/json', 'application/javascript', 'application/xml'}
+# Responses that never have a body, refer to RFC 7230 section 3.3.3
+BODILESS_STATUS = ('204', '304')
 
 
 class Request:
@@ -12,13 +24,14 @@ class Request:
 
     @property
     def buffer(self):
-        content_length = int(self._environ['CONTENT_LENGTH'])
+        content_length = int(self._environ.get('CONTENT_LENGTH') or 0)
         if not self._buffer:
             stream = self._environ['wsgi.input']
-            while content_length > 0:
-                c = stream.read(1)
-                self._buffer += c
-                content_length -= 1
+            chunks = []
+            while content_length > 0 and (chunk := stream.read(content_length)):
+                chunks.append(chunk)
+                content_length -= len(chunk)
+            self._buffer = b''.join(chunks)
         return self._buffer
 
     @property
@@ -35,6 +48,14 @@ class Request:
 
         return res
 
+    @property
+    def environ(self):
+        return self._environ
+
+    def get_header(self, name, default=None):
+        """ Return the request header ``name``, e.g. 'If-None-Match' """
+        return self._environ.get(f"HTTP_{name.upper().replace('-', '_')}", default)
+
     @property
     def path(self):
         return self._environ['PATH_INFO']
@@ -45,23 +66,207 @@ class Request:
 
 
 class Response:
-    def __init__(self, body=None, content_type='text/html'):
+    """ Response of a handler
+
+    ``body`` is bytes (or any bytes-like object, memoryview included), str,
+    or an iterable of them, such as a generator or ``template.stream``,
+    whose pieces are sent as they're produced.
+    The length of such a body isn't known, servers send it chunked.
+
+    Text is encoded in ``charset``, declared in the Content-Type.
+    A str body is encoded once, its length is then known before it's sent,
+    and the same buffer is handed to the server.
+
+    ``status`` is an int or the full status line, ``headers`` a list
+    of (name, value) pairs or a dict.
+
+        >>> Response('created', content_type='text/plain', status=201, headers={'Location': '/user/1'})
+    """
+    def __init__(self, body=None, content_type='text/html', status='200 OK', headers=None, charset=DEFAULT_CHARSET):
         self.body = body
         self.content_type = content_type
+        self.charset = charset
+        if isinstance(status, int):
+            status = f'{status} {HTTPStatus(status).phrase}'
+        self._status = status
+        self._headers = list(headers.items()) if isinstance(headers, dict) else list(headers or ())
+        self._buffer = None
 
     @property
     def status(self):
-        return '200 OK'
+        return self._status
+
+    @property
+    def streamed(self):
+        return self.body is not None and not isinstance(self.body, (str, *BYTES_TYPES))
+
+    @property
+    def buffer(self):
+        """ The encoded body, None when it's streamed """
+        if self._buffer is None and not self.streamed:
+            body = b'' if self.body is None else self.body
+            if isinstance(body, str):
+                body = body.encode(self.charset)
+            elif isinstance(body, memoryview):
+                body = body.cast('B')
+            self._buffer = body
+        return self._buffer
 
     @property
     def content_length(self):
-        return len(self.body)
+        return None if self.streamed else len(self.buffer)
 
     @property
     def headers(self):
-        return [
-            ('Content-type', self.content_type),
+        content_type = self.content_type
+        if self._encodes_text and 'charset=' not in content_type:
+            content_type = f'{content_type}; charset={self.charset}'
+        headers = [('Content-type', content_type), *self._headers]
+        if self.content_length is not None and self._status[:3] not in BODILESS_STATUS \
+                and not any(k.lower() == 'content-length' for k, _ in self._headers):
+            headers.append(('Content-Length', str(self.content_length)))
+        return headers
+
+    @property
+    def _encodes_text(self):
+        if not (isinstance(self.body, str) or self.streamed):
+            return False
+        content_type = self.content_type.partition(';')[0].strip()
+        return content_type.startswith('text/') or content_type in TEXT_TYPES \
+            or content_type.endswith(('+xml', '+json'))
+
+    def add_header(self, name, value):
+        self._headers.append((name, value))
+
+    def __iter__(self):
+        if not self.streamed:
+            if self.buffer:
+                yield self.buffer
+            return
+        for chunk in self.body:
+            if isinstance(chunk, str):
+                chunk = chunk.encode(self.charset)
+            if chunk:
+                yield chunk
+
+    def close(self):
+        """ Stop a streamed body, called by the server when it's done with the response """
+        if hasattr(self.body, 'close'):
+            self.body.close()
+
+
+def is_not_modified(request, etag, mtime):
+    """ Whether the validators of ``request`` match ``etag`` or ``mtime`` """
+    if_none_match = request.get_header('If-None-Match')
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        # Weak comparison, refer to RFC 7232 section 3.2
+        tags = [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+        return '*' in tags or etag in tags
+    if_modified_since = request.get_header('If-Modified-Since')
+    if if_modified_since is not None:
+        try:
+            return mtime <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+class FileResponse(Response):
+    """ Response of a file on disk
+
+    Carries ETag and Last-Modified, answers conditional requests with 304
+    and a single byte range with 206.
+
+    The file isn't read here, ``open`` hands it over positioned at the range,
+    so servers providing 'wsgi.file_wrapper' can send it with sendfile.
+    """
+    def __init__(self, path, request=None, content_type=None):
+        st = os.stat(path)
+        self.path = path
+        self.size = st.st_size
+        self.mtime = int(st.st_mtime)
+        self.etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+        self.offset = 0
+        self.length = st.st_size
+
+        status = '200 OK'
+        headers = [
+            ('ETag', self.etag),
+            ('Last-Modified', formatdate(self.mtime, usegmt=True)),
+            ('Accept-Ranges', 'bytes'),
         ]
+        if request is not None:
+            if self._not_modified(request):
+                status = '304 Not Modified'
+                self.length = None
+            elif (byte_range := self._byte_range(request)) is not None:
+                if byte_range is False:
+                    status = '416 Range Not Satisfiable'
+                    headers.append(('Content-Range', f'bytes */{self.size}'))
+                    self.length = 0
+                else:
+                    status = '206 Partial Content'
+                    self.offset, end = byte_range
+                    self.length = end - self.offset + 1
+                    headers.append(('Content-Range', f'bytes {self.offset}-{end}/{self.size}'))
+        if self.length is not None:
+            headers.append(('Content-Length', self.length))
+
+        super().__init__(
+            content_type=content_type or 'application/octet-stream',
+            status=status,
+            headers=headers,
+        )
+
+    def _not_modified(self, request):
+        return is_not_modified(request, self.etag, self.mtime)
+
+    def _byte_range(self, request):
+        """ Return (first, last) byte of the requested range,
+        None to send the whole file, or False if it can't be satisfied
+        """
+        range_header = request.get_header('Range')
+        if not range_header or not range_header.startswith('bytes='):
+            return None
+        if_range = request.get_header('If-Range')
+        if if_range is not None and if_range != self.etag \
+                and if_range != formatdate(self.mtime, usegmt=True):
+            return None
+        spec = range_header[len('bytes='):]
+        if ',' in spec:
+            # Multiple ranges need a multipart body, the whole file is fine as well
+            return None
+        first, _, last = spec.strip().partition('-')
+        try:
+            if not first:
+                suffix = int(last)
+                if suffix <= 0:
+                    return False
+                return max(self.size - suffix, 0), self.size - 1
+            first = int(first)
+            last = int(last) if last else self.size - 1
+        except ValueError:
+            return None
+        if first >= self.size or last < first:
+            return False
+        return first, min(last, self.size - 1)
+
+    @property
+    def content_length(self):
+        return self.length
+
+    def open(self):
+        """ Return the file, positioned at the first byte to send """
+        file = open(self.path, 'rb')
+        file.seek(self.offset)
+        return file
 
     def __iter__(self):
-        yield self.body.encode('iso-8859-1')
+        if not self.length:
+            return
+        with self.open() as file:
+            remains = self.length
+            while remains > 0 and (data := file.read(min(BLOCK_SIZE, remains))):
+                remains -= len(data)
+                yield data
@@ -3,43 +3,133 @@ import sys
 import types
 import logging
 import argparse
+import functools
 from importlib.abc import Loader, MetaPathFinder
 from importlib.util import spec_from_file_location
 
 from webgo import config
+from webgo import orm
+from webgo import middleware
 from webgo import webgoapp
+from webgo import template
 from webgo.template import get_abs_path
-from webgo.servers import Server
+from webgo.servers import Server, SelectorServer, AsyncServer, Arbiter
+from webgo.servers.server import DEFAULT_BACKLOG, DEFAULT_KEEPALIVE_TIMEOUT, DEFAULT_MAX_REQUESTS, DEFAULT_MAX_BODY_SIZE
+from webgo.servers.pool import DEFAULT_THREADS, DEFAULT_QUEUE_SIZE
+from webgo.servers.prefork import DEFAULT_GRACEFUL_TIMEOUT
 
 logger = logging.getLogger(__name__)
 
+SERVERS = {
+    'thread': Server,
+    'selector': SelectorServer,
+    'asyncio': AsyncServer,
+}
+
 
 def serving(Application=webgoapp.Application):
-    PROJECT_PATH = parse_command_argument()
+    args = parse_command_argument()
+    PROJECT_PATH = get_abs_path(args.project)
     config.project = config.ProjectParse(PROJECT_PATH)
 
     sys.meta_path.append(WebgoMetaPathFinder())
 
-    app = Application(config.project.pkg_name)
+    if args.migrate:
+        migrate(config.project.pkg_name, dry_run=args.dry_run)
+        sys.exit()
+
+    production = args.templates == 'production'
+    if production and args.template_cache is None:
+        args.template_cache = os.path.join(PROJECT_PATH, '__pycache__', 'templates')
+    if production or args.template_cache or args.precompile_templates:
+        # Before workers are forked, so that they share the compiled templates
+        template.setup_templates(
+            auto_reload=not production,
+            bytecode_cache=args.template_cache,
+            precompile=args.precompile_templates,
+        )
+
+    if args.asset_cache:
+        template.asset_cache = template.AssetCache(args.asset_cache * 1024 * 1024)
+
+    if args.server == 'asyncio':
+        app = webgoapp.AsgiApplication(config.project.pkg_name)
+        app = AsgiReload(app, config.project.path)
+    else:
+        app = Application(config.project.pkg_name)
+
+        # Reload file if file modified
+        app = Reload(app, config.project.path)
 
-    # Reload file if file modified
-    app = Reload(app, config.project.path)
+        if args.compress:
+            # Inside the cache, which then keeps the compressed responses
+            app = middleware.Compress(app, level=args.compress_level)
+
+        if args.response_cache:
+            size = args.response_cache * 1024 * 1024
+            if args.cache_db:
+                backend = middleware.SQLiteCacheBackend(args.cache_db, size)
+            else:
+                backend = middleware.MemoryCacheBackend(size)
+            app = middleware.ResponseCache(app, backend, ttl=args.cache_ttl)
 
     logger.info(f'Serving {config.project.pkg_name} ... ')
 
-    run_server(app)
+    options = dict(
+        server_class=SERVERS[args.server],
+        backlog=args.backlog,
+        threads=args.threads,
+        queue_size=args.queue_size,
+        block_when_full=args.when_full == 'wait',
+        keepalive_timeout=args.keepalive_timeout,
+        max_requests=args.max_requests,
+        max_body_size=args.max_body_size * 1024 * 1024,
+    )
+    if args.workers > 1:
+        run_prefork(
+            app,
+            workers=args.workers,
+            reuse_port=args.reuse_port,
+            graceful_timeout=args.graceful_timeout,
+            **options
+        )
+    else:
+        run_server(app, **options)
+
+
+def migrate(package, dry_run=False):
+    """ Alter the tables of the project's models to match them """
+    # Importing the project defines its models
+    webgoapp._import(package)
+    statements = orm.Model.migrate(dry_run=dry_run)
+    if dry_run:
+        for sql in statements:
+            print(f'{sql};')
+    logger.info(f'{len(statements)} migration statements {"to run" if dry_run else "run"}')
+
 
+def run_server(app, **kwargs):
+    make_server('', 8080, app, **kwargs).serve_forever()
 
-def run_server(app):
-    make_server('', 8080, app).serve_forever()
+
+def run_prefork(app, workers, reuse_port=False, graceful_timeout=DEFAULT_GRACEFUL_TIMEOUT, **kwargs):
+    """ Serve from ``workers`` forked processes sharing the port """
+    Arbiter(
+        functools.partial(make_server, '', 8080, app, reuse_port=reuse_port, **kwargs),
+        workers,
+        reuse_port=reuse_port,
+        graceful_timeout=graceful_timeout,
+    ).run()
 
 
 def make_server(
         host,
         port,
-        app
+        app,
+        server_class=Server,
+        **kwargs
 ):
-    httpd = Server((host, port))
+    httpd = server_class((host, port), **kwargs)
     httpd.set_app(app)
     return httpd
 
@@ -76,16 +166,71 @@ class WebgoLoader(Loader):
 def parse_command_argument():
     parser = argparse.ArgumentParser()
     parser.add_argument('project', help='your project')
-    parser.add_argument('--migrate', help='migrate your model')
+    parser.add_argument('--migrate', action='store_true',
+                        help='alter the tables to match the models, then exit')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='with --migrate, print the statements without running them')
+    parser.add_argument('--server', choices=SERVERS, default='thread',
+                        help='connection engine: a thread per request, '
+                             'a selector loop multiplexing connections, '
+                             'or an asyncio loop running the application as ASGI')
+    parser.add_argument('--backlog', type=int, default=DEFAULT_BACKLOG,
+                        help='size of the listen queue')
+    parser.add_argument('--threads', type=int, default=DEFAULT_THREADS,
+                        help='number of worker threads handling requests')
+    parser.add_argument('--queue-size', type=int, default=DEFAULT_QUEUE_SIZE,
+                        help='number of requests allowed to wait for a thread')
+    parser.add_argument('--when-full', choices=('reject', 'wait'), default='reject',
+                        help='answer 503 or wait when the request queue is full')
+    parser.add_argument('--keepalive-timeout', type=float, default=DEFAULT_KEEPALIVE_TIMEOUT,
+                        help='seconds an idle persistent connection is kept open')
+    parser.add_argument('--max-requests', type=int, default=DEFAULT_MAX_REQUESTS,
+                        help='requests served on one connection before closing it')
+    parser.add_argument('--max-body-size', type=int, default=DEFAULT_MAX_BODY_SIZE // (1024 * 1024), metavar='MB',
+                        help='megabytes a request body may take, larger ones are answered 413')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of forked worker processes')
+    parser.add_argument('--reuse-port', action='store_true',
+                        help='let each worker bind its own socket with SO_REUSEPORT')
+    parser.add_argument('--graceful-timeout', type=float, default=DEFAULT_GRACEFUL_TIMEOUT,
+                        help='seconds workers get to finish requests on SIGTERM')
+    parser.add_argument('--asset-cache', type=int, default=0, metavar='MB',
+                        help='megabytes of static files kept in memory with their '
+                             'compressed variants, 0 to read them from disk')
+    parser.add_argument('--templates', choices=('reload', 'production'), default='reload',
+                        help='recompile templates when they change, '
+                             'or compile them once and cache their bytecode on disk')
+    parser.add_argument('--template-cache', metavar='DIR',
+                        help='directory of the templates bytecode cache, '
+                             'in production __pycache__/templates of the project by default')
+    parser.add_argument('--precompile-templates', action='store_true',
+                        help='compile all templates at startup rather than at their first render')
+    parser.add_argument('--response-cache', type=int, default=0, metavar='MB',
+                        help='megabytes of responses kept and answered without '
+                             'calling handlers again, 0 to disable')
+    parser.add_argument('--cache-ttl', type=int, default=0, metavar='SECONDS',
+                        help='seconds responses without a Cache-Control max-age are cached for')
+    parser.add_argument('--cache-db', metavar='FILE',
+                        help='keep the cached responses in a SQLite file shared by the workers')
+    parser.add_argument('--compress', action='store_true',
+                        help='compress textual responses in the encoding the client accepts')
+    parser.add_argument('--compress-level', type=int, default=middleware.DEFAULT_COMPRESS_LEVEL,
+                        choices=range(1, 10), metavar='1-9',
+                        help='compression level, faster to smaller')
     args = parser.parse_args()
-
-    # if args.migrate:
-        # The operation is somewhat funny!
-        # _load_module(get_abs_path(args.project))
-        # orm.Model.create_table(args.migrate)
-        # sys.exit()
-
-    return get_abs_path(args.project)
+    if args.server == 'asyncio':
+        # Middlewares of WSGI applications, the ASGI one can't be wrapped in them
+        wsgi_only = [
+            flag for flag, value in (
+                ('--response-cache', args.response_cache),
+                ('--cache-ttl', args.cache_ttl),
+                ('--cache-db', args.cache_db),
+                ('--compress', args.compress),
+            ) if value
+        ]
+        if wsgi_only:
+            parser.error(f"{', '.join(wsgi_only)} can't be used with --server asyncio")
+    return args
 
 
 class Reload:
@@ -95,10 +240,21 @@ class Reload:
         self.project = project_path
         self.mtime = os.path.getctime(project_path)
 
-    def __call__(self, environ, start_response):
+    def reload(self):
+        """ Build the application again if the project changed """
         mtime_now = os.path.getctime(self.project)
         if mtime_now != self.mtime:
             logger.info(f'Reloading {self.project} ... ')
             self.app.__init__(config.project.pkg_name)
             self.mtime = mtime_now
+
+    def __call__(self, environ, start_response):
+        self.reload()
         return self.app(environ, start_response)
+
+
+class AsgiReload(Reload):
+    """ Module-reload Middleware of the ASGI application """
+    async def __call__(self, scope, receive, send):
+        self.reload()
+        await self.app(scope, receive, send)